@@ -0,0 +1,155 @@
+"""Deleting accounts in bounded batches.
+
+Deleting a user through the ORM loads every message, follow and like of
+theirs first. Instead, `delete_user()` marks the user deleted
+(`User.deleted_at`: they can't log in and their profile is gone) and
+queues a 'purge_user' job, which calls `purge_step()` until it is done.
+
+Each step removes at most `batch_size` rows of one kind with set-based
+statements, after fixing the counters of the other users and messages
+they counted for, so no transaction holds locks for long however big the
+account. The child rows are deleted explicitly rather than left to the
+`ondelete='CASCADE'` foreign keys, so each statement stays bounded and
+SQLite (which doesn't enforce them by default) ends up the same. The
+user row goes last.
+"""
+
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from counters import adjust
+from models import db, FollowersFollowee, Like, Message, User
+from tags import Mention, MessageTag
+from timelines import TimelineEntry
+
+
+def mark_deleted(user_id):
+    """Hide a user until they are purged; the caller commits."""
+
+    (User.query
+     .filter_by(id=user_id)
+     .update({User.deleted_at: datetime.utcnow()},
+             synchronize_session=False))
+
+
+def _purge_messages(user_id, batch_size, timelines):
+    message_ids = [row.id for row in (db.session.query(Message.id)
+                                      .filter(Message.user_id == user_id)
+                                      .order_by(Message.id)
+                                      .limit(batch_size))]
+    if not message_ids:
+        return None
+
+    # people who liked these messages lose those likes
+    likes = Like.__table__
+    users = User.__table__
+    liked = (select([func.count()])
+             .where(likes.c.user_id == users.c.id)
+             .where(likes.c.message_id.in_(message_ids))
+             .as_scalar())
+    liker_ids = {row.user_id for row in (db.session.query(Like.user_id)
+                                         .filter(Like.message_id
+                                                 .in_(message_ids))
+                                         .distinct())}
+    if liker_ids:
+        db.session.execute(users.update()
+                           .where(users.c.id.in_(liker_ids))
+                           .values(likes_count=users.c.likes_count - liked))
+
+    for model in (Like, TimelineEntry, MessageTag, Mention):
+        (model.query
+         .filter(model.message_id.in_(message_ids))
+         .delete(synchronize_session=False))
+
+    (Message.query
+     .filter(Message.id.in_(message_ids))
+     .delete(synchronize_session=False))
+
+    return liker_ids, set(message_ids)
+
+
+def _purge_likes(user_id, batch_size, timelines):
+    likes = (db.session.query(Like.id, Like.message_id)
+             .filter(Like.user_id == user_id)
+             .limit(batch_size)
+             .all())
+    if not likes:
+        return None
+
+    # the messages they liked lose a like (or more, for duplicate likes)
+    by_count = {}
+    counts = Counter(like.message_id for like in likes)
+    for message_id, count in counts.items():
+        by_count.setdefault(count, []).append(message_id)
+    for count, message_ids in by_count.items():
+        adjust(Message, message_ids, likes_count=-count)
+
+    (Like.query
+     .filter(Like.id.in_([like.id for like in likes]))
+     .delete(synchronize_session=False))
+
+    return set(), set(counts)
+
+
+def _purge_follows(user_id, batch_size, timelines):
+    # the columns read backwards, see FollowersFollowee
+    for own, other, counter in [
+            # users they follow lose a follower
+            ('followee_id', 'follower_id', 'followers_count'),
+            # users following them follow one fewer
+            ('follower_id', 'followee_id', 'following_count')]:
+        own = getattr(FollowersFollowee, own)
+        other = getattr(FollowersFollowee, other)
+
+        other_ids = [row[0] for row in (db.session.query(other)
+                                        .filter(own == user_id)
+                                        .limit(batch_size))]
+        if other_ids:
+            adjust(User, other_ids, **{counter: -1})
+            if counter == 'followers_count':
+                timelines.followers_changed(other_ids, -1)
+            (FollowersFollowee.query
+             .filter(own == user_id, other.in_(other_ids))
+             .delete(synchronize_session=False))
+            return set(other_ids), set()
+
+    return None
+
+
+def _purge_mentions(user_id, batch_size, timelines):
+    message_ids = [row.message_id for row in (
+        db.session.query(Mention.message_id)
+        .filter(Mention.user_id == user_id)
+        .limit(batch_size))]
+    if not message_ids:
+        return None
+
+    (Mention.query
+     .filter(Mention.user_id == user_id, Mention.message_id.in_(message_ids))
+     .delete(synchronize_session=False))
+
+    return set(), set()
+
+
+def purge_step(user_id, batch_size, timelines):
+    """Remove the next batch of what `user_id` left behind.
+
+    Returns (done, user ids, message ids): the users and messages whose
+    counters changed or which are gone, for cache invalidation. The caller
+    commits. Dropped follows go through `timelines` too (see
+    `TimelineStore.followers_changed()`). Once everything else is gone the
+    user row is deleted, along with their timeline, and `done` is True.
+    """
+
+    for purge in (_purge_messages, _purge_likes, _purge_follows,
+                  _purge_mentions):
+        changed = purge(user_id, batch_size, timelines)
+        if changed is not None:
+            return (False, *changed)
+
+    timelines.drop_user(user_id)
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+
+    return True, {user_id}, set()
@@ -0,0 +1,86 @@
+"""JSON API helpers: compact serialization and request parsing.
+
+The /api/v1 routes live in app.py next to the HTML routes they mirror and
+share the same write paths. Responses are compact: every message refers
+to its author by id, and each author appears once, in a "users" map:
+
+    {"messages": [{"id": 7, "text": "...", "ts": "2020-01-01T12:00:00",
+                   "user_id": 3, "likes": 2}],
+     "users": {"3": {"id": 3, "username": "...", "image_url": "..."}},
+     "liked": [7],
+     "next": "20200101120000000000-7"}
+
+Batch endpoints take {"ids": [...]} and answer with the ids that changed.
+"""
+
+from flask import abort, g, jsonify, request
+
+
+def message_json(message):
+    return {
+        'id': message.id,
+        'text': message.text,
+        'ts': message.timestamp.isoformat(timespec='seconds'),
+        'user_id': message.user_id,
+        'likes': message.likes_count,
+    }
+
+
+def author_json(user):
+    """What a message list needs to show its authors."""
+
+    return {
+        'id': user.id,
+        'username': user.username,
+        'image_url': user.image_url,
+    }
+
+
+def user_json(user):
+    return {
+        **author_json(user),
+        'header_image_url': user.header_image_url,
+        'bio': user.bio,
+        'location': user.location,
+        'messages': user.messages_count,
+        'following': user.following_count,
+        'followers': user.followers_count,
+        'likes': user.likes_count,
+    }
+
+
+def messages_json(messages, liked_ids=(), next_cursor=None):
+    """A page of messages, their authors once each, and which are liked."""
+
+    return jsonify(
+        messages=[message_json(msg) for msg in messages],
+        users={str(msg.user_id): author_json(msg.user) for msg in messages},
+        liked=sorted(liked_ids),
+        next=next_cursor,
+    )
+
+
+def read_ids(limit):
+    """The "ids" list of the JSON body; 400 unless it is 1..`limit` ints."""
+
+    body = request.get_json(silent=True)
+    ids = body.get('ids') if isinstance(body, dict) else None
+
+    if (not isinstance(ids, list) or not 0 < len(ids) <= limit
+            or not all(type(id) is int for id in ids)):
+        abort(400, f'expected {{"ids": [...]}} with 1 to {limit} integer ids')
+
+    return ids
+
+
+def require_user():
+    """401 unless someone is logged in."""
+
+    if not g.user:
+        abort(401)
+
+
+def error_json(error):
+    """Error handler: HTTP errors as {"error": description}."""
+
+    return jsonify(error=error.description), error.code
@@ -1,11 +1,38 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, Blueprint, render_template, request, flash, redirect,
+                   session, g, get_flashed_messages, abort, jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
-
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+
+import accounts
+import counters
+import follows
+import likes
+import loader
+import migrations
+import tags
+from api import (error_json, messages_json, read_ids, require_user,
+                 user_json)
+from autocomplete import create_username_index
+from cache import create_cache
 from forms import UserAddForm, LoginForm, MessageForm, ProfileEditForm
-from models import db, connect_db, User, Message, Like
+from http_cache import (apply_cache_policy, cache_policy, make_etag,
+                        not_modified, user_version, with_validators)
+from identity import load_current_user
+from instrumentation import create_instrumentation
+from jobs import create_job_queue
+from models import (db, connect_db, hasher, visible_messages, User, Message,
+                    Like, FollowersFollowee)
+from pagination import (make_page, message_cursor, messages_before, page_url,
+                        parse_message_cursor, parse_user_cursor,
+                        timestamp_cursor, user_cursor, users_before)
+from ratelimit import create_login_limiter
+from search import create_search_index
+from timelines import create_timeline_store
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +47,78 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Home timelines are precomputed on write; 'sql' or 'memory' (single process).
+app.config['TIMELINE_BACKEND'] = os.environ.get('TIMELINE_BACKEND', 'sql')
+app.config['TIMELINE_SIZE'] = 200
+# Messages by users with this many followers are merged in at read time
+# instead of being pushed to every follower.
+app.config['TIMELINE_CELEBRITY_THRESHOLD'] = int(
+    os.environ.get('TIMELINE_CELEBRITY_THRESHOLD', 10000))
+app.config['MESSAGES_PER_PAGE'] = 100
+app.config['USERS_PER_PAGE'] = 60
+
+# Rendered pages and fragments; 'lru' (in-process) or 'null'.
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'lru')
+app.config['CACHE_MAX_ENTRIES'] = 10000
+app.config['CACHE_DEFAULT_TTL'] = 300
+# bcrypt work factor, and worker processes hashing passwords (0: inline).
+app.config['PASSWORD_HASH_ROUNDS'] = int(
+    os.environ.get('PASSWORD_HASH_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = (
+    int(os.environ['PASSWORD_HASH_WORKERS'])
+    if 'PASSWORD_HASH_WORKERS' in os.environ else None)
+# Failed logins allowed per username / client IP in a sliding window.
+app.config['LOGIN_LIMIT_BACKEND'] = 'memory'
+app.config['LOGIN_LIMIT_WINDOW'] = 300
+app.config['LOGIN_LIMIT_PER_USERNAME'] = 10
+app.config['LOGIN_LIMIT_PER_IP'] = 50
+# How long the logged-in user's snapshot is reused before it is reloaded.
+app.config['IDENTITY_TTL'] = 60
+# Full-text search: 'postgres' or 'memory'; by default whichever fits the
+# database.
+app.config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND')
+# Username autocomplete: most suggestions per request, and prefixes matching
+# more users than this keep their top users precomputed.
+app.config['AUTOCOMPLETE_LIMIT'] = 10
+app.config['AUTOCOMPLETE_SCAN_LIMIT'] = 256
+# Side effects of writes (timeline fan-out, tag indexing) are background jobs
+# run by `flask work` when JOBS_EAGER=0, else run inside the request. The
+# memory timeline store only exists in the web process, so it needs them
+# eager. Account purges always wait for `flask work`.
+app.config['JOBS_EAGER'] = (os.environ.get('JOBS_EAGER', '1') != '0'
+                            or app.config['TIMELINE_BACKEND'] == 'memory')
+app.config['JOBS_BATCH_SIZE'] = 100
+app.config['JOBS_MAX_ATTEMPTS'] = 5
+# Deleted accounts are purged by jobs removing at most this many rows of a
+# kind each, never inside the request.
+app.config['DELETE_BATCH_SIZE'] = 1000
+# Most ids one batch API call may change.
+app.config['API_BATCH_LIMIT'] = 100
+# Trending tags are counted over this many seconds, in this many steps.
+app.config['TRENDING_WINDOW'] = 3600
+app.config['TRENDING_BUCKETS'] = 12
+# Requests slower than this are logged, with their SQL, at this rate.
+app.config['SLOW_REQUEST_SECONDS'] = 0.5
+app.config['SLOW_REQUEST_SAMPLE_RATE'] = 0.1
+# /metrics requires "Authorization: Bearer <token>"; it is off if unset.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
 # toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+timelines = create_timeline_store(app)
+cache = create_cache(app)
+login_limiter = create_login_limiter(app)
+search_index = create_search_index(app)
+usernames = create_username_index(app)
+trending = tags.create_trending(app)
+job_queue = create_job_queue(app)
+instrumentation = create_instrumentation(app, db.engine)
+instrumentation.add_gauges('password_hash', hasher.stats)
+instrumentation.add_gauges('jobs', job_queue.stats)
+app.add_template_global(page_url)
+app.add_template_filter(tags.link_tags)
+app.before_first_request(usernames.rebuild)
 
 
 ##############################################################################
@@ -31,10 +127,15 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    This is a cached snapshot (see identity.py); `g.user.model` is the
+    User row.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_current_user(session[CURR_USER_KEY], cache,
+                                   app.config['IDENTITY_TTL'])
 
     else:
         g.user = None
@@ -82,6 +183,9 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        login_limiter.forget(user.username)
+        search_index.update_user(user)
+        usernames.add(user)
         do_login(user)
 
         return redirect("/")
@@ -92,19 +196,36 @@ def signup():
 
 @app.route('/login', methods=["GET", "POST"])
 def login():
-    """Handle user login."""
+    """Handle user login.
+
+    Attempts over the failed-login limit, or repeating a username and
+    password that just failed, are turned away before authenticating.
+    """
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        username = form.username.data
+        password = form.password.data
+        ip = request.remote_addr
+
+        if login_limiter.limited(username, ip):
+            flash("Too many failed logins. Try again later.", 'danger')
+            return render_template('users/login.html', form=form), 429
+
+        if login_limiter.known_failure(username, password):
+            user = None
+        else:
+            user = User.authenticate(username, password)
 
         if user:
+            # authenticate() may have upgraded the password hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
 
+        login_limiter.record_failure(username, password, ip)
         flash("Invalid credentials.", 'danger')
 
     return render_template('users/login.html', form=form)
@@ -120,43 +241,293 @@ def logout():
         return redirect("/")
 
 
+##############################################################################
+# Background jobs (see jobs.py)
+
+
+@job_queue.handler('fan_out', batch=True)
+def fan_out(payloads):
+    """Push new messages to their followers' timelines; index their tags."""
+
+    message_ids = [payload['message_id'] for payload in payloads]
+
+    # messages deleted in the meantime are skipped
+    for msg in Message.query.filter(Message.id.in_(message_ids)):
+        timelines.push(msg)
+        tags.index_message(msg)
+
+
+@job_queue.handler('purge_user', eager=False)
+def purge_user(payload):
+    """Remove the next batch of a deleted user's rows; requeue until done.
+
+    Each batch commits by itself, so a big account never holds one long
+    transaction.
+    """
+
+    user_id = payload['user_id']
+    done, user_ids, message_ids = accounts.purge_step(
+        user_id, app.config['DELETE_BATCH_SIZE'], timelines)
+    db.session.commit()
+    cache.invalidate(*(f"stats:{id}" for id in user_ids),
+                     *(f"message:{id}" for id in message_ids))
+
+    if not done:
+        job_queue.enqueue('purge_user', payload)
+
+
+@job_queue.handler('follow_timeline')
+def follow_timeline(payload):
+    """Merge in, or drop, the messages of a user just (un)followed."""
+
+    if payload['following']:
+        timelines.backfill(payload['user_id'], payload['followee_id'])
+    else:
+        timelines.prune(payload['user_id'], payload['followee_id'])
+
+
+##############################################################################
+# Follows and likes
+#
+# Shared by the HTML routes and the JSON API. Each call is one transaction
+# however many ids it is given, and returns the ids that actually changed.
+
+
+def follow_users(user_id, followee_ids):
+    """Have `user_id` follow `followee_ids`.
+
+    Unknown users, `user_id` itself and users already followed are skipped.
+    """
+
+    wanted = set(followee_ids) - {user_id}
+    followed = set()
+    if wanted:
+        followed = {row.follower_id for row in (
+            db.session.query(FollowersFollowee.follower_id)
+            .filter(FollowersFollowee.followee_id == user_id,
+                    FollowersFollowee.follower_id.in_(wanted)))}
+        wanted = {row.id for row in (
+            db.session.query(User.id)
+            .filter(User.id.in_(wanted), User.deleted_at.is_(None)))}
+    new_ids = sorted(wanted - followed)
+
+    if not new_ids:
+        return []
+
+    # the columns read backwards, see FollowersFollowee
+    db.session.add_all(FollowersFollowee(followee_id=user_id,
+                                         follower_id=followee_id)
+                       for followee_id in new_ids)
+    db.session.flush()
+    counters.adjust(User, user_id, following_count=len(new_ids))
+    counters.adjust(User, new_ids, followers_count=1)
+    timelines.followers_changed(new_ids, 1)
+    for followee_id in new_ids:
+        job_queue.enqueue('follow_timeline', {'user_id': user_id,
+                                              'followee_id': followee_id,
+                                              'following': True})
+    db.session.commit()
+
+    for followee_id in new_ids:
+        usernames.add_followers(followee_id, 1)
+    cache.invalidate(*(f"stats:{id}" for id in [user_id, *new_ids]))
+
+    return new_ids
+
+
+def unfollow_users(user_id, followee_ids):
+    """Have `user_id` stop following `followee_ids`."""
+
+    follows = (FollowersFollowee.query
+               .filter(FollowersFollowee.followee_id == user_id,
+                       FollowersFollowee.follower_id.in_(set(followee_ids))))
+    old_ids = sorted(row.follower_id for row in follows)
+
+    if not old_ids:
+        return []
+
+    follows.delete(synchronize_session=False)
+    counters.adjust(User, user_id, following_count=-len(old_ids))
+    counters.adjust(User, old_ids, followers_count=-1)
+    timelines.followers_changed(old_ids, -1)
+    for followee_id in old_ids:
+        job_queue.enqueue('follow_timeline', {'user_id': user_id,
+                                              'followee_id': followee_id,
+                                              'following': False})
+    db.session.commit()
+
+    for followee_id in old_ids:
+        usernames.add_followers(followee_id, -1)
+    cache.invalidate(*(f"stats:{id}" for id in [user_id, *old_ids]))
+
+    return old_ids
+
+
+def like_messages(user_id, message_ids):
+    """Have `user_id` like `message_ids`.
+
+    Unknown messages, the user's own and ones already liked are skipped.
+    """
+
+    wanted = set(message_ids)
+    if wanted:
+        wanted = {row.id for row in (
+            visible_messages(db.session.query(Message.id))
+            .filter(Message.id.in_(wanted), Message.user_id != user_id))}
+    new_ids = likes.add(user_id, sorted(wanted))
+
+    if not new_ids:
+        return []
+
+    db.session.commit()
+    cache.invalidate(f"stats:{user_id}")
+
+    return new_ids
+
+
+def unlike_messages(user_id, message_ids):
+    """Have `user_id` stop liking `message_ids`."""
+
+    old_ids = likes.remove(user_id, sorted(set(message_ids)))
+
+    if not old_ids:
+        return []
+
+    db.session.commit()
+    cache.invalidate(f"stats:{user_id}")
+
+    return old_ids
+
+
+def toggle_like(user_id, message_id):
+    """Like or unlike a message; return (liked now?, its like count)."""
+
+    liked, count = likes.toggle(user_id, message_id)
+    db.session.commit()
+    cache.invalidate(f"stats:{user_id}")
+
+    return liked, count
+
+
 ##############################################################################
 # General user routes:
 
+
+def get_user_or_404(user_id):
+    """The user with `user_id`; 404 if there is none, or they are deleted."""
+
+    return User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+
+
+def get_message_or_404(message_id):
+    """The message with `message_id`; 404 if there is none, or if its
+    author is deleted.
+    """
+
+    return (visible_messages(Message.query)
+            .filter(Message.id == message_id)
+            .first_or_404())
+
+
 @app.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and
+    a 'before' cursor for the next page.
     """
 
     search = request.args.get('q')
+    before = parse_user_cursor(request.args.get('before'))
+    per_page = app.config['USERS_PER_PAGE']
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    query = User.query.filter(User.deleted_at.is_(None))
+    if search:
+        query = query.filter(User.username.like(f"%{search}%"))
+
+    rows = users_before(query, before).limit(per_page + 1).all()
+    page = make_page(rows, per_page, user_cursor)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html',
+                           users=page.items,
+                           next_cursor=page.next_cursor)
+
+
+@app.route('/users/autocomplete')
+@cache_policy(anonymous='public, max-age=30')
+def users_autocomplete():
+    """JSON: the most followed users whose username starts with 'q'.
+
+    Answered from the in-memory index, without touching the database.
+    """
+
+    try:
+        limit = int(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT']))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+
+    entries = usernames.complete(request.args.get('q', '').strip(), limit)
+
+    return jsonify(users=[entry._asdict() for entry in entries])
 
 
 @app.route('/users/<int:user_id>', methods=["GET", "POST"])
+@cache_policy(anonymous='public, no-cache', logged_in='private, no-cache')
 def users_show(user_id):
-    """Show user profile."""
-    user = User.query.get_or_404(user_id)
+    """Show user profile.
+
+    Anonymous visitors all see the same page, so it is cached whole.
+    """
+
+    cache_key = None
+    if not g.user and not get_flashed_messages():
+        cache_key = f"page:{request.full_path}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            html, etag = cached
+            return not_modified(etag) or with_validators(html, etag)
+
+    user = get_user_or_404(user_id)
+    before = parse_message_cursor(request.args.get('before'))
+    per_page = app.config['MESSAGES_PER_PAGE']
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    rows = (messages_before(Message.query.filter(Message.user_id == user_id),
+                            before)
+            .limit(per_page + 1)
+            .all())
+    page = make_page(rows, per_page, message_cursor)
+
+    liked_ids = g.user.liked_message_ids(page.items) if g.user else set()
+
+    # the stars too: liking one message and unliking another keeps the
+    # viewer's likes_count
+    etag = make_etag('users_show', user_version(user),
+                     [msg.id for msg in page.items], page.next_cursor,
+                     sorted(liked_ids))
+    response = not_modified(etag)
+    if response:
+        return response
+
+    html = render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           liked_ids=liked_ids,
+                           next_cursor=page.next_cursor)
+
+    if cache_key:
+        cache_tags = [f"user:{user_id}", f"stats:{user_id}"]
+        cache_tags.extend(f"message:{msg.id}" for msg in page.items)
+        cache.set(cache_key, (html, etag), tags=cache_tags)
+
+    return with_validators(html, etag)
 
 
 @app.route('/users/<int:user_id>/following')
+@cache_policy(anonymous=None, logged_in='private, no-cache')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -164,11 +535,33 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = get_user_or_404(user_id)
+    before = parse_user_cursor(request.args.get('before'))
+    per_page = app.config['USERS_PER_PAGE']
+
+    rows = (follows.following_before(user_id, g.user.id, before)
+            .limit(per_page + 1)
+            .all())
+
+    # the page is exactly these users and the viewer's follow buttons
+    etag = make_etag('show_following', user_version(user),
+                     [(user_version(row.User), row.viewer_follows)
+                      for row in rows])
+    response = not_modified(etag)
+    if response:
+        return response
+
+    page = make_page(rows, per_page, lambda row: user_cursor(row.User))
+
+    return with_validators(render_template('users/following.html',
+                                           user=user,
+                                           users=page.items,
+                                           next_cursor=page.next_cursor),
+                           etag)
 
 
 @app.route('/users/<int:user_id>/followers')
+@cache_policy(anonymous=None, logged_in='private, no-cache')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -176,9 +569,29 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    
-    return render_template('users/followers.html', user=user)
+    user = get_user_or_404(user_id)
+    before = parse_user_cursor(request.args.get('before'))
+    per_page = app.config['USERS_PER_PAGE']
+
+    rows = (follows.followers_before(user_id, g.user.id, before)
+            .limit(per_page + 1)
+            .all())
+
+    # the page is exactly these users and the viewer's follow buttons
+    etag = make_etag('users_followers', user_version(user),
+                     [(user_version(row.User), row.viewer_follows)
+                      for row in rows])
+    response = not_modified(etag)
+    if response:
+        return response
+
+    page = make_page(rows, per_page, lambda row: user_cursor(row.User))
+
+    return with_validators(render_template('users/followers.html',
+                                           user=user,
+                                           users=page.items,
+                                           next_cursor=page.next_cursor),
+                           etag)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -189,19 +602,53 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followee = User.query.get_or_404(follow_id)
-    g.user.following.append(followee)
-    db.session.commit()
-    
+    followee = get_user_or_404(follow_id)
+    follow_users(g.user.id, [followee.id])
 
     return redirect(f"/users/{g.user.id}/following")
 
 
 @app.route('/users/<int:user_id>/likes')
 def show_likes(user_id):
-    user = User.query.get_or_404(user_id)
-    likes = g.user.likes
-    return render_template('/users/liked_messages.html', liked_messages=likes, user=user)
+    """Show the messages this user liked, last liked first."""
+
+    user = get_user_or_404(user_id)
+    before = parse_message_cursor(request.args.get('before'))
+    per_page = app.config['MESSAGES_PER_PAGE']
+
+    rows = likes.liked_before(user_id, before).limit(per_page + 1).all()
+    page = make_page(rows, per_page,
+                     lambda row: timestamp_cursor(row.liked_at, row.Message.id))
+    messages = [row.Message for row in page.items]
+
+    # the stars show what the viewer likes, not the user whose page it is
+    liked_ids = g.user.liked_message_ids(messages) if g.user else set()
+
+    return render_template('users/liked_messages.html',
+                           user=user,
+                           messages=messages,
+                           liked_ids=liked_ids,
+                           next_cursor=page.next_cursor)
+
+
+@app.route('/users/<int:user_id>/mentions')
+def show_mentions(user_id):
+    """Show the messages that @mention this user, newest first."""
+
+    user = get_user_or_404(user_id)
+    before = parse_message_cursor(request.args.get('before'))
+    per_page = app.config['MESSAGES_PER_PAGE']
+
+    rows = tags.mentions_before(user_id, before).limit(per_page + 1).all()
+    page = make_page(rows, per_page, message_cursor)
+
+    liked_ids = g.user.liked_message_ids(page.items) if g.user else set()
+
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           liked_ids=liked_ids,
+                           next_cursor=page.next_cursor)
 
 
 @app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
@@ -212,9 +659,8 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followee = User.query.get(follow_id)
-    g.user.following.remove(followee)
-    db.session.commit()
+    followee = get_user_or_404(follow_id)
+    unfollow_users(g.user.id, [followee.id])
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -230,20 +676,24 @@ def profile():
     form = ProfileEditForm(obj=user)
 
     if form.validate_on_submit():
+        # check the password against the row we already have, before
+        # changing it -- no second lookup by (possibly new) username
+        if not hasher.check(user.password, form.password.data):
+            flash(f"Hello, {user.username}! incorrect password")
+            return redirect("/")
+
         user.username = form.username.data
         user.email = form.email.data
         user.image_url = form.image_url.data
         user.header_image_url = form.header_image_url.data
         user.bio = form.bio.data
         user.location = form.location.data
-        user_authentication = User.authenticate(username=user.username,password=form.password.data)
-        
-        if not user_authentication:
-            flash(f"Hello, {user.username}! incorrect password")
-            return redirect("/")
-        else:
-            db.session.commit()    
-            return redirect(f"/users/{user.id}")
+        db.session.commit()
+        cache.invalidate(f"user:{user.id}")
+        login_limiter.forget(user.username)
+        search_index.update_user(user)
+        usernames.add(user)
+        return redirect(f"/users/{user.id}")
 
     return render_template('users/edit.html', form=form)
 
@@ -258,7 +708,19 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # gone for everyone now; purged in batches by 'purge_user' jobs (see
+    # accounts.py), which fix the counters of everyone related
+    user_id = g.user.id
+    accounts.mark_deleted(user_id)
+    db.session.commit()
+    cache.invalidate(f"user:{user_id}")
+    search_index.drop_user(user_id)
+    usernames.remove(user_id)
+    for followed_id in g.user.following_ids:
+        usernames.add_followers(followed_id, -1)
+
+    job_queue.enqueue('purge_user', {'user_id': user_id},
+                      key=f"purge_user:{user_id}")
     db.session.commit()
 
     return redirect("/signup")
@@ -282,8 +744,15 @@ def messages_add():
 
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        g.user.model.messages.append(msg)
+        db.session.flush()
+        counters.adjust(User, g.user.id, messages_count=1)
+        job_queue.enqueue('fan_out', {'message_id': msg.id},
+                          key=f"fan_out:{msg.id}")
         db.session.commit()
+        cache.invalidate(f"stats:{g.user.id}")
+        search_index.add_message(msg)
+        trending.add(tags.extract_tags(msg.text))
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
@@ -291,24 +760,18 @@ def messages_add():
 
 @app.route('/messages/<int:message_id>', methods=[ "POST"])
 def messages_show(message_id):
-    """Show a message."""
-    msg = Message.query.get(message_id)
-    msg_id = message_id
-    user_id = g.user.id
-    like = Like.query.filter_by(message_id=msg_id, user_id=user_id).first()
+    """Like or unlike a message."""
 
-    if g.user.id == msg.user_id:
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
-        return redirect('/')
-    elif like:
-        db.session.delete(like)
-        db.session.commit()
-        return redirect('/')
-    else:
-        liked_post = Like(message_id=msg_id, user_id=user_id)
-        db.session.add(liked_post)
-        db.session.commit()
-        return redirect ("/")
+    msg = get_message_or_404(message_id)
+
+    if g.user.id != msg.user_id:
+        toggle_like(g.user.id, msg.id)
+
+    return redirect("/")
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -319,52 +782,368 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
+    msg = get_message_or_404(message_id)
+    if msg.user_id != g.user.id:
+        abort(403)
+
+    # the author and everyone who liked it get new counts
+    stats_ids = {like.user_id for like in (
+        db.session.query(Like.user_id).filter(Like.message_id == msg.id))}
+    stats_ids.add(msg.user_id)
+
+    counters.forget_message(msg)
+    timelines.remove_message(msg)
+    tags.forget_message(message_id)
     db.session.delete(msg)
     db.session.commit()
+    cache.invalidate(f"message:{message_id}",
+                     *(f"stats:{user_id}" for user_id in stats_ids))
+    search_index.remove_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
 
+##############################################################################
+# Tags
+
+
+@app.route('/tags')
+def trending_tags():
+    """Show the most used tags of the last TRENDING_WINDOW seconds."""
+
+    trending.warm()
+
+    return render_template('tags/index.html', trending=trending.top(20))
+
+
+@app.route('/tags/<tag>')
+def show_tag(tag):
+    """Show the messages with #tag, newest first."""
+
+    before = parse_message_cursor(request.args.get('before'))
+    per_page = app.config['MESSAGES_PER_PAGE']
+
+    rows = tags.tagged_before(tag, before).limit(per_page + 1).all()
+    page = make_page(rows, per_page, message_cursor)
+
+    liked_ids = g.user.liked_message_ids(page.items) if g.user else set()
+
+    return render_template('tags/show.html',
+                           tag=tag.lower(),
+                           messages=page.items,
+                           liked_ids=liked_ids,
+                           next_cursor=page.next_cursor)
+
+
+##############################################################################
+# Search
+
+
+@app.route('/search')
+def search():
+    """Search messages or, with kind=users, user profiles.
+
+    Results are ranked, not in id order, so pages are numbered ('page')
+    rather than keyed by a cursor.
+    """
+
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('kind', 'messages')
+    if kind not in ('messages', 'users'):
+        abort(400)
+
+    try:
+        page = int(request.args.get('page', 1))
+    except ValueError:
+        abort(400)
+    if page < 1:
+        abort(400)
+
+    if kind == 'users':
+        per_page = app.config['USERS_PER_PAGE']
+        find = search_index.user_ids
+        model, rows = User, User.query.filter(User.deleted_at.is_(None))
+    else:
+        per_page = app.config['MESSAGES_PER_PAGE']
+        find = search_index.message_ids
+        model, rows = Message, (visible_messages(Message.query)
+                                .options(joinedload(Message.user)))
+
+    ids = find(query, per_page + 1, (page - 1) * per_page) if query else []
+
+    # in rank order; skipping anything deleted since it was indexed
+    by_id = {row.id: row for row in rows.filter(model.id.in_(ids[:per_page]))}
+    results = [by_id[id] for id in ids[:per_page] if id in by_id]
+
+    liked_ids = set()
+    if g.user and kind == 'messages':
+        liked_ids = g.user.liked_message_ids(results)
+
+    return render_template('search.html',
+                           query=query,
+                           kind=kind,
+                           results=results,
+                           liked_ids=liked_ids,
+                           next_page=page + 1 if len(ids) > per_page else None)
+
+
+##############################################################################
+# JSON API, version 1 (see api.py)
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+api_v1.register_error_handler(HTTPException, error_json)
+
+
+@api_v1.route('/users/<int:user_id>')
+def api_user(user_id):
+    return jsonify(user=user_json(get_user_or_404(user_id)))
+
+
+@api_v1.route('/users/<int:user_id>/messages')
+def api_user_messages(user_id):
+    """A user's messages, newest first, paged with 'before'."""
+
+    get_user_or_404(user_id)
+    before = parse_message_cursor(request.args.get('before'))
+    per_page = app.config['MESSAGES_PER_PAGE']
+
+    query = (Message.query
+             .options(joinedload(Message.user))
+             .filter(Message.user_id == user_id))
+    rows = messages_before(query, before).limit(per_page + 1).all()
+    page = make_page(rows, per_page, message_cursor)
+
+    liked_ids = g.user.liked_message_ids(page.items) if g.user else set()
+
+    return messages_json(page.items, liked_ids, page.next_cursor)
+
+
+@api_v1.route('/timeline')
+def api_timeline():
+    """The logged-in user's home timeline, paged with 'before'."""
+
+    require_user()
+    before = parse_message_cursor(request.args.get('before'))
+    per_page = app.config['MESSAGES_PER_PAGE']
+
+    rows = timelines.messages_for(g.user.id, per_page + 1, before)
+    page = make_page(rows, per_page, message_cursor)
+
+    response = messages_json(page.items,
+                             g.user.liked_message_ids(page.items),
+                             page.next_cursor)
+
+    # a freshly warmed timeline; see homepage()
+    db.session.commit()
+    return response
+
+
+@api_v1.route('/messages/<int:message_id>')
+def api_message(message_id):
+    msg = get_message_or_404(message_id)
+    liked_ids = g.user.liked_message_ids([msg]) if g.user else set()
+
+    return messages_json([msg], liked_ids)
+
+
+@api_v1.route('/messages/<int:message_id>/fragment')
+def api_message_fragment(message_id):
+    """The message as HTML, as it appears in lists, to swap into a page."""
+
+    msg = get_message_or_404(message_id)
+    liked_ids = g.user.liked_message_ids([msg]) if g.user else set()
+
+    return render_template('messages/item.html', msg=msg, liked_ids=liked_ids)
+
+
+@api_v1.route('/messages/<int:message_id>/like', methods=['POST'])
+def api_toggle_like(message_id):
+    """Like or unlike one message; answer with just its new state."""
+
+    require_user()
+    msg = get_message_or_404(message_id)
+    if msg.user_id == g.user.id:
+        abort(400, "you can't like your own message")
+
+    liked, count = toggle_like(g.user.id, message_id)
+
+    return jsonify(id=message_id, liked=liked, likes=count)
+
+
+@api_v1.route('/likes', methods=['POST', 'DELETE'])
+def api_likes():
+    """Like (POST) or unlike (DELETE) every message in {"ids": [...]}."""
+
+    require_user()
+    message_ids = read_ids(app.config['API_BATCH_LIMIT'])
+
+    change = like_messages if request.method == 'POST' else unlike_messages
+    return jsonify(changed=change(g.user.id, message_ids))
+
+
+@api_v1.route('/follows', methods=['POST', 'DELETE'])
+def api_follows():
+    """Follow (POST) or unfollow (DELETE) every user in {"ids": [...]}."""
+
+    require_user()
+    user_ids = read_ids(app.config['API_BATCH_LIMIT'])
+
+    change = follow_users if request.method == 'POST' else unfollow_users
+    return jsonify(changed=change(g.user.id, user_ids))
+
+
+app.register_blueprint(api_v1)
+
+
 ##############################################################################
 # Homepage and error pages
 
 
 @app.route('/', methods=["GET", "POST"])
+@cache_policy(anonymous='public, max-age=60', logged_in='private, no-cache')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followees
+    - logged in: 100 most recent messages of followees, then older
+      pages with a 'before' cursor
+
+    The messages come from the user's precomputed timeline (see
+    timelines.py); a cold timeline is rebuilt from followees' messages.
     """
     if g.user:
-        users_ids = [followee.id for followee in g.user.following]
-        users_ids.append(g.user.id)
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_((users_ids)))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        return render_template('home.html', messages=messages)
+        before = parse_message_cursor(request.args.get('before'))
+        per_page = app.config['MESSAGES_PER_PAGE']
+
+        rows = timelines.messages_for(g.user.id, per_page + 1, before)
+        page = make_page(rows, per_page, message_cursor)
+
+        liked_ids = g.user.liked_message_ids(page.items)
+        etag = make_etag('homepage', [msg.id for msg in page.items],
+                         page.next_cursor, sorted(liked_ids))
+
+        response = not_modified(etag)
+        if response:
+            db.session.commit()
+            return response
+
+        html = render_template('home.html',
+                               messages=page.items,
+                               liked_ids=liked_ids,
+                               next_cursor=page.next_cursor)
+
+        # commit a freshly warmed timeline only now: committing expires
+        # the loaded messages and their eagerly loaded authors
+        db.session.commit()
+        return with_validators(html, etag)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# HTTP caching
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Routes pick their Cache-Control with @cache_policy (see http_cache.py);
+# everything else gets "no-cache, no-store".
 
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
+app.after_request(apply_cache_policy)
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+
+##############################################################################
+# CLI commands
+#
+#   FLASK_APP=app.py flask <command>
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Create missing tables and indexes in an existing database."""
+
+    changes = migrations.upgrade(db.engine)
+
+    for change in changes:
+        click.echo(change)
+    click.echo(f"{len(changes)} change(s)")
+
+    if any(change.startswith('created column') for change in changes):
+        click.echo("new columns start empty; run `flask reconcile-counters`")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute every denormalized counter from the underlying rows."""
+
+    counters.reconcile()
+    db.session.commit()
+    click.echo("counters reconciled")
+
+
+@app.cli.command('explain-queries')
+def explain_queries():
+    """Check that the hot queries use their indexes."""
+
+    failed = 0
+
+    for description, index, ok, plan in migrations.explain_queries(db.engine):
+        click.echo(f"[{'ok' if ok else 'MISSING'}] {description} ({index})")
+        if not ok:
+            failed += 1
+            click.echo(plan)
+
+    if failed:
+        raise SystemExit(1)
+
+
+@app.cli.command('work')
+@click.option('--threads', default=4, show_default=True,
+              help="Worker threads per process.")
+@click.option('--processes', default=1, show_default=True)
+@click.option('--burst', is_flag=True, help="Exit once no job is due.")
+def work(threads, processes, burst):
+    """Run background jobs until interrupted."""
+
+    job_queue.work(app, threads=threads, processes=processes, burst=burst)
+
+
+@app.cli.command('load-data')
+@click.argument('directory', default='generator')
+@click.option('--chunk-size', default=10000, show_default=True,
+              help="Rows per transaction.")
+@click.option('--restart', is_flag=True,
+              help="Ignore the checkpoints of an interrupted load.")
+@click.option('--keep-indexes', is_flag=True,
+              help="Don't drop indexes while loading (for a live database).")
+def load_data(directory, chunk_size, restart, keep_indexes):
+    """Bulk load users, messages, follows and likes files from DIRECTORY.
+
+    Each is <table>.csv or <table>.jsonl; missing ones are skipped.
+    """
+
+    reported = {}
+
+    def report(table, rows, seconds):
+        # every 10 seconds or so
+        if seconds - reported.get(table, 0) >= 10:
+            reported[table] = seconds
+            click.echo(f"{table}: {rows} rows, {rows / seconds:.0f} rows/s")
+
+    db.create_all()
+    results = loader.load_directory(db.engine, directory,
+                                    chunk_size=chunk_size,
+                                    resume=not restart,
+                                    defer_indexes=not keep_indexes,
+                                    progress=report)
+
+    for table, (rows, seconds) in results.items():
+        click.echo(f"{table}: {rows} rows in {seconds:.1f}s "
+                   f"({rows / (seconds or 1):.0f} rows/s)")
+
+    counters.reconcile()
+    timelines.clear()
+    tags.reindex()
+    db.session.commit()
+    search_index.rebuild()
+    usernames.rebuild()
+    click.echo("counters reconciled, timelines cleared, tags and search "
+               "reindexed")
@@ -0,0 +1,216 @@
+"""Username autocomplete.
+
+`UsernameIndex` keeps every username, lowercased, in one sorted list (with
+parallel lists of ids), so the users starting with a prefix are a slice
+found by bisection. Matches are ranked by follower count.
+
+Short prefixes match too many users to rank on every keystroke, so for
+prefixes matching more than `scan_limit` users the best few are kept
+ready: an exact top list that the `add`, `remove` and `add_followers`
+hooks repair in place. A list that shrinks below what a query needs is
+dropped and recomputed on its next use.
+
+Like the memory search index, every process builds its own copy from the
+database on first use and only sees its own writes.
+"""
+
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from threading import Lock
+
+from models import db, User
+
+Entry = namedtuple('Entry', 'id username image_url followers')
+
+
+def prefix_end(prefix):
+    """The smallest string after every string starting with `prefix`."""
+
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class UsernameIndex:
+    """Users found by username prefix, most followed first."""
+
+    def __init__(self, limit=10, scan_limit=256):
+        self.limit = limit
+        self.scan_limit = scan_limit
+        # sorted lowercased usernames, and the user id of each
+        self._keys = []
+        self._ids = []
+        # user id -> Entry
+        self._entries = {}
+        # prefix -> ids of its top users, best first; see _repair
+        self._top = {}
+        self._built = False
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # building
+
+    def rebuild(self):
+        """Reload every user from the database."""
+
+        rows = (db.session.query(User.id, User.username, User.image_url,
+                                 User.followers_count)
+                .filter(User.deleted_at.is_(None))
+                .yield_per(10000))
+        entries = {row.id: Entry(row.id, row.username, row.image_url,
+                                 row.followers_count or 0)
+                   for row in rows}
+        pairs = sorted((entry.username.lower(), user_id)
+                       for user_id, entry in entries.items())
+
+        with self._lock:
+            self._entries = entries
+            self._keys = [key for key, _ in pairs]
+            self._ids = [user_id for _, user_id in pairs]
+            self._top = {}
+            self._built = True
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    # queries
+
+    def _rank(self, user_id):
+        """Sort key: most followers, then alphabetical."""
+
+        entry = self._entries[user_id]
+        return (-entry.followers, entry.username.lower(), user_id)
+
+    def _range(self, prefix):
+        return (bisect_left(self._keys, prefix),
+                bisect_left(self._keys, prefix_end(prefix)))
+
+    def _best(self, start, end, count):
+        return heapq.nsmallest(count, self._ids[start:end], key=self._rank)
+
+    def complete(self, prefix, limit=None):
+        """Up to `limit` Entries whose username starts with `prefix`."""
+
+        self._ensure_built()
+
+        limit = min(limit or self.limit, self.limit)
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+
+        with self._lock:
+            start, end = self._range(prefix)
+
+            if end - start <= self.scan_limit:
+                ids = self._best(start, end, limit)
+            else:
+                ids = self._top.get(prefix)
+                if ids is None:
+                    # twice what's shown, so a few unfollows don't
+                    # immediately force a recount
+                    ids = self._best(start, end, 2 * self.limit)
+                    self._top[prefix] = ids
+
+            return [self._entries[user_id] for user_id in ids[:limit]]
+
+    # keeping up with writes
+
+    def _prefixes(self, key):
+        return [key[:length] for length in range(1, len(key) + 1)
+                if key[:length] in self._top]
+
+    def _repair(self, user_id, key):
+        """Fix the top lists after `user_id` was added or changed rank.
+
+        Each list is the exact top of its prefix: everyone not in it
+        ranks after its last id. That stays true if the changed user is
+        taken out and put back only when it ranks before the last id; a
+        list left shorter than `limit` is dropped.
+        """
+
+        rank = self._rank(user_id)
+
+        for prefix in self._prefixes(key):
+            ids = self._top[prefix]
+            if user_id in ids:
+                ids.remove(user_id)
+
+            if ids and rank < self._rank(ids[-1]):
+                ranks = [self._rank(other) for other in ids]
+                ids.insert(bisect_right(ranks, rank), user_id)
+                del ids[2 * self.limit:]
+
+            if len(ids) < self.limit:
+                del self._top[prefix]
+
+    def _discard(self, user_id):
+        """Take `user_id` out of the index, and return its Entry."""
+
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+
+        key = entry.username.lower()
+        index = bisect_left(self._keys, key)
+        while self._ids[index] != user_id:
+            index += 1
+        del self._keys[index]
+        del self._ids[index]
+
+        for prefix in self._prefixes(key):
+            ids = self._top[prefix]
+            if user_id in ids:
+                ids.remove(user_id)
+                if len(ids) < self.limit:
+                    del self._top[prefix]
+
+        del self._entries[user_id]
+        return entry
+
+    def add(self, user):
+        """Index a new user, or reindex a renamed or edited one."""
+
+        with self._lock:
+            if not self._built:
+                return
+
+            old = self._discard(user.id)
+            followers = old.followers if old else user.followers_count or 0
+            self._entries[user.id] = Entry(user.id, user.username,
+                                           user.image_url, followers)
+
+            key = user.username.lower()
+            index = bisect_right(self._keys, key)
+            self._keys.insert(index, key)
+            self._ids.insert(index, user.id)
+
+            self._repair(user.id, key)
+
+    def remove(self, user_id):
+        """Forget a deleted user."""
+
+        with self._lock:
+            if self._built:
+                self._discard(user_id)
+
+    def add_followers(self, user_id, delta):
+        """Move a user by `delta` followers."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+
+            self._entries[user_id] = entry._replace(
+                followers=entry.followers + delta)
+            self._repair(user_id, entry.username.lower())
+
+
+def create_username_index(app):
+    """A UsernameIndex from the `AUTOCOMPLETE_*` settings."""
+
+    return UsernameIndex(limit=app.config.get('AUTOCOMPLETE_LIMIT', 10),
+                         scan_limit=app.config.get('AUTOCOMPLETE_SCAN_LIMIT',
+                                                   256))
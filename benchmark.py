@@ -0,0 +1,395 @@
+"""Benchmark the Warbler routes.
+
+Seeds a database from the generator, then requests each route many times
+with several concurrent virtual users, through Flask's test client and/or
+a real threaded WSGI server, and records latency percentiles, throughput
+and SQL statements per request:
+
+    python benchmark.py --users 2000 --messages 20000 --follows 50000 \\
+        --output before.json
+    ... change something ...
+    python benchmark.py --users 2000 --messages 20000 --follows 50000 \\
+        --output after.json --compare before.json
+
+The default database is a scratch SQLite file; pass --database to
+benchmark against PostgreSQL (SQLite serializes the write routes).
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from math import ceil
+from http.cookiejar import CookieJar
+from time import perf_counter
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import (HTTPCookieProcessor, HTTPRedirectHandler, Request,
+                            build_opener)
+
+SQL_HEADER = 'X-Benchmark-SQL'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default='sqlite:////tmp/warbler-bench.db')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', help="load these CSVs instead of generating")
+    parser.add_argument('--no-seed', action='store_true',
+                        help="use the database as it is")
+    parser.add_argument('--mode', choices=['client', 'server', 'both'],
+                        default='both')
+    parser.add_argument('--requests', type=int, default=200,
+                        help="measured requests per route")
+    parser.add_argument('--warmup', type=int, default=20,
+                        help="unmeasured requests per route first")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="virtual users")
+    parser.add_argument('--routes', help="comma-separated subset of routes")
+    parser.add_argument('--output', help="write the results here as JSON")
+    parser.add_argument('--compare', help="earlier results to compare with")
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# before the app connects
+os.environ['DATABASE_URL'] = args.database
+
+from app import app, CURR_USER_KEY, db, timelines  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from flask import g, has_request_context  # noqa: E402
+import counters  # noqa: E402
+import loader  # noqa: E402
+from models import Message, User  # noqa: E402
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+##############################################################################
+# Data
+
+
+def seed():
+    """Recreate the database from generated (or given) CSVs."""
+
+    directory = args.data or tempfile.mkdtemp()
+
+    try:
+        if not args.data:
+            subprocess.run(
+                [sys.executable, 'generator/create_csvs.py',
+                 '--output', directory, '--seed', str(args.seed),
+                 '--users', str(args.users), '--messages', str(args.messages),
+                 '--follows', str(args.follows), '--likes', str(args.likes)],
+                check=True)
+
+        db.drop_all()
+        db.create_all()
+        for table, (rows, seconds) in loader.load_directory(
+                db.engine, directory).items():
+            print(f"loaded {rows} {table} in {seconds:.1f}s")
+
+        counters.reconcile()
+        timelines.clear()
+        db.session.commit()
+
+    finally:
+        if not args.data:
+            shutil.rmtree(directory)
+
+
+##############################################################################
+# SQL statement counting
+
+
+@event.listens_for(db.engine, 'before_cursor_execute')
+def count_statement(*_):
+    if has_request_context():
+        g.benchmark_sql = g.get('benchmark_sql', 0) + 1
+
+
+@app.after_request
+def add_statement_count(response):
+    response.headers[SQL_HEADER] = str(g.get('benchmark_sql', 0))
+    return response
+
+
+def session_cookie(user_id):
+    """Value of a session cookie logging in `user_id`."""
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({CURR_USER_KEY: user_id})
+
+
+##############################################################################
+# Routes: each returns (method, url, form data) for a random request
+
+
+def route_homepage(ids):
+    return 'GET', '/', None
+
+
+def route_users_show(ids):
+    return 'GET', f"/users/{random.choice(ids['users'])}", None
+
+
+def route_list_users(ids):
+    return 'GET', f"/users?{urlencode({'q': random.choice('aeiou')})}", None
+
+
+def route_messages_add(ids):
+    return 'POST', '/messages/new', {'text': "benchmark"}
+
+
+def route_like_toggle(ids):
+    return 'POST', f"/messages/{random.choice(ids['messages'])}", None
+
+
+def route_api_like_toggle(ids):
+    return 'POST', f"/api/v1/messages/{random.choice(ids['messages'])}/like", None
+
+
+# name -> (request maker, logged in?)
+ROUTES = {
+    'homepage': (route_homepage, True),
+    'users_show': (route_users_show, True),
+    'users_show_anonymous': (route_users_show, False),
+    'list_users': (route_list_users, True),
+    'messages_add': (route_messages_add, True),
+    'like_toggle': (route_like_toggle, True),
+    'api_like_toggle': (route_api_like_toggle, True),
+}
+
+
+##############################################################################
+# Drivers: one per virtual user; request() returns (status, sql statements)
+
+
+class ClientDriver:
+    """Requests through Flask's test client, in this thread."""
+
+    def __init__(self, user_id):
+        self.client = app.test_client()
+        if user_id:
+            self.client.set_cookie('localhost', app.session_cookie_name,
+                                   session_cookie(user_id))
+
+    def request(self, method, url, data):
+        response = self.client.open(url, method=method, data=data)
+        return response.status_code, int(response.headers.get(SQL_HEADER, 0))
+
+
+class NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, *_):
+        return None
+
+
+class ServerDriver:
+    """Requests over HTTP to the WSGI server at `base_url`."""
+
+    def __init__(self, user_id, base_url):
+        self.base_url = base_url
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()),
+                                   NoRedirect())
+        self.cookie = (f"{app.session_cookie_name}={session_cookie(user_id)}"
+                       if user_id else None)
+
+    def request(self, method, url, data):
+        body = urlencode(data).encode() if data else None
+        request = Request(self.base_url + url, data=body, method=method)
+        if self.cookie:
+            request.add_header('Cookie', self.cookie)
+
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status, int(response.headers.get(SQL_HEADER, 0))
+        except HTTPError as error:
+            error.read()
+            return error.code, int(error.headers.get(SQL_HEADER, 0))
+
+
+def start_server():
+    """Serve the app from a background thread; return its base URL."""
+
+    from werkzeug.serving import make_server
+
+    # no access log
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+##############################################################################
+# Measuring
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of already sorted values."""
+
+    if not sorted_values:
+        return None
+
+    index = max(ceil(fraction * len(sorted_values)), 1) - 1
+    return sorted_values[index]
+
+
+def run_route(name, make_driver, ids):
+    """Hit route `name` with the virtual users; return its statistics."""
+
+    make_request, logged_in = ROUTES[name]
+    drivers = [make_driver(random.choice(ids['users']) if logged_in else None)
+               for _ in range(args.concurrency)]
+
+    for i in range(args.warmup):
+        drivers[i % len(drivers)].request(*make_request(ids))
+
+    latencies = []
+    statements = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def virtual_user(driver):
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+
+            request = make_request(ids)
+            start = perf_counter()
+            try:
+                status, sql = driver.request(*request)
+            except Exception:
+                status, sql = 599, 0
+            elapsed = perf_counter() - start
+
+            with lock:
+                latencies.append(elapsed)
+                statements.append(sql)
+                if status >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=virtual_user, args=(driver,))
+               for driver in drivers]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'sql_mean': sum(statements) / len(statements),
+        'sql_max': max(statements),
+    }
+
+
+def print_results(mode, results, previous=None):
+    print(f"\n{mode}")
+    print(f"{'route':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'sql':>7}{'errors':>8}")
+
+    for name, stats in results.items():
+        line = (f"{name:<22}{stats['throughput']:>9.1f}{stats['p50_ms']:>9.1f}"
+                f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+                f"{stats['sql_mean']:>7.1f}{stats['errors']:>8}")
+
+        before = (previous or {}).get(name)
+        if before:
+            change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms']
+            line += f"   p95 {change:+.0%}"
+
+        print(line)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    random.seed(args.seed)
+
+    if not args.no_seed:
+        seed()
+
+    ids = {
+        'users': [row.id for row in db.session.query(User.id)],
+        'messages': [row.id for row in db.session.query(Message.id)],
+    }
+    db.session.remove()
+
+    routes = args.routes.split(',') if args.routes else list(ROUTES)
+    modes = ['client', 'server'] if args.mode == 'both' else [args.mode]
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'database': db.engine.dialect.name,
+        'config': {name: getattr(args, name) for name in
+                   ['users', 'messages', 'follows', 'likes', 'seed',
+                    'requests', 'warmup', 'concurrency']},
+        'counts': {
+            'users': len(ids['users']),
+            'messages': len(ids['messages']),
+        },
+        'results': {},
+    }
+
+    for mode in modes:
+        if mode == 'server':
+            base_url, server = start_server()
+
+            def make_driver(user_id):
+                return ServerDriver(user_id, base_url)
+        else:
+            server = None
+            make_driver = ClientDriver
+
+        results = {name: run_route(name, make_driver, ids) for name in routes}
+        report['results'][mode] = results
+        print_results(mode, results, previous.get(mode))
+
+        if server:
+            server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
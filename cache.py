@@ -0,0 +1,201 @@
+"""Server-side cache for rendered pages and template fragments.
+
+Entries are tagged with what they were rendered from -- "user:<id>" for a
+user's name, pictures and bio, "stats:<id>" for their counters,
+"message:<id>" for a message -- and the write routes invalidate exactly
+those tags.
+
+`CacheBackend` is the interface; `LRUCache` keeps entries in this process.
+A backend for a shared store (memcached, redis) only needs to implement
+the same five methods.
+
+In templates:
+
+    {% cache 'profile-bio:%d' % user.id, ['user:%d' % user.id] %}
+      ...
+    {% endcache %}
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+class CacheBackend:
+    """Interface every cache backend implements."""
+
+    def get(self, key):
+        """Return the value stored under `key`, or None."""
+
+        raise NotImplementedError
+
+    def set(self, key, value, tags=(), ttl=None):
+        """Store `value` under `key`, tagged with `tags`."""
+
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove `key` if it is cached."""
+
+        raise NotImplementedError
+
+    def invalidate(self, *tags):
+        """Remove every entry tagged with any of `tags`."""
+
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove everything."""
+
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    """Caches nothing; for development and tests."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, tags=(), ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def invalidate(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(CacheBackend):
+    """In-process cache holding at most `max_entries`, least recently used
+    evicted first; entries also expire after `default_ttl` seconds.
+    """
+
+    def __init__(self, max_entries=10000, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        # key -> (expires, value, tags), least recently used first
+        self._entries = OrderedDict()
+        # tag -> set of keys
+        self._tags = {}
+        self._lock = Lock()
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry[0] < monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags=(), ttl=None):
+        expires = monotonic() + (ttl or self.default_ttl)
+        tags = tuple(tags)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (expires, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja `{% cache key, tags %}...{% endcache %}` block.
+
+    Uses the backend stored on the environment as `fragment_cache`.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=NullCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(()))
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return (nodes.CallBlock(self.call_method('_render', args), [], [], body)
+                .set_lineno(lineno))
+
+    def _render(self, key, tags, caller):
+        cache = self.environment.fragment_cache
+
+        html = cache.get(key)
+        if html is None:
+            html = caller()
+            cache.set(key, html, tags=tags)
+
+        return html
+
+
+BACKENDS = {
+    'null': NullCache,
+    'lru': LRUCache,
+}
+
+
+def create_cache(app):
+    """Build the backend named by `CACHE_BACKEND` and enable `{% cache %}`."""
+
+    if app.config.get('CACHE_BACKEND', 'lru') == 'lru':
+        cache = LRUCache(
+            max_entries=app.config.get('CACHE_MAX_ENTRIES', 10000),
+            default_ttl=app.config.get('CACHE_DEFAULT_TTL', 300),
+        )
+    else:
+        cache = BACKENDS[app.config['CACHE_BACKEND']]()
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = cache
+
+    return cache
@@ -0,0 +1,59 @@
+"""Denormalized counters on users and messages.
+
+`User.messages_count`, `following_count`, `followers_count`, `likes_count`
+and `Message.likes_count` are adjusted with `col = col + n` updates in the
+same transaction as the change they count, so they stay consistent under
+concurrent requests. `reconcile()` recomputes all of them from scratch.
+"""
+
+from sqlalchemy import func, select
+
+from models import db, FollowersFollowee, Like, Message, User
+
+
+def adjust(model, ids, **deltas):
+    """Add `deltas` (column name -> amount) to rows of `model` with `ids`.
+
+    `ids` is a single id, a list, or a subquery.
+    """
+
+    if isinstance(ids, int):
+        ids = [ids]
+
+    values = {getattr(model, name): getattr(model, name) + delta
+              for name, delta in deltas.items()}
+
+    (model.query
+     .filter(model.id.in_(ids))
+     .update(values, synchronize_session=False))
+
+
+def forget_message(message):
+    """Fix counters before deleting `message`."""
+
+    adjust(User, message.user_id, messages_count=-1)
+    adjust(User,
+           db.session.query(Like.user_id)
+           .filter(Like.message_id == message.id)
+           .subquery(),
+           likes_count=-1)
+
+
+def reconcile():
+    """Recompute every counter with set-based updates."""
+
+    def count(column, key):
+        return select([func.count()]).where(column == key).as_scalar()
+
+    users = User.__table__
+    db.session.execute(users.update().values(
+        messages_count=count(Message.user_id, users.c.id),
+        following_count=count(FollowersFollowee.followee_id, users.c.id),
+        followers_count=count(FollowersFollowee.follower_id, users.c.id),
+        likes_count=count(Like.user_id, users.c.id),
+    ))
+
+    messages = Message.__table__
+    db.session.execute(messages.update().values(
+        likes_count=count(Like.message_id, messages.c.id),
+    ))
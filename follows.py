@@ -0,0 +1,49 @@
+"""Followers and following lists, a page at a time.
+
+Each page is one SELECT over `follows`, walking the index for the listed
+user's side newest first (by user id; see pagination.py), joined to the
+listed users and to the viewer's own follow of each. So the first page
+costs the same however many followers an account has, and the follow
+buttons need no lookups of their own.
+
+Rows are (User, viewer_follows).
+"""
+
+from sqlalchemy.orm import aliased
+
+from models import db, FollowersFollowee, User
+
+
+def _listed_before(own, listed, user_id, viewer_id, before):
+    viewer = aliased(FollowersFollowee)
+
+    # the columns read backwards, see FollowersFollowee
+    query = (db.session
+             .query(User, viewer.follower_id.isnot(None)
+                    .label('viewer_follows'))
+             .select_from(FollowersFollowee)
+             .join(User, User.id == listed)
+             .outerjoin(viewer, (viewer.followee_id == viewer_id)
+                        & (viewer.follower_id == User.id))
+             .filter(own == user_id, User.deleted_at.is_(None)))
+
+    if before is not None:
+        query = query.filter(listed < before)
+
+    return query.order_by(listed.desc())
+
+
+def following_before(user_id, viewer_id, before):
+    """Query for the users `user_id` follows, after the id `before`."""
+
+    return _listed_before(FollowersFollowee.followee_id,
+                          FollowersFollowee.follower_id,
+                          user_id, viewer_id, before)
+
+
+def followers_before(user_id, viewer_id, before):
+    """Query for the users following `user_id`, after the id `before`."""
+
+    return _listed_before(FollowersFollowee.follower_id,
+                          FollowersFollowee.followee_id,
+                          user_id, viewer_id, before)
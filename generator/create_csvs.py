@@ -3,28 +3,66 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Output is streamed to disk and drawn from seeded random generators, so the
+same arguments always give the same files (for a given --end date), and no
+network access is needed. It scales to production sizes:
+
+    python generator/create_csvs.py --users 10000000 --messages 100000000 \\
+        --follows 200000000 --likes 100000000
+
+and load the result with `FLASK_APP=app.py flask load-data generator`.
+
+The data is shaped like a real social network:
+
+- followers per user follow a power law: a few users are followed by a
+  large share of everyone (the timeline "celebrities")
+- the same users also post the most
+- message timestamps cluster in bursts
+- likes mostly go to a small set of popular messages
+
+Popularity ranks are drawn by inverting the power-law CDF and mapped to
+ids through a seeded permutation, so popular users aren't just the first
+ids and nothing of size users x users is ever built. Users and messages
+are numbered 1..n in file order, so load them into empty tables.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+from datetime import date, datetime, time
+from math import gcd
+
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import get_bursty_datetime, get_random_datetime
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['followee_id', 'follower_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+NUM_LIKES = 2000
 
-fake = Faker()
+# Zipf exponents: how unequal followers, posts and likes are
+FOLLOW_EXPONENT = 1.0
+POST_EXPONENT = 0.8
+LIKE_EXPONENT = 1.1
 
-# Generate random profile image URLs to use for users
+# every user's password is "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+HEADER_IMAGE_URL = '/static/images/warbler-hero.jpg'
+
+# Faker is slow; texts are picked from pools of this size
+POOL_SIZE = 5000
+
+MASK64 = 2 ** 64 - 1
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +70,192 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
+def zipf_rank(n, exponent, u):
+    """Popularity rank in 1..n for a uniform `u` in [0, 1).
+
+    Inverts the CDF of the continuous power law p(r) ~ r ** -exponent.
+    """
+
+    if exponent == 1:
+        rank = n ** u
+    else:
+        a = 1 - exponent
+        rank = ((n ** a - 1) * u + 1) ** (1 / a)
+
+    return min(int(rank), n)
+
+
+def unit(seed, key):
+    """A uniform float in [0, 1) determined by `seed` and `key` (splitmix64)."""
+
+    z = (seed + (key + 1) * 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+
+    return (z ^ (z >> 31)) / 2 ** 64
+
+
+class Permutation:
+    """A seeded shuffle of 1..n, in constant memory: rank -> id."""
+
+    def __init__(self, n, rng):
+        self.n = n
+        self.step = 1
+        if n > 2:
+            self.step = rng.randrange(1, n)
+            while gcd(self.step, n) != 1:
+                self.step = rng.randrange(1, n)
+        self.offset = rng.randrange(n)
+
+    def __call__(self, rank):
+        return (self.step * (rank - 1) + self.offset) % self.n + 1
+
+
+def out_degrees(num_users, total, rng):
+    """(user_id, how many to pick) for every user, about `total` in all."""
+
+    mean = total / num_users
+    for user_id in range(1, num_users + 1):
+        yield user_id, min(round(rng.expovariate(1 / mean)), num_users - 1)
+
+
+def pick_distinct(count, draw, exclude):
+    """Up to `count` distinct values of `draw()`, other than `exclude`."""
+
+    picked = set()
+    for _ in range(count * 10):
+        if len(picked) >= count:
+            break
+        value = draw()
+        if value != exclude:
+            picked.add(value)
+
+    return sorted(picked)
+
+
+def write_users(path, args, fake, rng):
+    bios = [fake.sentence() for _ in range(POOL_SIZE)]
+    cities = [fake.city() for _ in range(POOL_SIZE)]
+    names = [fake.user_name() for _ in range(POOL_SIZE)]
+    domains = [fake.free_email_domain() for _ in range(100)]
+
+    with open(path, 'w', newline='') as users_csv:
+        users_writer = csv.writer(users_csv)
+        users_writer.writerow(USERS_CSV_HEADERS)
+
+        for user_id in range(1, args.users + 1):
+            # the id suffix keeps usernames unique
+            username = f"{rng.choice(names)}_{user_id}"
+            users_writer.writerow([
+                f"{username}@{rng.choice(domains)}",
+                username,
+                rng.choice(image_urls),
+                PASSWORD,
+                rng.choice(bios),
+                HEADER_IMAGE_URL,
+                rng.choice(cities),
+            ])
+
+
+def write_messages(path, args, fake, author_of):
+    texts = [fake.paragraph()[:MAX_WARBLER_LENGTH] for _ in range(POOL_SIZE)]
+    bursts = [get_random_datetime(now=args.end)
+              for _ in range(max(1, args.messages // 1000))]
+
+    with open(path, 'w', newline='') as messages_csv:
+        messages_writer = csv.writer(messages_csv)
+        messages_writer.writerow(MESSAGES_CSV_HEADERS)
+
+        for message_id in range(1, args.messages + 1):
+            messages_writer.writerow([
+                random.choice(texts),
+                get_bursty_datetime(bursts, now=args.end),
+                author_of(message_id),
+            ])
+
+
+def write_follows(path, args, rng, users):
+    def draw():
+        return users(zipf_rank(args.users, FOLLOW_EXPONENT, rng.random()))
+
+    with open(path, 'w', newline='') as follows_csv:
+        follows_writer = csv.writer(follows_csv)
+        follows_writer.writerow(FOLLOWS_CSV_HEADERS)
+
+        written = 0
+        for user_id, count in out_degrees(args.users, args.follows, rng):
+            for followed_id in pick_distinct(count, draw, user_id):
+                # the columns read backwards: followee_id follows follower_id
+                follows_writer.writerow([user_id, followed_id])
+                written += 1
+
+    return written
+
+
+def write_likes(path, args, rng, author_of):
+    messages = Permutation(args.messages, rng)
+
+    def draw():
+        return messages(zipf_rank(args.messages, LIKE_EXPONENT, rng.random()))
+
+    with open(path, 'w', newline='') as likes_csv:
+        likes_writer = csv.writer(likes_csv)
+        likes_writer.writerow(LIKES_CSV_HEADERS)
+
+        written = 0
+        for user_id, count in out_degrees(args.users, args.likes, rng):
+            for message_id in pick_distinct(count, draw, None):
+                # nobody likes their own messages
+                if author_of(message_id) != user_id:
+                    likes_writer.writerow([user_id, message_id])
+                    written += 1
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS,
+                        help="about this many")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="about this many")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime.combine(date.today(), time()),
+                        help="latest message timestamp (default: today)")
+    parser.add_argument('--output', default='generator',
+                        help="directory to write the CSVs to")
+    args = parser.parse_args()
+
+    # one generator per file, so changing one size doesn't reshuffle the rest
+    fake = Faker()
+    fake.seed_instance(args.seed)
+    random.seed(args.seed)
+
+    # popularity rank -> user id, for both followers and posting
+    users = Permutation(args.users, random.Random(args.seed))
+
+    def author_of(message_id):
+        # a pure function of the id, so likes can avoid self-likes
+        # without keeping every message's author in memory
+        u = unit(args.seed, message_id)
+        return users(zipf_rank(args.users, POST_EXPONENT, u))
+
+    write_users(os.path.join(args.output, 'users.csv'), args, fake,
+                random.Random(args.seed + 1))
+    write_messages(os.path.join(args.output, 'messages.csv'), args, fake,
+                   author_of)
+    follows = write_follows(os.path.join(args.output, 'follows.csv'), args,
+                            random.Random(args.seed + 2), users)
+    likes = write_likes(os.path.join(args.output, 'likes.csv'), args,
+                        random.Random(args.seed + 3), author_of)
+
+    print(f"{args.users} users, {args.messages} messages, "
+          f"{follows} follows, {likes} likes")
+
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followee, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(followee_id=followee, follower_id=follower))
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,32 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import datetime, timedelta
+from random import choice, expovariate, random, uniform
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, now=None):
+    """Get a random datetime within the last few years (before `now`)."""
 
-    now = datetime.now()
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
     random_timestamp = uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def get_bursty_datetime(bursts, burst_share=0.6, burst_seconds=3600,
+                        year_gap=2, now=None):
+    """Get a random datetime that often falls just after one of `bursts`.
+
+    `burst_share` of the datetimes land, on average, `burst_seconds` after
+    a random burst (a news event, a viral post); the rest are spread
+    evenly like get_random_datetime().
+    """
+
+    now = now or datetime.now()
+
+    if bursts and random() < burst_share:
+        offset = timedelta(seconds=expovariate(1 / burst_seconds))
+        return min(choice(bursts) + offset, now)
+
+    return get_random_datetime(year_gap, now)
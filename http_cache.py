@@ -0,0 +1,115 @@
+"""HTTP caching: per-route Cache-Control and conditional GET.
+
+Routes declare their policy with `@cache_policy(...)`; anything without
+one gets the old blanket "don't cache" headers. Pages that can be
+revalidated compute a cheap ETag from the rows they depend on (without
+rendering) and answer If-None-Match with a 304. They send no
+Last-Modified: a page depends on profiles, counters, follows and likes
+as well as its messages, none of which a date alone would cover.
+
+ETags also change at least every VALIDATOR_LIFETIME seconds: they are
+built from the profile owner and the viewer, so edits to *other* users
+shown on a page (a message author's new picture) only appear once it rolls
+over. Follower and following lists are built from the users listed.
+"""
+
+from functools import wraps
+from hashlib import sha1
+from time import time
+
+from flask import g, make_response, request, session
+
+DEFAULT_CACHE_CONTROL = "no-cache, no-store, must-revalidate"
+
+VALIDATOR_LIFETIME = 3600
+
+
+def cache_policy(anonymous, logged_in=None):
+    """Set the Cache-Control directives of a route.
+
+    `anonymous` is used for logged-out visitors, `logged_in` (defaulting
+    to `anonymous`) for everyone else.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.cache_control = logged_in if g.user and logged_in else anonymous
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def apply_cache_policy(response):
+    """after_request hook: add the Cache-Control chosen by the route."""
+
+    if request.endpoint == 'static':
+        return response
+
+    cache_control = g.get('cache_control')
+
+    # a page that flashed a message or set a cookie is for this visitor only
+    if cache_control and cache_control.startswith('public') and session.modified:
+        cache_control = 'private' + cache_control[len('public'):]
+
+    if cache_control is None:
+        response.headers['Cache-Control'] = DEFAULT_CACHE_CONTROL
+        response.headers['Pragma'] = "no-cache"
+        response.headers['Expires'] = "0"
+    else:
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Cookie')
+
+    return response
+
+
+def viewer_version():
+    """What of the logged-in user shows up on every page.
+
+    That includes who they follow, for the follow buttons: following one
+    user and unfollowing another leaves the counts as they were.
+    """
+
+    user = g.user
+    if not user:
+        return None
+
+    return (user.id, user.username, user.image_url, user.header_image_url,
+            user.messages_count, user.following_count, user.followers_count,
+            user.likes_count, hash(user.following_ids))
+
+
+def user_version(user):
+    """What of `user` shows up on their profile pages."""
+
+    return (user.id, user.username, user.image_url, user.header_image_url,
+            user.bio, user.location, user.messages_count, user.following_count,
+            user.followers_count, user.likes_count)
+
+
+def make_etag(*parts):
+    """ETag over `parts`, the viewer and the current validator period."""
+
+    period = int(time() // VALIDATOR_LIFETIME)
+    data = repr((parts, viewer_version(), period)).encode('utf-8')
+    return sha1(data).hexdigest()
+
+
+def not_modified(etag):
+    """A 304 response if the client's copy is current, else None."""
+
+    if not request.if_none_match.contains(etag):
+        return None
+
+    return with_validators(make_response('', 304), etag)
+
+
+def with_validators(response, etag):
+    """Add the ETag to `response` (or rendered HTML)."""
+
+    response = make_response(response)
+    response.set_etag(etag)
+
+    return response
@@ -0,0 +1,97 @@
+"""The logged-in user, without a query on every request.
+
+`load_current_user()` returns a `CurrentUser` for `g.user`: an immutable
+snapshot of what the pages show about the logged-in user -- name,
+pictures, counters and who they follow. Snapshots live in the page cache
+under "identity:<id>" for a short while, tagged "user:<id>" and
+"stats:<id>", so the invalidations the write routes already do (profile
+edits, deletes, follows, likes, new messages) drop them too.
+
+Routes that change the user go through `g.user.model`, which loads the
+ORM object the first time it is needed.
+"""
+
+from collections import namedtuple
+
+from models import User
+
+UserSnapshot = namedtuple('UserSnapshot', [
+    'id', 'username', 'image_url', 'header_image_url', 'messages_count',
+    'following_count', 'followers_count', 'likes_count', 'following_ids',
+])
+
+
+def snapshot(user):
+    """UserSnapshot of `user`, whose following ids must be loaded."""
+
+    return UserSnapshot(
+        id=user.id,
+        username=user.username,
+        image_url=user.image_url,
+        header_image_url=user.header_image_url,
+        messages_count=user.messages_count,
+        following_count=user.following_count,
+        followers_count=user.followers_count,
+        likes_count=user.likes_count,
+        following_ids=frozenset(user._following_ids),
+    )
+
+
+class CurrentUser:
+    """The logged-in user: snapshot fields, plus the model on demand."""
+
+    def __init__(self, snapshot, model=None):
+        self._snapshot = snapshot
+        self._model = model
+
+    def __getattr__(self, name):
+        return getattr(self._snapshot, name)
+
+    @property
+    def _following_ids(self):
+        # lets User.is_followed_by() take a CurrentUser
+        return self._snapshot.following_ids
+
+    @property
+    def model(self):
+        """The User row, loaded on first use."""
+
+        if self._model is None:
+            self._model = User.query.get_or_404(self.id)
+            self._model._following_ids = set(self.following_ids)
+
+        return self._model
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return other_user.id in self.following_ids
+
+    def liked_message_ids(self, messages):
+        """Ids of the `messages` this user has liked, fetched in one query."""
+
+        return User.liked_message_ids(self, messages)
+
+
+def load_current_user(user_id, cache, ttl):
+    """CurrentUser for `user_id`, or None if there is no such user.
+
+    A user deleted but not purged yet counts as no user.
+    """
+
+    key = f"identity:{user_id}"
+
+    cached = cache.get(key)
+    if cached is not None:
+        return CurrentUser(cached)
+
+    user = User.query.get(user_id)
+    if user is None or user.deleted_at is not None:
+        return None
+
+    user.load_following_ids()
+    cached = snapshot(user)
+    cache.set(key, cached, tags=[f"user:{user_id}", f"stats:{user_id}"],
+              ttl=ttl)
+
+    return CurrentUser(cached, user)
@@ -0,0 +1,238 @@
+"""Per-request SQL and timing instrumentation.
+
+For every request `Instrumentation` records the number of SQL statements,
+the time spent in them, the time spent rendering templates and the total
+time, into histograms per endpoint. It hooks SQLAlchemy's cursor events
+and Flask's request and template signals, so no route needs changing.
+
+`/metrics` serves the histograms (and any registered gauges) in the
+Prometheus text format to requests with "Authorization: Bearer <token>"
+for `METRICS_TOKEN`. Without a token configured it answers 404.
+
+A sample of requests slower than `SLOW_REQUEST_SECONDS` is logged with
+the SQL they ran.
+"""
+
+from bisect import bisect_left
+from hmac import compare_digest
+from random import random
+from threading import Lock
+from time import perf_counter
+
+from flask import (Response, abort, before_render_template, current_app, g,
+                   has_request_context, request, request_finished,
+                   request_started, template_rendered)
+from sqlalchemy import event
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# metric name -> (bucket bounds, help text)
+METRICS = {
+    'request_seconds': (SECONDS_BUCKETS, "Total request time."),
+    'sql_seconds': (SECONDS_BUCKETS, "Time spent in SQL statements."),
+    'sql_statements': (STATEMENT_BUCKETS, "SQL statements per request."),
+    'template_seconds': (SECONDS_BUCKETS, "Time spent rendering templates."),
+}
+
+PREFIX = 'warbler'
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # the last bucket is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    """What one request has done so far."""
+
+    __slots__ = ('start', 'sql_statements', 'sql_seconds', 'template_seconds',
+                 'template_start', 'statements')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_start = None
+        # (seconds, statement), for the slow request log
+        self.statements = []
+
+
+class Instrumentation:
+    """Collects per-endpoint histograms for an app and serves them."""
+
+    def __init__(self, slow_seconds=0.5, sample_rate=0.1, max_statements=100):
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        self.max_statements = max_statements
+        # (metric, endpoint) -> Histogram
+        self._histograms = {}
+        # prefix -> function returning {name: number}
+        self._gauges = {}
+        self._lock = Lock()
+
+    def init_app(self, app, engine):
+        """Hook into `app` and `engine` and add the /metrics route."""
+
+        event.listen(engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor)
+
+        request_started.connect(self._request_started, app, weak=False)
+        request_finished.connect(self._request_finished, app, weak=False)
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._rendered, app, weak=False)
+
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    def add_gauges(self, prefix, source):
+        """Also report the numbers returned by `source()` as gauges."""
+
+        self._gauges[prefix] = source
+
+    # SQLAlchemy events
+
+    def _before_cursor(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        conn.info.setdefault('query_start', []).append(perf_counter())
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        elapsed = perf_counter() - conn.info['query_start'].pop()
+
+        metrics = g.get('request_metrics') if has_request_context() else None
+        if metrics is None:
+            return
+
+        metrics.sql_statements += 1
+        metrics.sql_seconds += elapsed
+        if len(metrics.statements) < self.max_statements:
+            metrics.statements.append((elapsed, statement))
+
+    # Flask signals
+
+    def _request_started(self, sender, **extra):
+        g.request_metrics = RequestMetrics()
+
+    def _before_render(self, sender, template, context, **extra):
+        metrics = g.get('request_metrics')
+        if metrics is not None:
+            metrics.template_start = perf_counter()
+
+    def _rendered(self, sender, template, context, **extra):
+        metrics = g.get('request_metrics')
+        if metrics is not None and metrics.template_start is not None:
+            metrics.template_seconds += perf_counter() - metrics.template_start
+            metrics.template_start = None
+
+    def _request_finished(self, sender, response, **extra):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return
+
+        total = perf_counter() - metrics.start
+        endpoint = request.endpoint or 'unmatched'
+
+        self.observe(endpoint, {
+            'request_seconds': total,
+            'sql_seconds': metrics.sql_seconds,
+            'sql_statements': metrics.sql_statements,
+            'template_seconds': metrics.template_seconds,
+        })
+
+        if total >= self.slow_seconds and random() < self.sample_rate:
+            self._log_slow(sender, endpoint, response, total, metrics)
+
+    def observe(self, endpoint, values):
+        """Add one request's {metric: value} to `endpoint`'s histograms."""
+
+        with self._lock:
+            for metric, value in values.items():
+                histogram = self._histograms.get((metric, endpoint))
+                if histogram is None:
+                    histogram = Histogram(METRICS[metric][0])
+                    self._histograms[(metric, endpoint)] = histogram
+                histogram.observe(value)
+
+    def _log_slow(self, app, endpoint, response, total, metrics):
+        statements = "\n".join(f"  {seconds * 1000:8.1f}ms  {statement[:500]}"
+                               for seconds, statement in metrics.statements)
+
+        app.logger.warning(
+            "slow request %s %s (%s) -> %s: %.0fms total, %d SQL statements "
+            "in %.0fms, templates %.0fms\n%s",
+            request.method, request.full_path, endpoint, response.status_code,
+            total * 1000, metrics.sql_statements, metrics.sql_seconds * 1000,
+            metrics.template_seconds * 1000, statements)
+
+    # /metrics
+
+    def render(self):
+        """Everything collected, in the Prometheus text format."""
+
+        lines = []
+
+        with self._lock:
+            for metric, (bounds, help_text) in METRICS.items():
+                name = f"{PREFIX}_{metric}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+
+                for (histogram_metric, endpoint), histogram in sorted(
+                        self._histograms.items()):
+                    if histogram_metric != metric:
+                        continue
+
+                    labels = f'endpoint="{endpoint}"'
+                    cumulative = 0
+                    for bound, count in zip(bounds + ('+Inf',),
+                                            histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} '
+                                     f'{cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        for prefix, source in sorted(self._gauges.items()):
+            for key, value in sorted(source().items()):
+                name = f"{PREFIX}_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def _metrics_view(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        if not token:
+            abort(404)
+
+        authorization = request.headers.get('Authorization', '')
+        if not compare_digest(authorization.encode(),
+                              f"Bearer {token}".encode()):
+            abort(403)
+
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def create_instrumentation(app, engine):
+    """Instrument `app` from the `SLOW_REQUEST_*` settings."""
+
+    instrumentation = Instrumentation(
+        slow_seconds=app.config.get('SLOW_REQUEST_SECONDS', 0.5),
+        sample_rate=app.config.get('SLOW_REQUEST_SAMPLE_RATE', 0.1),
+    )
+    instrumentation.init_app(app, engine)
+
+    return instrumentation
@@ -0,0 +1,393 @@
+"""Background jobs: side effects of writes, run after the request.
+
+A route calls `queue.enqueue(kind, payload)` before committing; the job
+is a row in the `jobs` table, committed together with the change that
+caused it, so it is never lost or run for a change that rolled back.
+`flask work` runs the jobs from a pool of threads (and processes).
+
+- Handlers are registered per kind with `@queue.handler(kind)`. With
+  `batch=True` a handler receives the payloads of up to `batch_size`
+  jobs of its kind at once.
+- A failed job is retried after an exponentially growing, jittered delay,
+  up to `max_attempts` times; then it is left 'failed' for inspection.
+- Jobs enqueued with an idempotency `key` are only stored once per key.
+- A worker claims jobs with a lease; jobs whose worker died are claimed
+  again when the lease runs out.
+- In eager mode (`JOBS_EAGER`) `enqueue` runs the handler on the spot,
+  inside the caller's transaction, as if there were no queue. Jobs that
+  handler enqueues run after it returns, not nested inside it. Kinds
+  registered with `eager=False` (work too long for a request) are queued
+  for the worker even then.
+"""
+
+import json
+import logging
+import multiprocessing
+import random
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class Job(db.Model):
+    """A queued call of a job handler."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # JSON
+    payload = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    idempotency_key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    # 'pending', 'running', 'done' or 'failed'
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='pending',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # not before this
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # the claim of the worker running it, until `locked_until`
+    claimed_by = db.Column(
+        db.Text,
+    )
+
+    locked_until = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+
+db.Index('ix_jobs_status_run_at', Job.status, Job.run_at)
+
+
+class JobQueue:
+    """Job handlers and the `jobs` table they are run from."""
+
+    def __init__(self, eager=False, batch_size=100, max_attempts=5,
+                 retry_delay=2, max_retry_delay=3600, lease=300,
+                 retention=86400):
+        self.eager = eager
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self.retention = retention
+        # kind -> (handler, takes a list of payloads?, may run eagerly?)
+        self._handlers = {}
+        # eager mode: jobs enqueued by the handler running in this thread
+        self._local = threading.local()
+
+    def handler(self, kind, batch=False, eager=True):
+        """Decorator: run jobs of `kind` with the decorated function.
+
+        With `eager=False` they are never run inside the request.
+        """
+
+        def decorator(function):
+            self._handlers[kind] = (function, batch, eager)
+            return function
+
+        return decorator
+
+    def _call(self, kind, payloads):
+        function, batch, _ = self._handlers[kind]
+
+        if batch:
+            function(payloads)
+        else:
+            for payload in payloads:
+                function(payload)
+
+    # producing
+
+    def enqueue(self, kind, payload, key=None, delay=0):
+        """Queue a job in the current transaction; the caller commits.
+
+        With a `key`, a job with the same key is only ever queued once.
+        """
+
+        if kind not in self._handlers:
+            raise KeyError(f"no handler for {kind!r} jobs")
+
+        if self.eager and self._handlers[kind][2]:
+            self._run_eagerly(kind, payload)
+            return
+
+        values = {
+            'kind': kind,
+            'payload': json.dumps(payload),
+            'idempotency_key': key,
+            'status': 'pending',
+            'attempts': 0,
+            'run_at': datetime.utcnow() + timedelta(seconds=delay),
+        }
+
+        dialect = db.session.get_bind().dialect.name
+        if key is None:
+            statement = Job.__table__.insert()
+        elif dialect == 'postgresql':
+            statement = (postgresql_insert(Job.__table__)
+                         .on_conflict_do_nothing(
+                             index_elements=['idempotency_key']))
+        else:
+            statement = Job.__table__.insert().prefix_with('OR IGNORE')
+
+        db.session.execute(statement.values(**values))
+
+    def _run_eagerly(self, kind, payload):
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            # a handler is running; a job re-enqueueing itself must not
+            # recurse once per round
+            pending.append((kind, payload))
+            return
+
+        self._local.pending = pending = deque([(kind, payload)])
+        try:
+            while pending:
+                kind, payload = pending.popleft()
+                self._call(kind, [payload])
+        finally:
+            self._local.pending = None
+
+    # consuming
+
+    def _claimable(self, now):
+        """Due jobs nobody is running, or whose worker's lease ran out."""
+
+        return (or_(Job.status == 'pending',
+                    (Job.status == 'running') & (Job.locked_until < now))
+                & (Job.run_at <= now))
+
+    def claim(self):
+        """Lease the next due job and more of its kind; return them.
+
+        The update only takes jobs still claimable, so concurrent workers
+        never end up with the same job.
+        """
+
+        now = datetime.utcnow()
+        due = (db.session.query(Job.id, Job.kind)
+               .filter(self._claimable(now))
+               .order_by(Job.run_at, Job.id))
+
+        first = due.first()
+        if first is None:
+            db.session.commit()
+            return []
+
+        ids = [row.id for row in (due
+                                  .filter(Job.kind == first.kind)
+                                  .limit(self.batch_size)
+                                  .with_for_update(skip_locked=True))]
+
+        claim = uuid4().hex
+        (Job.query
+         .filter(Job.id.in_(ids), self._claimable(now))
+         .update({Job.status: 'running',
+                  Job.claimed_by: claim,
+                  Job.locked_until: now + timedelta(seconds=self.lease)},
+                 synchronize_session=False))
+        db.session.commit()
+
+        return Job.query.filter_by(claimed_by=claim).order_by(Job.id).all()
+
+    def _retry_at(self, attempts):
+        delay = min(self.retry_delay * 2 ** (attempts - 1),
+                    self.max_retry_delay)
+        return datetime.utcnow() + timedelta(
+            seconds=delay * random.uniform(0.5, 1.5))
+
+    def run_once(self):
+        """Claim and run one batch of jobs; return how many ran."""
+
+        jobs = self.claim()
+        if not jobs:
+            return 0
+
+        kind = jobs[0].kind
+        ids = [job.id for job in jobs]
+
+        try:
+            self._call(kind, [json.loads(job.payload) for job in jobs])
+        except Exception as error:
+            db.session.rollback()
+            logger.exception("%d %s job(s) failed", len(ids), kind)
+            self._failed(ids, f"{type(error).__name__}: {error}")
+        else:
+            # in the handler's transaction: done exactly when it is
+            (Job.query
+             .filter(Job.id.in_(ids))
+             .update({Job.status: 'done',
+                      Job.claimed_by: None,
+                      Job.locked_until: None,
+                      Job.finished_at: datetime.utcnow()},
+                     synchronize_session=False))
+            db.session.commit()
+
+        return len(ids)
+
+    def _failed(self, ids, error):
+        for job in Job.query.filter(Job.id.in_(ids)):
+            job.attempts += 1
+            job.last_error = error[:2000]
+            job.claimed_by = None
+            job.locked_until = None
+
+            if job.attempts >= self.max_attempts:
+                job.status = 'failed'
+                job.finished_at = datetime.utcnow()
+            else:
+                job.status = 'pending'
+                job.run_at = self._retry_at(job.attempts)
+
+        db.session.commit()
+
+    def purge(self):
+        """Delete jobs done more than `retention` seconds ago."""
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        deleted = (Job.query
+                   .filter(Job.status == 'done', Job.finished_at < cutoff)
+                   .delete(synchronize_session=False))
+        db.session.commit()
+
+        return deleted
+
+    def stats(self):
+        """{status: number of jobs}, for the metrics endpoint."""
+
+        counts = dict.fromkeys(['pending', 'running', 'done', 'failed'], 0)
+        counts.update(db.session
+                      .query(Job.status, func.count())
+                      .group_by(Job.status))
+
+        return counts
+
+    # workers
+
+    def _work(self, app, stop, burst, poll_interval):
+        with app.app_context():
+            try:
+                while not stop.is_set():
+                    try:
+                        ran = self.run_once()
+                    except Exception:
+                        # e.g. the database went away; try again shortly
+                        db.session.rollback()
+                        logger.exception("job worker error")
+                        ran = 0
+
+                    if not ran:
+                        if burst:
+                            return
+                        stop.wait(poll_interval)
+            finally:
+                db.session.remove()
+
+    def _work_threads(self, app, threads, burst, poll_interval):
+        stop = threading.Event()
+        workers = [threading.Thread(target=self._work,
+                                    args=(app, stop, burst, poll_interval))
+                   for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            for worker in workers:
+                # a timeout, so Ctrl-C isn't blocked
+                while worker.is_alive():
+                    worker.join(1)
+        except KeyboardInterrupt:
+            # let running jobs finish
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def _work_process(self, app, threads, burst, poll_interval):
+        # connections can't be shared with the parent process
+        with app.app_context():
+            db.engine.dispose()
+
+        self._work_threads(app, threads, burst, poll_interval)
+
+    def work(self, app, threads=4, processes=1, burst=False, poll_interval=1):
+        """Run jobs until interrupted (or, with `burst`, the queue is empty).
+
+        Runs `threads` threads in each of `processes` processes.
+        """
+
+        with app.app_context():
+            self.purge()
+
+        if processes <= 1:
+            self._work_threads(app, threads, burst, poll_interval)
+            return
+
+        context = multiprocessing.get_context('fork')
+        children = [context.Process(target=self._work_process,
+                                    args=(app, threads, burst, poll_interval))
+                    for _ in range(processes)]
+        for child in children:
+            child.start()
+
+        # Ctrl-C reaches the children too; they stop by themselves
+        for child in children:
+            while child.is_alive():
+                try:
+                    child.join()
+                except KeyboardInterrupt:
+                    pass
+
+
+def create_job_queue(app):
+    """A JobQueue from the `JOBS_*` settings."""
+
+    return JobQueue(eager=app.config.get('JOBS_EAGER', False),
+                    batch_size=app.config.get('JOBS_BATCH_SIZE', 100),
+                    max_attempts=app.config.get('JOBS_MAX_ATTEMPTS', 5))
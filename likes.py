@@ -0,0 +1,159 @@
+"""Liking and unliking that stays correct under concurrent requests.
+
+`likes` has a unique index on (user_id, message_id), so a message is
+liked at most once per user however many requests race. Rather than
+reading first and writing after (and double counting when two requests
+both see "not liked yet"), likes are inserted and deleted with statements
+that report what they actually changed, and counters move by exactly
+that:
+
+- PostgreSQL: `INSERT ... ON CONFLICT DO NOTHING RETURNING` and
+  `DELETE ... RETURNING`; `toggle()` is a single statement.
+- SQLite: `INSERT OR IGNORE` and `DELETE`, one row at a time, using each
+  statement's row count. SQLite has one writer at a time, so nothing else
+  changes the likes between them.
+
+The caller commits.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+from counters import adjust
+from models import db, visible_messages, Like, Message, User
+from pagination import joined_messages_before
+
+likes = Like.__table__
+
+# Delete the like if there is one, else insert it; move both counters by
+# what changed and answer with the new state and like count.
+POSTGRES_TOGGLE = text("""
+    WITH unliked AS (
+        DELETE FROM likes
+        WHERE user_id = :user_id AND message_id = :message_id
+        RETURNING 1
+    ), liked AS (
+        INSERT INTO likes (user_id, message_id, timestamp)
+        SELECT :user_id, :message_id, :timestamp
+        WHERE NOT EXISTS (SELECT 1 FROM unliked)
+        ON CONFLICT (user_id, message_id) DO NOTHING
+        RETURNING 1
+    ), delta AS (
+        SELECT (SELECT count(*) FROM liked)
+               - (SELECT count(*) FROM unliked) AS n
+    ), user_counted AS (
+        UPDATE users SET likes_count = likes_count + delta.n
+        FROM delta
+        WHERE users.id = :user_id AND delta.n <> 0
+    ), message_counted AS (
+        UPDATE messages SET likes_count = likes_count + delta.n
+        FROM delta
+        WHERE messages.id = :message_id
+        RETURNING messages.likes_count
+    )
+    SELECT NOT EXISTS (SELECT 1 FROM unliked) AS liked,
+           (SELECT likes_count FROM message_counted) AS likes
+""")
+
+
+def _is_postgresql():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def _counted(user_id, message_ids, delta):
+    if message_ids:
+        adjust(Message, message_ids, likes_count=delta)
+        adjust(User, user_id, likes_count=delta * len(message_ids))
+
+    return message_ids
+
+
+def add(user_id, message_ids):
+    """Have `user_id` like `message_ids`; return the ids newly liked.
+
+    The caller checks the messages exist and aren't the user's own.
+    """
+
+    if not message_ids:
+        return []
+
+    if _is_postgresql():
+        now = datetime.utcnow()
+        statement = (postgresql_insert(likes)
+                     .values([{'user_id': user_id, 'message_id': message_id,
+                               'timestamp': now}
+                              for message_id in message_ids])
+                     .on_conflict_do_nothing(
+                         index_elements=['user_id', 'message_id'])
+                     .returning(likes.c.message_id))
+        new_ids = [row.message_id
+                   for row in db.session.execute(statement)]
+    else:
+        statement = likes.insert().prefix_with('OR IGNORE')
+        new_ids = [message_id for message_id in message_ids
+                   if db.session.execute(statement.values(
+                       user_id=user_id, message_id=message_id)).rowcount]
+
+    return _counted(user_id, sorted(new_ids), 1)
+
+
+def remove(user_id, message_ids):
+    """Have `user_id` stop liking `message_ids`; return the ids unliked."""
+
+    if not message_ids:
+        return []
+
+    if _is_postgresql():
+        statement = (likes.delete()
+                     .where(likes.c.user_id == user_id)
+                     .where(likes.c.message_id.in_(message_ids))
+                     .returning(likes.c.message_id))
+        old_ids = [row.message_id for row in db.session.execute(statement)]
+    else:
+        old_ids = [message_id for message_id in message_ids
+                   if db.session.execute(
+                       likes.delete()
+                       .where(likes.c.user_id == user_id)
+                       .where(likes.c.message_id == message_id)).rowcount]
+
+    return _counted(user_id, sorted(old_ids), -1)
+
+
+def toggle(user_id, message_id):
+    """Like `message_id` if `user_id` doesn't yet, else unlike it.
+
+    Returns (liked now?, the message's like count). Of two toggles racing
+    to like, one likes and the other finds it liked.
+    """
+
+    if _is_postgresql():
+        row = db.session.execute(POSTGRES_TOGGLE,
+                                 {'user_id': user_id,
+                                  'message_id': message_id,
+                                  'timestamp': datetime.utcnow()})
+        liked, count = row.first()
+        return liked, count
+
+    liked = not remove(user_id, [message_id])
+    if liked:
+        add(user_id, [message_id])
+    count = (db.session.query(Message.likes_count)
+             .filter(Message.id == message_id)
+             .scalar())
+
+    return liked, count
+
+
+def liked_before(user_id, before):
+    """Query for the messages `user_id` liked, last liked first.
+
+    Rows are (Message, liked_at); `before` is a (liked_at, message id)
+    pagination key.
+    """
+
+    return (joined_messages_before(visible_messages(Message.query), Like,
+                                   before)
+            .filter(Like.user_id == user_id)
+            .add_columns(Like.timestamp.label('liked_at')))
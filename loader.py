@@ -0,0 +1,269 @@
+"""Bulk loading of users, messages, follows and likes from files.
+
+Rows are streamed from CSV (with a header) or JSON Lines files in chunks
+of `chunk_size`, so memory use doesn't depend on the file size. Each
+chunk is one transaction: `COPY ... FROM STDIN` on PostgreSQL, an
+executemany INSERT elsewhere (SQLite). The number of rows loaded from a
+file is saved in `load_checkpoints` in the same transaction, so an
+interrupted load picks up exactly where it stopped. Checkpoints are kept
+per file size and modification time: running again over the same files
+loads nothing new, while regenerated files are loaded from the start.
+
+`load_directory()` drops a table's secondary indexes before loading it
+and builds them once afterwards, which is much faster than maintaining
+them row by row.
+
+Counters and timelines aren't touched; run `counters.reconcile()` and
+clear the timelines after loading (`flask load-data` does both).
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from itertools import chain, islice
+from time import monotonic
+
+from sqlalchemy import func, inspect, select
+
+from models import db
+
+# parents before children, for the foreign keys
+LOAD_ORDER = ['users', 'messages', 'follows', 'likes']
+
+FORMATS = ['.csv', '.jsonl']
+
+
+class LoadCheckpoint(db.Model):
+    """How many rows of a file have been loaded."""
+
+    __tablename__ = 'load_checkpoints'
+
+    source = db.Column(db.Text, primary_key=True)
+
+    rows = db.Column(db.Integer, nullable=False)
+
+
+def read_rows(path):
+    """Yield each row of a CSV or JSON Lines file as a dict."""
+
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+
+    return datetime.fromisoformat(value)
+
+
+def _converter(column):
+    """Function turning a file value into what `column` stores."""
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+
+    if python_type is datetime:
+        convert = _parse_datetime
+    elif python_type is int:
+        convert = int
+    else:
+        convert = str
+
+    def converter(value):
+        # empty CSV fields are NULL
+        if value is None or value == '':
+            return None
+        return convert(value)
+
+    return converter
+
+
+def _row_builder(table, columns):
+    """Function turning a file row into a tuple of `table` values.
+
+    Returns it with the column names of the tuple: `columns` followed by
+    the missing columns that have a Python-side default.
+    """
+
+    converters = [(name, _converter(table.c[name])) for name in columns]
+
+    defaults = [column for column in table.columns
+                if column.name not in columns
+                and column.default is not None
+                and (column.default.is_scalar or column.default.is_callable)]
+    names = list(columns) + [column.name for column in defaults]
+
+    def build(row):
+        values = [convert(row.get(name)) for name, convert in converters]
+        for column in defaults:
+            if column.default.is_scalar:
+                values.append(column.default.arg)
+            else:
+                values.append(column.default.arg(None))
+        return tuple(values)
+
+    return names, build
+
+
+def _copy(conn, table, names, rows):
+    """COPY `rows` into `table` through psycopg2."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(names)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def _insert(conn, table, names, rows):
+    """executemany INSERT of `rows` into `table`."""
+
+    conn.execute(table.insert(), [dict(zip(names, row)) for row in rows])
+
+
+def _source(table, path):
+    """Checkpoint key for loading `path` into `table`, and its prefix.
+
+    The prefix names the file; the rest changes whenever the file does.
+    """
+
+    stat = os.stat(path)
+    prefix = f"{table.name}:{os.path.abspath(path)}:"
+    return f"{prefix}{stat.st_size}:{stat.st_mtime_ns}", prefix
+
+
+def _set_checkpoint(conn, source, prefix, rows):
+    """Record `rows` done for `source`, replacing older versions of it."""
+
+    checkpoints = LoadCheckpoint.__table__
+    conn.execute(checkpoints.delete()
+                 .where(checkpoints.c.source.startswith(prefix,
+                                                        autoescape=True)))
+    conn.execute(checkpoints.insert().values(source=source, rows=rows))
+
+
+def _get_checkpoint(engine, source):
+    checkpoints = LoadCheckpoint.__table__
+    return engine.execute(select([checkpoints.c.rows])
+                          .where(checkpoints.c.source == source)).scalar()
+
+
+def load_file(engine, table, path, chunk_size=10000, resume=True,
+              progress=None):
+    """Load the rows of `path` into `table`; return (rows, seconds).
+
+    With `resume`, rows loaded by an earlier, interrupted run are
+    skipped. `progress(table_name, rows, seconds)` is called after each
+    chunk.
+    """
+
+    LoadCheckpoint.__table__.create(engine, checkfirst=True)
+
+    source, prefix = _source(table, path)
+    done = (_get_checkpoint(engine, source) if resume else None) or 0
+    write = _copy if engine.dialect.name == 'postgresql' else _insert
+
+    rows = read_rows(path)
+    first = next(rows, None)
+    if first is None:
+        return 0, 0.0
+
+    names, build = _row_builder(table, list(first))
+    rows = islice(chain([first], rows), done, None)
+
+    loaded = 0
+    start = monotonic()
+
+    while True:
+        chunk = [build(row) for row in islice(rows, chunk_size)]
+        if not chunk:
+            break
+
+        with engine.begin() as conn:
+            write(conn, table, names, chunk)
+            done += len(chunk)
+            _set_checkpoint(conn, source, prefix, done)
+
+        loaded += len(chunk)
+        if progress:
+            progress(table.name, loaded, monotonic() - start)
+
+    # ids given explicitly don't advance the sequence
+    if 'id' in names and engine.dialect.name == 'postgresql':
+        engine.execute(
+            select([func.setval(func.pg_get_serial_sequence(table.name, 'id'),
+                                func.max(table.c.id))]))
+
+    return loaded, monotonic() - start
+
+
+def drop_indexes(engine, table):
+    """Drop the secondary indexes of `table` that exist."""
+
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+
+    for index in table.indexes:
+        if index.name in existing:
+            index.drop(engine)
+
+
+def create_indexes(engine, table):
+    """Create the secondary indexes of `table` that are missing."""
+
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(engine)
+
+
+def find_file(directory, name):
+    """Path of `name`.csv or `name`.jsonl in `directory`, or None."""
+
+    for extension in FORMATS:
+        path = os.path.join(directory, name + extension)
+        if os.path.exists(path):
+            return path
+
+    return None
+
+
+def load_directory(engine, directory, chunk_size=10000, resume=True,
+                   defer_indexes=True, progress=None):
+    """Load each table's file in `directory`, in LOAD_ORDER.
+
+    Returns {table name: (rows, seconds)} for the files found.
+    """
+
+    results = {}
+
+    for name in LOAD_ORDER:
+        path = find_file(directory, name)
+        if path is None:
+            continue
+
+        table = db.metadata.tables[name]
+
+        if defer_indexes:
+            drop_indexes(engine, table)
+
+        results[name] = load_file(engine, table, path, chunk_size=chunk_size,
+                                  resume=resume, progress=progress)
+
+        # also after a failed earlier run that left them dropped
+        create_indexes(engine, table)
+
+    return results
@@ -0,0 +1,246 @@
+"""Bring an existing Warbler database up to date with models.py.
+
+`db.create_all()` only creates missing tables; `upgrade()` also adds the
+columns and indexes declared on the models since the tables were created,
+filling in new required columns and fixing the rows a new unique index
+would reject, and drops indexes they replaced.
+`explain_queries()` checks that the hot queries actually use them.
+
+Run these through the Flask CLI:
+
+    FLASK_APP=app.py flask upgrade-db
+    FLASK_APP=app.py flask explain-queries
+"""
+
+from sqlalchemy import func, inspect, literal_column, select
+from sqlalchemy.schema import CreateColumn
+
+from models import (db, MESSAGE_SEARCH_VECTOR, POSTGRES_INDEXES,
+                    USER_SEARCH_VECTOR, FollowersFollowee, Like, Message, User)
+from follows import followers_before
+from likes import liked_before
+from pagination import messages_before, users_before
+from tags import mentions_before, tagged_before
+from timelines import TimelineEntry
+
+
+def dedupe_likes(conn):
+    """Delete repeated likes of a message by a user, keeping the first.
+
+    Fixes the counters they inflated; returns how many were deleted.
+    """
+
+    likes = Like.__table__
+    pairs = (select([likes.c.user_id, likes.c.message_id])
+             .group_by(likes.c.user_id, likes.c.message_id)
+             .having(func.count() > 1))
+    duplicated = conn.execute(pairs).fetchall()
+    if not duplicated:
+        return 0
+
+    first_ids = (select([func.min(likes.c.id)])
+                 .group_by(likes.c.user_id, likes.c.message_id))
+    deleted = conn.execute(likes.delete()
+                           .where(likes.c.id.notin_(first_ids))).rowcount
+
+    for model, column, ids in [
+            (User, likes.c.user_id, {row.user_id for row in duplicated}),
+            (Message, likes.c.message_id,
+             {row.message_id for row in duplicated})]:
+        table = model.__table__
+        count = select([func.count()]).where(column == table.c.id).as_scalar()
+        conn.execute(table.update()
+                     .where(table.c.id.in_(ids))
+                     .values(likes_count=count))
+
+    return deleted
+
+
+def backfill_like_timestamps(conn):
+    """Date likes from before likes were dated as their message."""
+
+    likes = Like.__table__
+    messages = Message.__table__
+    conn.execute(likes.update().values(
+        timestamp=select([messages.c.timestamp])
+        .where(messages.c.id == likes.c.message_id)
+        .as_scalar()))
+
+
+# new required columns -> (a default the rows already there get when the
+# column is added, what then fills them in)
+BACKFILLS = {
+    'likes.timestamp': ("'1970-01-01 00:00:00'", backfill_like_timestamps),
+}
+
+# index name -> what has to run before it can be built
+BEFORE_INDEX = {
+    'uq_likes_user_id_message_id': dedupe_likes,
+}
+
+# indexes replaced by others, dropped if still there
+OBSOLETE_INDEXES = {
+    'likes': ['ix_likes_user_id_message_id'],
+}
+
+
+def upgrade(engine):
+    """Create missing tables, columns and indexes; return what changed."""
+
+    db.metadata.create_all(engine)
+
+    inspector = inspect(engine)
+    changes = []
+
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                backfill = BACKFILLS.get(f"{table.name}.{column.name}")
+                if backfill:
+                    ddl = f"{ddl} DEFAULT {backfill[0]}"
+                engine.execute(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                if backfill:
+                    with engine.begin() as conn:
+                        backfill[1](conn)
+                changes.append(f"created column {table.name}.{column.name}")
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                if index.name in BEFORE_INDEX:
+                    with engine.begin() as conn:
+                        fixed = BEFORE_INDEX[index.name](conn)
+                    if fixed:
+                        changes.append(f"fixed {fixed} row(s) of {table.name} "
+                                       f"for index {index.name}")
+                index.create(engine)
+                changes.append(f"created index {index.name}")
+
+        for name in OBSOLETE_INDEXES.get(table.name, []):
+            if name in existing:
+                engine.execute(f"DROP INDEX {name}")
+                changes.append(f"dropped index {name}")
+
+    if engine.dialect.name == 'postgresql':
+        for statement in POSTGRES_INDEXES:
+            engine.execute(statement)
+
+    return changes
+
+
+def _hot_queries(engine):
+    """(description, query, index it should use) for each hot query.
+
+    These mirror the queries the routes run; the bound values don't need
+    to exist.
+    """
+
+    queries = [
+        ("homepage: warm timeline",
+         TimelineEntry.query
+         .filter(TimelineEntry.user_id == 1)
+         .order_by(TimelineEntry.timestamp.desc(),
+                   TimelineEntry.message_id.desc())
+         .limit(101),
+         'ix_timeline_entries_user_id_timestamp'),
+
+        ("homepage: cold timeline",
+         messages_before(Message.query.filter(Message.user_id.in_([1, 2])),
+                         None)
+         .limit(200),
+         'ix_messages_user_id_timestamp'),
+
+        ("homepage: fan-out to followers",
+         db.session.query(FollowersFollowee.followee_id)
+         .filter(FollowersFollowee.follower_id == 1),
+         'ix_follows_follower_id_followee_id'),
+
+        ("users_followers: a page of followers",
+         followers_before(1, 2, None).limit(61),
+         'ix_follows_follower_id_followee_id'),
+
+        ("users_show: profile messages",
+         messages_before(Message.query.filter(Message.user_id == 1), None)
+         .limit(101),
+         'ix_messages_user_id_timestamp'),
+
+        ("messages_show: has the user liked it",
+         Like.query.filter_by(message_id=1, user_id=1).limit(1),
+         'uq_likes_user_id_message_id'),
+
+        ("show_likes: messages a user liked",
+         liked_before(1, None).limit(101),
+         'ix_likes_user_id_timestamp'),
+
+        ("show_tag: tagged messages",
+         tagged_before('abc', None).limit(101),
+         'ix_message_tags_tag_timestamp'),
+
+        ("show_mentions: messages mentioning a user",
+         mentions_before(1, None).limit(101),
+         'ix_mentions_user_id_timestamp'),
+    ]
+
+    # only PostgreSQL has indexes that can serve LIKE '%q%' and full-text
+    # search
+    if engine.dialect.name == 'postgresql':
+        queries.append(
+            ("list_users: username search",
+             users_before(User.query.filter(User.username.like('%abc%')),
+                          None)
+             .limit(61),
+             'ix_users_username_trgm'))
+
+        for description, model, vector, config, index in [
+                ("search: messages", Message, MESSAGE_SEARCH_VECTOR,
+                 'english', 'ix_messages_text_search'),
+                ("search: users", User, USER_SEARCH_VECTOR,
+                 'simple', 'ix_users_profile_search')]:
+            tsquery = func.plainto_tsquery(literal_column(f"'{config}'"),
+                                           'abc')
+            queries.append(
+                (description,
+                 db.session.query(model.id)
+                 .filter(literal_column(vector).op('@@')(tsquery))
+                 .limit(101),
+                 index))
+
+    return queries
+
+
+def explain_queries(engine):
+    """EXPLAIN each hot query; return (description, index, ok, plan) tuples.
+
+    On PostgreSQL sequential scans are switched off for the check, so a
+    small or empty database still shows whether the index is usable.
+    """
+
+    if engine.dialect.name == 'postgresql':
+        explain = "EXPLAIN "
+    else:
+        explain = "EXPLAIN QUERY PLAN "
+
+    results = []
+
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.execute("SET enable_seqscan = off")
+
+        for description, query, index in _hot_queries(engine):
+            compiled = query.statement.compile(dialect=engine.dialect)
+            params = compiled.construct_params()
+            if compiled.positional:
+                params = [params[name] for name in compiled.positiontup]
+
+            rows = conn.execute(explain + str(compiled), params)
+            plan = "\n".join(" ".join(str(col) for col in row) for row in rows)
+            results.append((description, index, index in plan, plan))
+
+        if engine.dialect.name == 'postgresql':
+            conn.execute("RESET enable_seqscan")
+
+    return results
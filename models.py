@@ -2,15 +2,21 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, exists
+
+from passwords import PasswordHasher
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
+hasher = PasswordHasher()
 
 
 class FollowersFollowee(db.Model):
-    """Connection of a follower <-> followee."""
+    """Connection of a follower <-> followee.
+
+    Note the column names read backwards: a row (followee_id=A,
+    follower_id=B) means A follows B -- see `User.following`.
+    """
 
     __tablename__ = 'follows'
 
@@ -26,6 +32,13 @@ class FollowersFollowee(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # the primary key covers "who does A follow"; this covers
+        # "who follows B"
+        db.Index('ix_follows_follower_id_followee_id',
+                 'follower_id', 'followee_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -72,6 +85,42 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts for profile cards, kept up to date by the routes
+    # (see counters.py) so rendering a profile doesn't count relationships.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # set when the account is deleted, until accounts.py purges it
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message', backref='user')
 
     followers = db.relationship(
@@ -86,20 +135,59 @@ class User(db.Model):
         secondary="likes",
         backref="liked_messages")
 
+    # ids of the users this user follows, once `load_following_ids()` ran
+    _following_ids = None
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def liked_message_ids(self, messages):
+        """Ids of the `messages` this user has liked, fetched in one query."""
+
+        message_ids = [msg.id for msg in messages]
+        if not message_ids:
+            return set()
+
+        return {like.message_id for like in (
+            db.session
+            .query(Like.message_id)
+            .filter(Like.user_id == self.id, Like.message_id.in_(message_ids)))}
+
+    @staticmethod
+    def _follows(follower_id, followee_id):
+        """Does a user follow another? A single EXISTS query."""
+
+        return db.session.query(exists().where(
+            (FollowersFollowee.followee_id == follower_id)
+            & (FollowersFollowee.follower_id == followee_id))).scalar()
+
+    def load_following_ids(self):
+        """Load the ids of everyone this user follows, in one query.
+
+        After this, `is_following()` is a set lookup. Used for the logged-in
+        user, whose follow buttons appear next to every user on a page.
+        """
+
+        self._following_ids = {row.follower_id for row in (
+            db.session
+            .query(FollowersFollowee.follower_id)
+            .filter(FollowersFollowee.followee_id == self.id))}
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        if other_user._following_ids is not None:
+            return self.id in other_user._following_ids
+
+        return self._follows(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        if self._following_ids is not None:
+            return other_user.id in self._following_ids
+
+        return self._follows(self.id, other_user.id)
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -108,7 +196,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -129,13 +217,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A password hashed with an outdated work factor is rehashed; the
+        caller commits the change.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -159,7 +252,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -168,6 +261,13 @@ class Message(db.Model):
         nullable=False,
     )
 
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
 
 class Like(db.Model):
     """An individual message ("warble")."""
@@ -191,6 +291,62 @@ class Like(db.Model):
         nullable=False,
     )
 
+    # when it was liked, for the user's likes page
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        # a message is liked once per user, however requests race (see
+        # likes.py)
+        db.Index('uq_likes_user_id_message_id', 'user_id', 'message_id',
+                 unique=True),
+        db.Index('ix_likes_message_id', 'message_id'),
+        db.Index('ix_likes_user_id_timestamp', 'user_id', timestamp.desc(),
+                 message_id.desc()),
+    )
+
+
+# Profiles and timelines list a user's messages newest first.
+db.Index('ix_messages_user_id_timestamp',
+         Message.user_id, Message.timestamp.desc(), Message.id.desc())
+
+# Full-text search documents (see search.py); queries must use these exact
+# expressions for PostgreSQL to use the indexes below.
+MESSAGE_SEARCH_VECTOR = "to_tsvector('english', text)"
+USER_SEARCH_VECTOR = ("to_tsvector('simple', coalesce(username, '') || ' ' || "
+                      "coalesce(bio, '') || ' ' || coalesce(location, ''))")
+
+# Indexes only PostgreSQL can build: a trigram GIN index so that user search
+# (username LIKE '%q%') doesn't scan the whole table, and GIN indexes for
+# full-text search.
+POSTGRES_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+    "ON users USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_text_search "
+    f"ON messages USING gin ({MESSAGE_SEARCH_VECTOR})",
+    "CREATE INDEX IF NOT EXISTS ix_users_profile_search "
+    f"ON users USING gin ({USER_SEARCH_VECTOR})",
+]
+
+# after every table exists
+for statement in POSTGRES_INDEXES:
+    event.listen(db.metadata, 'after_create',
+                 DDL(statement).execute_if(dialect='postgresql'))
+
+
+def visible_messages(query):
+    """Filter a message query to messages by users who aren't deleted.
+
+    A deleted user's messages stay until their purge job gets to them
+    (see accounts.py); nothing should show them in the meantime.
+    """
+
+    return query.join(Message.user).filter(User.deleted_at.is_(None))
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -200,3 +356,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    hasher.init_app(app)
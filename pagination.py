@@ -0,0 +1,122 @@
+"""Keyset ("cursor") pagination for Warbler.
+
+Pages are requested with `?before=<cursor>`, where the cursor identifies
+the last row of the previous page. Messages are keyed on (timestamp, id),
+users on id, both newest first -- so every page is an index range scan,
+however deep it is. Messages listed through another table (tags, mentions,
+likes) are keyed on that table's (timestamp, message_id) instead.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, request, url_for
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+
+from models import Message, User
+
+CURSOR_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S%f'
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def timestamp_cursor(timestamp, id):
+    """Cursor pointing just past the row keyed (`timestamp`, `id`)."""
+
+    return f"{timestamp.strftime(CURSOR_TIMESTAMP_FORMAT)}-{id}"
+
+
+def message_cursor(message):
+    """Cursor pointing just past `message`."""
+
+    return timestamp_cursor(message.timestamp, message.id)
+
+
+def parse_message_cursor(cursor):
+    """Parse a message cursor into (timestamp, id); 400 if it's garbage."""
+
+    if not cursor:
+        return None
+
+    try:
+        timestamp, message_id = cursor.split('-')
+        return (datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT),
+                int(message_id))
+    except ValueError:
+        abort(400)
+
+
+def user_cursor(user):
+    """Cursor pointing just past `user`."""
+
+    return str(user.id)
+
+
+def parse_user_cursor(cursor):
+    """Parse a user cursor into an id; 400 if it's garbage."""
+
+    if not cursor:
+        return None
+
+    try:
+        return int(cursor)
+    except ValueError:
+        abort(400)
+
+
+def messages_before(query, before):
+    """Order a message query newest first, starting after `before`."""
+
+    if before is not None:
+        query = query.filter(tuple_(Message.timestamp, Message.id) < before)
+
+    return query.order_by(Message.timestamp.desc(), Message.id.desc())
+
+
+def joined_messages_before(query, model, before):
+    """Order messages joined to `model` newest first, after `before`.
+
+    `model` has `timestamp` and `message_id` columns; `before` is a
+    (timestamp, message id) pagination key. Authors are loaded along.
+    """
+
+    query = (query
+             .join(model, model.message_id == Message.id)
+             .options(joinedload(Message.user)))
+
+    if before is not None:
+        query = query.filter(tuple_(model.timestamp, model.message_id) < before)
+
+    return query.order_by(model.timestamp.desc(), model.message_id.desc())
+
+
+def users_before(query, before):
+    """Order a user query newest first, starting after `before`."""
+
+    if before is not None:
+        query = query.filter(User.id < before)
+
+    return query.order_by(User.id.desc())
+
+
+def make_page(rows, per_page, cursor):
+    """Turn `per_page + 1` fetched rows into a Page.
+
+    The extra row only tells us there is a next page; it isn't shown.
+    """
+
+    items = rows[:per_page]
+    next_cursor = cursor(items[-1]) if len(rows) > per_page else None
+
+    return Page(items, next_cursor)
+
+
+def page_url(next_cursor):
+    """URL of the current page of results, starting at `next_cursor`."""
+
+    args = request.args.to_dict()
+    args.update(request.view_args)
+    args['before'] = next_cursor
+
+    return url_for(request.endpoint, **args)
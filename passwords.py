@@ -0,0 +1,156 @@
+"""Password hashing off the request thread.
+
+bcrypt is deliberately slow and holds a CPU for the whole hash, so
+`PasswordHasher` runs it in a pool of worker processes: a login storm
+then uses every core, and request threads waiting on a hash don't hold
+the GIL while other requests render pages.
+
+At most `max_pending` hashes are queued or running at once; further
+callers wait for a slot. The work factor is `PASSWORD_HASH_ROUNDS`;
+`User.authenticate()` rehashes a password stored with a different one.
+`stats()` reports queue depth and latency.
+
+With `PASSWORD_HASH_WORKERS = 0` hashes run inline, on the calling thread.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed):
+    """The work factor `hashed` was made with, or None if it isn't bcrypt."""
+
+    # $2b$12$<salt and hash>
+    parts = hashed.split('$')
+    if len(parts) != 4 or not parts[1].startswith('2'):
+        return None
+
+    try:
+        return int(parts[2])
+    except ValueError:
+        return None
+
+
+class PasswordHasher:
+    """bcrypt in a bounded pool of worker processes."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=None, max_pending=None):
+        self._pool = None
+        self._pool_lock = Lock()
+        self._stats_lock = Lock()
+        self.configure(rounds, workers, max_pending)
+
+    def init_app(self, app):
+        """Configure from `PASSWORD_HASH_ROUNDS`, `PASSWORD_HASH_WORKERS`
+        and `PASSWORD_HASH_MAX_PENDING`.
+        """
+
+        self.configure(app.config.get('PASSWORD_HASH_ROUNDS', DEFAULT_ROUNDS),
+                       app.config.get('PASSWORD_HASH_WORKERS'),
+                       app.config.get('PASSWORD_HASH_MAX_PENDING'))
+
+    def configure(self, rounds=DEFAULT_ROUNDS, workers=None, max_pending=None):
+        """Set the work factor and pool size; restarts the pool."""
+
+        self.shutdown()
+
+        self.rounds = rounds
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_pending = max_pending or max(self.workers, 1) * 4
+        self._slots = BoundedSemaphore(self.max_pending)
+
+        self._pending = 0
+        self._completed = 0
+        self._seconds = 0.0
+        self._max_seconds = 0.0
+
+    def shutdown(self):
+        """Stop the worker processes; they restart on the next hash."""
+
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _run(self, fn, *args):
+        start = monotonic()
+
+        with self._stats_lock:
+            self._pending += 1
+
+        try:
+            with self._slots:
+                if not self.workers:
+                    return fn(*args)
+
+                with self._pool_lock:
+                    # started lazily, so each forked app worker gets its own
+                    if self._pool is None:
+                        self._pool = ProcessPoolExecutor(self.workers)
+                    future = self._pool.submit(fn, *args)
+
+                return future.result()
+
+        finally:
+            elapsed = monotonic() - start
+
+            with self._stats_lock:
+                self._pending -= 1
+                self._completed += 1
+                self._seconds += elapsed
+                self._max_seconds = max(self._max_seconds, elapsed)
+
+    def hash(self, password):
+        """bcrypt hash of `password`, as text."""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        return self._run(_hash, password.encode('utf-8'), self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`? False for anything not bcrypt."""
+
+        if not password or hash_rounds(hashed) is None:
+            return False
+
+        try:
+            return self._run(_check, hashed.encode('utf-8'),
+                             password.encode('utf-8'))
+        except ValueError:
+            # a malformed salt
+            return False
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different work factor?"""
+
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self):
+        """Queue depth and latency (queueing included) so far."""
+
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'completed': self._completed,
+                'mean_seconds': (self._seconds / self._completed
+                                 if self._completed else 0.0),
+                'max_seconds': self._max_seconds,
+            }
@@ -0,0 +1,223 @@
+"""Failed-login rate limiting.
+
+`LoginLimiter` counts failed logins per username and per client IP over
+a sliding window, and remembers recently failed (username, password)
+pairs, so `login()` can turn credential stuffing away before
+`User.authenticate()` queries the database or runs bcrypt.
+
+Failure counts live in a `LimiterStorage`, one for usernames and one for
+IPs; `MemoryStorage` keeps them in this process in bounded memory, so an
+attack with millions of usernames can't grow it. A count-min sketch (see
+sketch.py) only ever overcounts, and a flood of distinct usernames would
+push every estimate over the limit, so a login is only refused on exact
+counts: a `FailureTable` keeps the failure times of the keys failing
+most, and a key it doesn't track counts as no more than the fewest
+failures it had to drop lately.
+
+Failed pairs are kept as HMAC digests -- never the password itself -- in
+a bounded `LRUCache`, tagged with the username, so `forget()` can drop
+them when a username is signed up for or taken.
+"""
+
+import hmac
+from collections import deque, OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import time
+
+from cache import LRUCache
+from sketch import SlidingCountMin
+
+
+class LimiterStorage:
+    """Interface every failure-count storage implements."""
+
+    def add(self, key):
+        """Count a failure for `key`; return its count over the window."""
+
+        raise NotImplementedError
+
+    def count(self, key):
+        """Failures for `key` over the window."""
+
+        raise NotImplementedError
+
+
+class FailureTable:
+    """Exact recent failure times of the keys failing most.
+
+    Keeps, for at most `capacity` keys, the times of their last `limit`
+    failures: enough to tell whether a key reached `limit` within `window`
+    seconds. When full, a new key replaces one whose failures all left the
+    window or, failing that, one with the fewest failures, so keys near the
+    limit stay tracked while a flood of one-off keys churns. `floor()` is
+    the most failures a replaced key still had: a key not tracked has had
+    no more than that.
+    """
+
+    def __init__(self, window, limit, capacity=10000):
+        self.window = window
+        self.limit = limit
+        self.capacity = capacity
+        # key -> failure times, least recently failed key first
+        self._times = OrderedDict()
+        # failures -> keys with that many when last looked at
+        self._by_count = [OrderedDict() for _ in range(limit + 1)]
+        self._count_of = {}
+        # (failures of the worst key replaced, when)
+        self._floor = (0, 0.0)
+        self._lock = Lock()
+
+    def _live(self, key, now):
+        times = self._times[key]
+        while times and times[0] <= now - self.window:
+            times.popleft()
+
+        count = len(times)
+        old = self._count_of.get(key)
+        if old != count:
+            if old is not None:
+                del self._by_count[old][key]
+            self._by_count[count][key] = None
+            self._count_of[key] = count
+
+        return count
+
+    def _floor_at(self, now):
+        count, when = self._floor
+        return count if now - when < self.window else 0
+
+    def _evict(self, now):
+        key, times = next(iter(self._times.items()))
+
+        if times and times[-1] > now - self.window:
+            # nothing expired: replace one of the keys with the fewest
+            key = next(key for keys in self._by_count for key in keys)
+            count = self._live(key, now)
+            if count > self._floor_at(now):
+                self._floor = (count, now)
+
+        del self._times[key]
+        del self._by_count[self._count_of.pop(key)][key]
+
+    def add(self, key, now=None):
+        """Count a failure for `key`; return its failures in the window."""
+
+        now = time() if now is None else now
+
+        with self._lock:
+            if key in self._times:
+                self._times.move_to_end(key)
+            else:
+                if len(self._times) >= self.capacity:
+                    self._evict(now)
+                self._times[key] = deque(maxlen=self.limit)
+
+            self._times[key].append(now)
+            return self._live(key, now)
+
+    def count(self, key, now=None):
+        """`key`'s failures in the window; None if it isn't tracked."""
+
+        now = time() if now is None else now
+
+        with self._lock:
+            if key not in self._times:
+                return None
+            return self._live(key, now)
+
+    def floor(self, now=None):
+        """Most failures an untracked key can have had in the window."""
+
+        now = time() if now is None else now
+
+        with self._lock:
+            return self._floor_at(now)
+
+
+class MemoryStorage(LimiterStorage):
+    """Counts in this process: exact for the keys failing most.
+
+    Counts are exact up to `limit`, which is all the limiter asks about;
+    the sliding count-min sketch bounds the rest.
+    """
+
+    def __init__(self, window=300, limit=10, capacity=10000, width=4096,
+                 depth=4):
+        self._counts = SlidingCountMin(window, width=width, depth=depth)
+        self._table = FailureTable(window, limit, capacity)
+
+    def add(self, key):
+        self._counts.add(key)
+        return self._table.add(key)
+
+    def count(self, key):
+        count = self._table.count(key)
+        if count is None:
+            count = min(self._table.floor(), self._counts.estimate(key))
+
+        return count
+
+
+class LoginLimiter:
+    """Decides which login attempts may reach `User.authenticate()`."""
+
+    def __init__(self, usernames, ips, secret, max_per_username=10,
+                 max_per_ip=50, failed_entries=10000, failed_ttl=900):
+        self.usernames = usernames
+        self.ips = ips
+        self.max_per_username = max_per_username
+        self.max_per_ip = max_per_ip
+        self._secret = secret.encode('utf-8')
+        self._failed = LRUCache(max_entries=failed_entries,
+                                default_ttl=failed_ttl)
+
+    def _digest(self, username, password):
+        message = f"{username}\0{password}".encode('utf-8')
+        return hmac.new(self._secret, message, sha256).hexdigest()
+
+    def limited(self, username, ip):
+        """Has `username` or `ip` failed too often lately?"""
+
+        return (self.usernames.count(username) >= self.max_per_username
+                or self.ips.count(ip) >= self.max_per_ip)
+
+    def known_failure(self, username, password):
+        """Did this exact username and password fail recently?"""
+
+        return self._failed.get(self._digest(username, password)) is not None
+
+    def record_failure(self, username, password, ip):
+        """Count a failed login and remember the pair."""
+
+        self.usernames.add(username)
+        self.ips.add(ip)
+        self._failed.set(self._digest(username, password), True,
+                         tags=[f"username:{username}"])
+
+    def forget(self, username):
+        """Drop remembered failures for `username`, which just changed hands."""
+
+        self._failed.invalidate(f"username:{username}")
+
+
+BACKENDS = {
+    'memory': MemoryStorage,
+}
+
+
+def create_login_limiter(app):
+    """Build a LoginLimiter from the `LOGIN_*` settings."""
+
+    storage = BACKENDS[app.config.get('LOGIN_LIMIT_BACKEND', 'memory')]
+    window = app.config.get('LOGIN_LIMIT_WINDOW', 300)
+    max_per_username = app.config.get('LOGIN_LIMIT_PER_USERNAME', 10)
+    max_per_ip = app.config.get('LOGIN_LIMIT_PER_IP', 50)
+
+    return LoginLimiter(
+        storage(window=window, limit=max_per_username),
+        storage(window=window, limit=max_per_ip),
+        app.config['SECRET_KEY'],
+        max_per_username=max_per_username,
+        max_per_ip=max_per_ip,
+    )
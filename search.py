@@ -0,0 +1,331 @@
+"""Full-text search over messages and user profiles.
+
+`SearchIndex` is the interface the routes use: `message_ids()` and
+`user_ids()` return ids of matches, best first, and the `add_*`,
+`remove_*`, `update_user` and `drop_user` hooks keep the index current
+as messages and profiles change.
+
+`PostgresSearch` matches against the GIN-indexed `to_tsvector`
+expressions declared in models.py (so PostgreSQL keeps them current on
+its own) and ranks with `ts_rank`.
+
+`MemorySearch` keeps an `InvertedIndex` per kind of document in this
+process: term -> sorted arrays of document ids and term counts, ranked
+with BM25. A query only walks the postings of its rarest term, so it
+stays fast however big the corpus is. Every process builds its own copy
+from the database on first use, so it suits SQLite and single-process
+deployments, like the memory timeline store.
+"""
+
+import heapq
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from math import log
+from threading import Lock
+
+from sqlalchemy import func, literal_column
+
+from models import (db, visible_messages, MESSAGE_SEARCH_VECTOR,
+                    USER_SEARCH_VECTOR, Message, User)
+
+WORD = re.compile(r"\w+")
+
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for if in into is it no not of on or so
+    such that the their then there these they this to was will with
+""".split())
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """Lowercased words of `text`, without stop words."""
+
+    return [word for word in WORD.findall((text or '').lower())
+            if word not in STOP_WORDS]
+
+
+def user_document(user):
+    """The text a user is found by."""
+
+    return " ".join(filter(None, [user.username, user.bio, user.location]))
+
+
+class InvertedIndex:
+    """Documents (id -> text) searchable by all of a query's words."""
+
+    def __init__(self):
+        # term -> (sorted document ids, count of the term in each)
+        self._postings = {}
+        # document id -> (number of terms, its distinct terms)
+        self._documents = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, doc_id, text):
+        """Index `text` as document `doc_id`, replacing what it was."""
+
+        self.remove(doc_id)
+
+        counts = Counter(tokenize(text))
+        if not counts:
+            return
+
+        for term, count in counts.items():
+            ids, term_counts = self._postings.setdefault(
+                term, (array('L'), array('H')))
+            count = min(count, 0xFFFF)
+
+            # documents mostly arrive in id order
+            if not ids or ids[-1] < doc_id:
+                ids.append(doc_id)
+                term_counts.append(count)
+            else:
+                index = bisect_left(ids, doc_id)
+                ids.insert(index, doc_id)
+                term_counts.insert(index, count)
+
+        length = sum(counts.values())
+        self._documents[doc_id] = (length, tuple(counts))
+        self._total_length += length
+
+    def remove(self, doc_id):
+        """Forget document `doc_id`, if it is indexed."""
+
+        document = self._documents.pop(doc_id, None)
+        if document is None:
+            return
+
+        length, terms = document
+        self._total_length -= length
+
+        for term in terms:
+            ids, term_counts = self._postings[term]
+            index = bisect_left(ids, doc_id)
+            del ids[index]
+            del term_counts[index]
+            if not ids:
+                del self._postings[term]
+
+    def search(self, query, limit, offset=0):
+        """Ids of documents with every word of `query`, best first.
+
+        Ties go to the newest (highest) id.
+        """
+
+        terms = set(tokenize(query))
+        postings = [self._postings.get(term) for term in terms]
+        if not postings or None in postings:
+            return []
+
+        # walk the rarest term's documents, look the others up
+        postings.sort(key=lambda posting: len(posting[0]))
+
+        documents = len(self._documents)
+        average_length = self._total_length / documents
+        weights = [log(1 + (documents - len(ids) + 0.5) / (len(ids) + 0.5))
+                   for ids, _ in postings]
+
+        def bm25(weight, count, doc_id):
+            length = self._documents[doc_id][0]
+            norm = K1 * (1 - B + B * length / average_length)
+            return weight * count * (K1 + 1) / (count + norm)
+
+        matches = []
+        rarest_ids, rarest_counts = postings[0]
+
+        for position, doc_id in enumerate(rarest_ids):
+            score = bm25(weights[0], rarest_counts[position], doc_id)
+
+            for weight, (ids, term_counts) in zip(weights[1:], postings[1:]):
+                index = bisect_left(ids, doc_id)
+                if index == len(ids) or ids[index] != doc_id:
+                    break
+                score += bm25(weight, term_counts[index], doc_id)
+            else:
+                matches.append((score, doc_id))
+
+        best = heapq.nlargest(offset + limit, matches)
+        return [doc_id for _, doc_id in best[offset:]]
+
+
+class SearchIndex:
+    """Interface every search backend implements."""
+
+    def message_ids(self, query, limit, offset=0):
+        """Ids of the messages matching `query`, best first."""
+
+        raise NotImplementedError
+
+    def user_ids(self, query, limit, offset=0):
+        """Ids of the users whose profile matches `query`, best first."""
+
+        raise NotImplementedError
+
+    def add_message(self, message):
+        """Make a new message searchable."""
+
+        raise NotImplementedError
+
+    def remove_message(self, message_id):
+        """Forget a deleted message."""
+
+        raise NotImplementedError
+
+    def update_user(self, user):
+        """Reindex a new or edited profile."""
+
+        raise NotImplementedError
+
+    def drop_user(self, user_id):
+        """Forget a user and their messages; call before deleting them."""
+
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Reindex everything, e.g. after a bulk load."""
+
+        raise NotImplementedError
+
+
+class PostgresSearch(SearchIndex):
+    """tsvector / GIN search; PostgreSQL updates the indexes itself."""
+
+    def _ranked_ids(self, rows, model, vector, config, query, limit, offset):
+        vector = literal_column(vector)
+        tsquery = func.plainto_tsquery(literal_column(f"'{config}'"), query)
+
+        rows = (rows
+                .filter(vector.op('@@')(tsquery))
+                .order_by(func.ts_rank(vector, tsquery).desc(),
+                          model.id.desc())
+                .limit(limit)
+                .offset(offset))
+
+        return [row.id for row in rows]
+
+    def message_ids(self, query, limit, offset=0):
+        return self._ranked_ids(visible_messages(db.session.query(Message.id)),
+                                Message, MESSAGE_SEARCH_VECTOR, 'english',
+                                query, limit, offset)
+
+    def user_ids(self, query, limit, offset=0):
+        return self._ranked_ids(db.session.query(User.id)
+                                .filter(User.deleted_at.is_(None)),
+                                User, USER_SEARCH_VECTOR, 'simple',
+                                query, limit, offset)
+
+    def add_message(self, message):
+        pass
+
+    def remove_message(self, message_id):
+        pass
+
+    def update_user(self, user):
+        pass
+
+    def drop_user(self, user_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class MemorySearch(SearchIndex):
+    """Inverted indexes in this process, built on first use."""
+
+    def __init__(self):
+        self._messages = None
+        self._users = None
+        self._lock = Lock()
+
+    def _build(self):
+        messages = InvertedIndex()
+        for row in (visible_messages(db.session.query(Message.id,
+                                                      Message.text))
+                    .order_by(Message.id)
+                    .yield_per(10000)):
+            messages.add(row.id, row.text)
+
+        users = InvertedIndex()
+        for user in (db.session.query(User.id, User.username, User.bio,
+                                      User.location)
+                     .filter(User.deleted_at.is_(None))
+                     .order_by(User.id)
+                     .yield_per(10000)):
+            users.add(user.id, user_document(user))
+
+        self._messages, self._users = messages, users
+
+    def _built(self):
+        with self._lock:
+            if self._messages is None:
+                self._build()
+
+    def message_ids(self, query, limit, offset=0):
+        self._built()
+        with self._lock:
+            return self._messages.search(query, limit, offset)
+
+    def user_ids(self, query, limit, offset=0):
+        self._built()
+        with self._lock:
+            return self._users.search(query, limit, offset)
+
+    # until the first search the indexes don't exist, and the build
+    # will pick up these changes from the database
+
+    def add_message(self, message):
+        with self._lock:
+            if self._messages is not None:
+                self._messages.add(message.id, message.text)
+
+    def remove_message(self, message_id):
+        with self._lock:
+            if self._messages is not None:
+                self._messages.remove(message_id)
+
+    def update_user(self, user):
+        with self._lock:
+            if self._users is not None:
+                self._users.add(user.id, user_document(user))
+
+    def drop_user(self, user_id):
+        message_ids = [row.id for row in (db.session.query(Message.id)
+                                          .filter(Message.user_id == user_id))]
+
+        with self._lock:
+            if self._users is not None:
+                self._users.remove(user_id)
+                for message_id in message_ids:
+                    self._messages.remove(message_id)
+
+    def rebuild(self):
+        with self._lock:
+            self._build()
+
+
+BACKENDS = {
+    'postgres': PostgresSearch,
+    'memory': MemorySearch,
+}
+
+
+def create_search_index(app):
+    """Build the backend named by `SEARCH_BACKEND`.
+
+    Defaults to 'postgres' on PostgreSQL and 'memory' otherwise.
+    """
+
+    backend = app.config.get('SEARCH_BACKEND')
+    if backend is None:
+        backend = ('postgres' if db.engine.dialect.name == 'postgresql'
+                   else 'memory')
+
+    return BACKENDS[backend]()
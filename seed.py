@@ -1,20 +1,14 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
 from app import db
-from models import User, Message, FollowersFollowee
+import counters
+import loader
 
 
 db.drop_all()
 db.create_all()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(FollowersFollowee, DictReader(follows))
+loader.load_directory(db.engine, 'generator')
 
+counters.reconcile()
 db.session.commit()
@@ -0,0 +1,96 @@
+"""Fixed-size approximate counters.
+
+`CountMinSketch` counts occurrences of arbitrarily many keys in
+`width * depth` integers. Estimates are never low, and too high by at
+most about `2 / width` of the total count (with probability
+1 - 2 ** -depth).
+
+`SlidingCountMin` keeps one sketch per time bucket, so counts cover
+roughly the last `window` seconds; memory stays the same however many
+keys turn up.
+"""
+
+from array import array
+from hashlib import blake2b
+from threading import Lock
+from time import time
+
+
+class CountMinSketch:
+    """Approximate per-key counts in a fixed `width` x `depth` table."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self._rows = [array('L', [0]) * width for _ in range(depth)]
+
+    def _columns(self, key):
+        digest = blake2b(key.encode('utf-8'), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[i:i + 4], 'little') % self.width
+                for i in range(0, 4 * self.depth, 4)]
+
+    def add(self, key, count=1):
+        """Count `key` `count` more times; return its new estimate."""
+
+        estimate = None
+        for row, column in zip(self._rows, self._columns(key)):
+            row[column] += count
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+
+        return estimate
+
+    def estimate(self, key):
+        """How many times `key` was counted, or a little more."""
+
+        return min(row[column]
+                   for row, column in zip(self._rows, self._columns(key)))
+
+    def clear(self):
+        self._rows = [array('L', [0]) * self.width for _ in range(self.depth)]
+
+
+class SlidingCountMin:
+    """Count-min sketch over the last `window` seconds, in `buckets` steps."""
+
+    def __init__(self, window, buckets=10, width=2048, depth=4):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_seconds = window / buckets
+        self._sketches = [CountMinSketch(width, depth) for _ in range(buckets)]
+        # which bucket number each sketch currently holds
+        self._epochs = [None] * buckets
+        self._lock = Lock()
+
+    def _current(self, now):
+        epoch = int(now // self.bucket_seconds)
+        index = epoch % self.buckets
+
+        if self._epochs[index] != epoch:
+            self._sketches[index].clear()
+            self._epochs[index] = epoch
+
+        return epoch
+
+    def _live(self, epoch):
+        return [sketch for sketch, sketch_epoch in zip(self._sketches, self._epochs)
+                if sketch_epoch is not None and epoch - sketch_epoch < self.buckets]
+
+    def add(self, key, count=1, now=None):
+        """Count `key`; return its estimate over the window."""
+
+        now = time() if now is None else now
+
+        with self._lock:
+            epoch = self._current(now)
+            self._sketches[epoch % self.buckets].add(key, count)
+            return sum(sketch.estimate(key) for sketch in self._live(epoch))
+
+    def estimate(self, key, now=None):
+        """Approximate count of `key` over the window."""
+
+        now = time() if now is None else now
+
+        with self._lock:
+            epoch = self._current(now)
+            return sum(sketch.estimate(key) for sketch in self._live(epoch))
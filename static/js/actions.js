@@ -0,0 +1,44 @@
+// Like and follow without reloading the page: the buttons' forms are sent
+// to the JSON API, and only the button changes.
+
+$(function () {
+  $(document).on('submit', 'form[action^="/messages/"]', function (event) {
+    var match = this.getAttribute('action').match(/^\/messages\/(\d+)$/);
+    if (!match) return;
+
+    event.preventDefault();
+    var $icon = $(this).find('i');
+
+    $.post('/api/v1/messages/' + match[1] + '/like', function (data) {
+      $icon.toggleClass('fas', data.liked).toggleClass('far', !data.liked);
+    });
+  });
+
+  $(document).on('submit', 'form[action^="/users/follow/"], ' +
+                           'form[action^="/users/stop-following/"]',
+                 function (event) {
+    var form = this;
+    var action = form.getAttribute('action');
+    var following = action.indexOf('/users/follow/') === 0;
+    var id = parseInt(action.split('/').pop(), 10);
+
+    event.preventDefault();
+
+    $.ajax({
+      url: '/api/v1/follows',
+      method: following ? 'POST' : 'DELETE',
+      contentType: 'application/json',
+      data: JSON.stringify({ids: [id]})
+    }).done(function () {
+      var $button = $(form).find('button');
+      var small = $button.hasClass('btn-sm') ? ' btn-sm' : '';
+
+      form.setAttribute('action', (following ? '/users/stop-following/'
+                                             : '/users/follow/') + id);
+      $button
+        .text(following ? 'Unfollow' : 'Follow')
+        .attr('class', (following ? 'btn btn-primary'
+                                  : 'btn btn-outline-primary') + small);
+    });
+  });
+});
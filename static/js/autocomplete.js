@@ -0,0 +1,45 @@
+// Suggest usernames under the navbar search box as the user types.
+
+$(function () {
+  var $search = $('#search');
+  var $list = $('<datalist id="search-users"></datalist>');
+  var timer = null;
+  var last = '';
+  var ids = {};
+
+  $search.attr({list: 'search-users', autocomplete: 'off'}).after($list);
+
+  $search.on('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(suggest, 100);
+  });
+
+  // picking a suggestion goes straight to that profile
+  $search.on('change', function () {
+    var id = ids[$search.val()];
+    if (id) window.location = '/users/' + id;
+  });
+
+  function suggest() {
+    var q = $search.val().trim();
+    if (q === last) return;
+    last = q;
+
+    if (!q) {
+      $list.empty();
+      return;
+    }
+
+    $.getJSON('/users/autocomplete', {q: q}, function (data) {
+      // a slower, earlier request may answer after a later one
+      if (q !== last) return;
+
+      $list.empty();
+      ids = {};
+      data.users.forEach(function (user) {
+        ids[user.username] = user.id;
+        $list.append($('<option>').attr('value', user.username));
+      });
+    });
+  }
+});
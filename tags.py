@@ -0,0 +1,298 @@
+"""Hashtags, mentions and trending tags.
+
+Messages are parsed when they are posted: every `#tag` gets a row in
+`message_tags` and every `@username` of an existing user a row in
+`mentions`. Both copy the message's timestamp, so a tag's or a user's
+messages are read newest first straight off one index, keyset paginated
+like every other message list (see pagination.py).
+
+`TrendingTags` counts tags as they are posted in a `SlidingCountMin`
+(see sketch.py) and keeps the few tags with the highest estimates as
+heavy-hitter candidates, so finding what's trending costs the same however
+many tags and posts there are. Like the memory timeline store it only
+sees what this process posts (plus the window it replays on first use).
+"""
+
+import re
+from calendar import timegm
+from datetime import datetime, timedelta
+from threading import Lock
+from time import time
+
+from markupsafe import Markup, escape
+from models import db, visible_messages, Message, User
+from pagination import joined_messages_before
+from sketch import SlidingCountMin
+
+HASHTAG = re.compile(r"(?<![\w#])#(\w{1,64})")
+MENTION = re.compile(r"(?<![\w@])@(\w{1,64})")
+
+
+def extract_tags(text):
+    """Distinct lowercased hashtags in `text`, in order."""
+
+    return list(dict.fromkeys(tag.lower() for tag in HASHTAG.findall(text)))
+
+
+def extract_mentions(text):
+    """Distinct usernames mentioned in `text`, in order."""
+
+    return list(dict.fromkeys(MENTION.findall(text)))
+
+
+def link_tags(text):
+    """Template filter: escape `text` and link its hashtags."""
+
+    parts = []
+    last = 0
+
+    for match in HASHTAG.finditer(text):
+        parts.append(escape(text[last:match.start()]))
+        parts.append(Markup('<a href="/tags/{}">#{}</a>').format(
+            match.group(1).lower(), match.group(1)))
+        last = match.end()
+
+    parts.append(escape(text[last:]))
+    return Markup('').join(parts)
+
+
+class MessageTag(db.Model):
+    """A hashtag used in a message."""
+
+    __tablename__ = 'message_tags'
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True,
+    )
+
+    # the message's, for reading a tag newest first
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class Mention(db.Model):
+    """A user @mentioned in a message."""
+
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True,
+    )
+
+    # the message's, for reading a user's mentions newest first
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+db.Index('ix_message_tags_tag_timestamp',
+         MessageTag.tag, MessageTag.timestamp.desc(),
+         MessageTag.message_id.desc())
+
+db.Index('ix_mentions_user_id_timestamp',
+         Mention.user_id, Mention.timestamp.desc(), Mention.message_id.desc())
+
+
+def index_message(message):
+    """Add the tag and mention rows of a new (flushed) message.
+
+    Returns its tags. The caller commits.
+    """
+
+    tags = extract_tags(message.text)
+    for tag in tags:
+        db.session.add(MessageTag(tag=tag, message_id=message.id,
+                                  timestamp=message.timestamp))
+
+    usernames = extract_mentions(message.text)
+    if usernames:
+        for row in (db.session.query(User.id)
+                    .filter(User.username.in_(usernames),
+                            User.deleted_at.is_(None))):
+            db.session.add(Mention(user_id=row.id, message_id=message.id,
+                                   timestamp=message.timestamp))
+
+    return tags
+
+
+def forget_message(message_id):
+    """Delete the rows of a message about to be deleted."""
+
+    for model in (MessageTag, Mention):
+        (model.query
+         .filter(model.message_id == message_id)
+         .delete(synchronize_session=False))
+
+
+def reindex(chunk_size=10000):
+    """Rebuild both tables from every message, e.g. after a bulk load.
+
+    The caller commits.
+    """
+
+    MessageTag.query.delete(synchronize_session=False)
+    Mention.query.delete(synchronize_session=False)
+
+    last_id = 0
+    while True:
+        messages = (db.session.query(Message.id, Message.text,
+                                     Message.timestamp)
+                    .filter(Message.id > last_id)
+                    .order_by(Message.id)
+                    .limit(chunk_size)
+                    .all())
+        if not messages:
+            return
+
+        for message in messages:
+            index_message(message)
+        db.session.flush()
+
+        last_id = messages[-1].id
+
+
+def tagged_before(tag, before):
+    """Query for the messages tagged `tag`, newest first."""
+
+    return (joined_messages_before(visible_messages(Message.query),
+                                   MessageTag, before)
+            .filter(MessageTag.tag == tag.lower()))
+
+
+def mentions_before(user_id, before):
+    """Query for the messages mentioning `user_id`, newest first."""
+
+    return (joined_messages_before(visible_messages(Message.query),
+                                   Mention, before)
+            .filter(Mention.user_id == user_id))
+
+
+class TrendingTags:
+    """The most used tags of the last `window` seconds, approximately.
+
+    `capacity` candidates are tracked exactly by name; a tag replaces the
+    weakest candidate once its sketch estimate beats it. Candidates'
+    estimates are refreshed as each bucket of the window expires.
+    """
+
+    def __init__(self, window=3600, buckets=12, capacity=100, width=2048,
+                 depth=4):
+        self.window = window
+        self.capacity = capacity
+        self._counts = SlidingCountMin(window, buckets, width, depth)
+        # tag -> estimate when last looked at
+        self._candidates = {}
+        self._floor = 0
+        self._bucket = None
+        self._warm = False
+        self._lock = Lock()
+
+    def _refresh(self, now):
+        """Re-estimate the candidates once per bucket, as counts expire."""
+
+        bucket = int(now // self._counts.bucket_seconds)
+        if bucket == self._bucket:
+            return
+
+        self._bucket = bucket
+        for tag in list(self._candidates):
+            estimate = self._counts.estimate(tag, now)
+            if estimate:
+                self._candidates[tag] = estimate
+            else:
+                del self._candidates[tag]
+        self._update_floor()
+
+    def _update_floor(self):
+        if len(self._candidates) < self.capacity:
+            self._floor = 0
+        else:
+            self._floor = min(self._candidates.values())
+
+    def _add(self, tag, now):
+        estimate = self._counts.add(tag, now=now)
+        self._refresh(now)
+
+        if tag in self._candidates:
+            self._candidates[tag] = estimate
+        elif estimate > self._floor:
+            if len(self._candidates) >= self.capacity:
+                weakest = min(self._candidates, key=self._candidates.get)
+                del self._candidates[weakest]
+            self._candidates[tag] = estimate
+        else:
+            return
+
+        self._update_floor()
+
+    def add(self, tags, now=None):
+        """Count a message's `tags`.
+
+        Until `warm()` has run this does nothing: the replay will count
+        them.
+        """
+
+        now = time() if now is None else now
+
+        with self._lock:
+            if not self._warm:
+                return
+            for tag in tags:
+                self._add(tag, now)
+
+    def warm(self):
+        """Replay the tags of the last window from the database, once."""
+
+        with self._lock:
+            if self._warm:
+                return
+            self._warm = True
+
+            since = datetime.utcnow() - timedelta(seconds=self.window)
+            for row in (db.session.query(MessageTag.tag, MessageTag.timestamp)
+                        .filter(MessageTag.timestamp > since)
+                        .order_by(MessageTag.timestamp)
+                        .yield_per(10000)):
+                self._add(row.tag, timegm(row.timestamp.utctimetuple()))
+
+    def top(self, count=10, now=None):
+        """[(tag, estimated uses)] of the `count` most used tags."""
+
+        now = time() if now is None else now
+
+        with self._lock:
+            self._refresh(now)
+            estimates = [(self._counts.estimate(tag, now), tag)
+                         for tag in self._candidates]
+
+        estimates.sort(key=lambda pair: (-pair[0], pair[1]))
+        return [(tag, estimate) for estimate, tag in estimates[:count]
+                if estimate]
+
+
+def create_trending(app):
+    """A TrendingTags from the `TRENDING_*` settings."""
+
+    return TrendingTags(window=app.config.get('TRENDING_WINDOW', 3600),
+                        buckets=app.config.get('TRENDING_BUCKETS', 12),
+                        capacity=app.config.get('TRENDING_CANDIDATES', 100))
@@ -0,0 +1,175 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_accounts.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Like, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY, job_queue, timelines
+import accounts
+from jobs import Job
+from tags import Mention, MessageTag
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class DeleteAccountTestCase(TestCase):
+    """Test deleting a user with messages, likes, follows and mentions."""
+
+    def setUp(self):
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        MessageTag.query.delete()
+        Mention.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        users = [User.signup(username=name,
+                             email=f"{name}@test.com",
+                             password="password",
+                             image_url=None)
+                 for name in ["gone", "friend", "fan"]]
+        db.session.commit()
+        self.gone_id, self.friend_id, self.fan_id = [user.id for user in users]
+
+        self.clients = {}
+        for user_id in [self.gone_id, self.friend_id, self.fan_id]:
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            self.clients[user_id] = client
+
+        gone = self.clients[self.gone_id]
+        friend = self.clients[self.friend_id]
+        fan = self.clients[self.fan_id]
+
+        # gone and friend follow each other; fan follows gone
+        gone.post(f"/users/follow/{self.friend_id}")
+        friend.post(f"/users/follow/{self.gone_id}")
+        fan.post(f"/users/follow/{self.gone_id}")
+
+        for i in range(5):
+            gone.post("/messages/new", data={"text": f"#bye {i} @friend"})
+        friend.post("/messages/new", data={"text": "Hi @gone"})
+
+        gone_ids = [msg.id for msg in
+                    Message.query.filter_by(user_id=self.gone_id)]
+        self.friend_msg_id = Message.query.filter_by(
+            user_id=self.friend_id).one().id
+
+        # everyone likes the friend's message; the friend and fan like
+        # some of gone's
+        fan.post("/api/v1/likes", json={"ids": gone_ids[:3]
+                                        + [self.friend_msg_id]})
+        friend.post("/api/v1/likes", json={"ids": gone_ids[:1]})
+        gone.post("/api/v1/likes", json={"ids": [self.friend_msg_id]})
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def assert_gone(self):
+        self.assertIsNone(User.query.get(self.gone_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.gone_id).count(),
+                         0)
+        self.assertEqual(Like.query.filter_by(user_id=self.gone_id).count(), 0)
+        self.assertEqual(FollowersFollowee.query.count(), 0)
+        self.assertEqual(Mention.query.filter_by(user_id=self.gone_id).count(),
+                         0)
+        self.assertEqual(MessageTag.query.filter_by(tag="bye").count(), 0)
+
+        self.assertEqual(self.counts(self.friend_id), (1, 0, 0, 0))
+        self.assertEqual(self.counts(self.fan_id), (0, 0, 0, 1))
+        self.assertEqual(Message.query.get(self.friend_msg_id).likes_count, 1)
+
+    def test_delete(self):
+        """Does the route leave the purge to the worker, even when eager?"""
+
+        resp = self.clients[self.gone_id].post("/users/delete")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNotNone(User.query.get(self.gone_id).deleted_at)
+        self.assertEqual(Job.query.filter_by(kind='purge_user',
+                                             status='pending').count(), 1)
+
+        while job_queue.run_once():
+            pass
+
+        self.assert_gone()
+
+    def test_purge_in_batches(self):
+        accounts.mark_deleted(self.gone_id)
+        db.session.commit()
+
+        self.assertEqual(self.clients[self.friend_id]
+                         .get(f"/users/{self.gone_id}").status_code, 404)
+        self.assertFalse(User.authenticate("gone", "password"))
+
+        steps = 0
+        done = False
+        while not done:
+            done, _, _ = accounts.purge_step(self.gone_id, 2, timelines)
+            db.session.commit()
+            steps += 1
+
+        # 5 messages, 1 like, 3 follows, 1 mention, 2 at a time; the user
+        self.assertEqual(steps, 3 + 1 + 2 + 1 + 1)
+        self.assert_gone()
+
+    def test_messages_hidden(self):
+        """Are a deleted user's messages hidden until they are purged?"""
+
+        gone_id = Message.query.filter_by(user_id=self.gone_id).first().id
+        accounts.mark_deleted(self.gone_id)
+        db.session.commit()
+        friend = self.clients[self.friend_id]
+
+        for url in ["/tags/bye", f"/users/{self.friend_id}/mentions",
+                    f"/users/{self.fan_id}/likes", "/search?q=bye", "/"]:
+            self.assertNotIn(">@gone</a>",
+                             friend.get(url).get_data(as_text=True), url)
+        self.assertEqual(friend.get(f"/api/v1/messages/{gone_id}")
+                         .status_code, 404)
+        self.assertEqual(friend.post(f"/messages/{gone_id}").status_code, 404)
+
+        friend.post("/messages/new", data={"text": "Bye @gone"})
+        self.assertEqual(Mention.query.filter_by(user_id=self.gone_id).count(),
+                         1)
+
+    def test_deferred(self):
+        job_queue.eager = False
+        try:
+            self.clients[self.gone_id].post("/users/delete")
+
+            self.assertIsNotNone(User.query.get(self.gone_id).deleted_at)
+            self.assertEqual(self.clients[self.fan_id]
+                             .get("/users").get_data(as_text=True)
+                             .count("@gone"), 0)
+
+            while job_queue.run_once():
+                pass
+        finally:
+            job_queue.eager = app.config['JOBS_EAGER']
+            Job.query.delete()
+            db.session.commit()
+
+        self.assert_gone()
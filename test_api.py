@@ -0,0 +1,152 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Like, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class APITestCase(TestCase):
+    """Test /api/v1."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        self.users = [User.signup(username=f"user{i}",
+                                  email=f"user{i}@test.com",
+                                  password="password",
+                                  image_url=None)
+                      for i in range(4)]
+        db.session.commit()
+
+        self.user_ids = [user.id for user in self.users]
+        self.me = self.user_ids[0]
+
+        messages = [Message(text=f"message {i}", user_id=self.user_ids[1])
+                    for i in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.message_ids = [msg.id for msg in messages]
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.me
+
+    def test_user(self):
+        resp = self.client.get(f"/api/v1/users/{self.user_ids[1]}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['user']['username'], "user1")
+        self.assertEqual(resp.json['user']['messages'], 0)
+
+    def test_user_messages(self):
+        resp = self.client.get(f"/api/v1/users/{self.user_ids[1]}/messages")
+        data = resp.json
+
+        self.assertEqual(len(data['messages']), 3)
+        self.assertEqual(list(data['users']), [str(self.user_ids[1])])
+        self.assertEqual(data['liked'], [])
+        self.assertIsNone(data['next'])
+
+    def test_batch_likes(self):
+        self.login()
+
+        resp = self.client.post("/api/v1/likes",
+                                json={"ids": self.message_ids[:2]})
+        self.assertEqual(resp.json['changed'], self.message_ids[:2])
+
+        # already liked ones are skipped
+        resp = self.client.post("/api/v1/likes", json={"ids": self.message_ids})
+        self.assertEqual(resp.json['changed'], self.message_ids[2:])
+
+        self.assertEqual(User.query.get(self.me).likes_count, 3)
+        self.assertEqual(Message.query.get(self.message_ids[0]).likes_count, 1)
+
+        resp = self.client.delete("/api/v1/likes",
+                                  json={"ids": self.message_ids[:1]})
+        self.assertEqual(resp.json['changed'], self.message_ids[:1])
+        self.assertEqual(Like.query.count(), 2)
+        self.assertEqual(User.query.get(self.me).likes_count, 2)
+
+    def test_batch_follows(self):
+        self.login()
+        others = self.user_ids[1:]
+
+        resp = self.client.post("/api/v1/follows",
+                                json={"ids": others + [self.me, 999999]})
+        self.assertEqual(resp.json['changed'], others)
+        self.assertEqual(User.query.get(self.me).following_count, 3)
+        self.assertEqual(User.query.get(others[0]).followers_count, 1)
+
+        resp = self.client.get("/api/v1/timeline")
+        self.assertEqual(len(resp.json['messages']), 3)
+
+        resp = self.client.delete("/api/v1/follows", json={"ids": others[:1]})
+        self.assertEqual(resp.json['changed'], others[:1])
+        self.assertEqual(User.query.get(self.me).following_count, 2)
+
+        resp = self.client.get("/api/v1/timeline")
+        self.assertEqual(resp.json['messages'], [])
+
+    def test_toggle_like(self):
+        self.login()
+        url = f"/api/v1/messages/{self.message_ids[0]}/like"
+
+        self.assertEqual(self.client.post(url).json,
+                         {"id": self.message_ids[0], "liked": True,
+                          "likes": 1})
+        self.assertEqual(self.client.post(url).json,
+                         {"id": self.message_ids[0], "liked": False,
+                          "likes": 0})
+
+    def test_fragment(self):
+        self.login()
+        self.client.post("/api/v1/likes", json={"ids": self.message_ids[:1]})
+
+        resp = self.client.get(
+            f"/api/v1/messages/{self.message_ids[0]}/fragment")
+        html = resp.get_data(as_text=True)
+
+        self.assertIn("message 0", html)
+        self.assertIn("fas fa-star", html)
+        self.assertNotIn("<html", html)
+
+    def test_errors(self):
+        resp = self.client.post("/api/v1/likes", json={"ids": [1]})
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn("error", resp.json)
+
+        self.login()
+        for body in [{}, {"ids": []}, {"ids": ["1"]},
+                     {"ids": list(range(101))}]:
+            resp = self.client.post("/api/v1/likes", json=body)
+            self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.get("/api/v1/messages/999999")
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("error", resp.json)
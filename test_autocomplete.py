@@ -0,0 +1,188 @@
+"""Username autocomplete tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_autocomplete.py
+
+
+import os
+import random
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY, usernames
+from autocomplete import UsernameIndex
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UsernameIndexTestCase(TestCase):
+    """Test ranking and keeping the index current."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+
+        for i, (name, followers) in enumerate([("alice", 5), ("alfred", 50),
+                                               ("Albert", 20), ("bob", 100)]):
+            db.session.add(User(username=name, email=f"{i}@test.com",
+                                password="HASHED", followers_count=followers))
+        db.session.commit()
+
+        self.ids = {user.username: user.id for user in User.query}
+
+        # tiny scan limit so short prefixes use the precomputed lists
+        self.index = UsernameIndex(limit=2, scan_limit=1)
+        self.index.rebuild()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def names(self, prefix, limit=None):
+        return [entry.username for entry in self.index.complete(prefix, limit)]
+
+    def test_ranked_by_followers(self):
+        self.assertEqual(self.names("al"), ["alfred", "Albert"])
+        self.assertEqual(self.names("AL", limit=1), ["alfred"])
+        self.assertEqual(self.names("ali"), ["alice"])
+        self.assertEqual(self.names("x"), [])
+        self.assertEqual(self.names(""), [])
+
+    def test_followers_change(self):
+        self.names("al")
+
+        self.index.add_followers(self.ids["alice"], 100)
+        self.assertEqual(self.names("al"), ["alice", "alfred"])
+
+        self.index.add_followers(self.ids["alice"], -100)
+        self.index.add_followers(self.ids["alfred"], -49)
+        self.assertEqual(self.names("al"), ["Albert", "alice"])
+
+    def test_rename_and_remove(self):
+        self.names("al")
+
+        alfred = User.query.get(self.ids["alfred"])
+        alfred.username = "fred"
+        self.index.add(alfred)
+        self.assertEqual(self.names("al"), ["Albert", "alice"])
+        self.assertEqual(self.names("fr"), ["fred"])
+
+        self.index.remove(self.ids["Albert"])
+        self.assertEqual(self.names("al"), ["alice"])
+        self.assertEqual(len(self.index), 3)
+
+    def test_matches_brute_force(self):
+        """Do the maintained top lists agree with ranking from scratch?"""
+
+        User.query.delete()
+        db.session.commit()
+
+        rng = random.Random(0)
+        letters = "ab"
+        users = {}
+
+        index = UsernameIndex(limit=3, scan_limit=2)
+        index.rebuild()
+
+        for step in range(300):
+            user_id = rng.randrange(1, 30)
+            action = rng.random()
+
+            if action < 0.4:
+                user = User(id=user_id + 1000,
+                            username="".join(rng.choice(letters)
+                                             for _ in range(rng.randint(1, 4)))
+                            + str(user_id),
+                            image_url=None,
+                            followers_count=rng.randrange(10))
+                index.add(user)
+                # a re-added (renamed) user keeps its follower count
+                followers = users.get(user.id, [None, user.followers_count])[1]
+                users[user.id] = [user.username, followers]
+            elif action < 0.5:
+                index.remove(user_id + 1000)
+                users.pop(user_id + 1000, None)
+            elif user_id + 1000 in users:
+                delta = rng.choice([-2, -1, 1, 2])
+                index.add_followers(user_id + 1000, delta)
+                users[user_id + 1000][1] += delta
+
+            for prefix in ["a", "b", "ab", "ba", "aa"]:
+                expected = sorted(
+                    ((-followers, name.lower(), user_id)
+                     for user_id, (name, followers) in users.items()
+                     if name.lower().startswith(prefix)))[:3]
+                got = [entry.id for entry in index.complete(prefix)]
+                self.assertEqual(got, [user_id for *_, user_id in expected])
+
+
+class AutocompleteViewTestCase(TestCase):
+    """Test the JSON endpoint and the hooks in the write routes."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        self.other = User.signup(username="tester",
+                                 email="tester@test.com",
+                                 password="tester",
+                                 image_url=None)
+        db.session.commit()
+
+        self.testuser_id = self.testuser.id
+        self.other_id = self.other.id
+        usernames.rebuild()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_autocomplete(self):
+        resp = self.client.get("/users/autocomplete?q=TEST")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([user['username'] for user in resp.json['users']],
+                         ["tester", "testuser"])
+        self.assertIn("public", resp.headers['Cache-Control'])
+
+        resp = self.client.get("/users/autocomplete?q=test&limit=0")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_follow_reorders(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.other_id
+
+            c.post(f"/users/follow/{self.testuser_id}")
+
+        resp = self.client.get("/users/autocomplete?q=test")
+        self.assertEqual([user['username'] for user in resp.json['users']],
+                         ["testuser", "tester"])
+        self.assertEqual(resp.json['users'][0]['followers'], 1)
+
+    def test_signup_is_suggested(self):
+        self.client.post("/signup", data={"username": "testing123",
+                                          "password": "testing123",
+                                          "email": "t123@test.com"})
+
+        resp = self.client.get("/users/autocomplete?q=testi")
+        self.assertEqual([user['username'] for user in resp.json['users']],
+                         ["testing123"])
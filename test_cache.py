@@ -0,0 +1,72 @@
+"""Cache backend tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from jinja2 import Environment
+
+from cache import LRUCache, FragmentCacheExtension
+
+
+class LRUCacheTestCase(TestCase):
+    """Test the in-process LRU backend."""
+
+    def test_get_set(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = LRUCache(default_ttl=10)
+
+        with patch('cache.monotonic', return_value=100):
+            cache.set("a", 1)
+        with patch('cache.monotonic', return_value=105):
+            self.assertEqual(cache.get("a"), 1)
+        with patch('cache.monotonic', return_value=111):
+            self.assertIsNone(cache.get("a"))
+
+    def test_invalidate_tags(self):
+        cache = LRUCache()
+        cache.set("a", 1, tags=["user:1", "message:1"])
+        cache.set("b", 2, tags=["user:2"])
+
+        cache.invalidate("message:1")
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test the {% cache %} template tag."""
+
+    def test_fragment_is_cached(self):
+        env = Environment(extensions=[FragmentCacheExtension])
+        env.fragment_cache = LRUCache()
+        template = env.from_string(
+            "{% cache 'k', ['t'] %}{{ value }}{% endcache %}")
+
+        self.assertEqual(template.render(value=1), "1")
+        self.assertEqual(template.render(value=2), "1")
+
+        env.fragment_cache.invalidate('t')
+
+        self.assertEqual(template.render(value=3), "3")
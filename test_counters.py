@@ -0,0 +1,91 @@
+"""Denormalized counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import counters
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CountersTestCase(TestCase):
+    """Routes keep counters in step with the rows they count."""
+
+    def setUp(self):
+        """Create two users with a client logged in as each."""
+
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+
+        u1 = User(email="u1@test.com", username="u1", password="HASHED")
+        u2 = User(email="u2@test.com", username="u2", password="HASHED")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.c1 = app.test_client()
+        with self.c1.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        self.c2 = app.test_client()
+        with self.c2.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def test_follow_unfollow(self):
+        self.c1.post(f"/users/follow/{self.u2_id}")
+
+        self.assertEqual(self.counts(self.u1_id), (0, 1, 0, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 1, 0))
+
+        self.c1.post(f"/users/stop-following/{self.u2_id}")
+
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 0, 0))
+
+    def test_messages_and_likes(self):
+        self.c2.post("/messages/new", data={"text": "Hello"})
+        msg_id = Message.query.one().id
+
+        self.c1.post(f"/messages/{msg_id}")
+
+        self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 1))
+        self.assertEqual(Message.query.get(msg_id).likes_count, 1)
+
+        self.c2.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+    def test_reconcile(self):
+        db.session.add(FollowersFollowee(followee_id=self.u1_id,
+                                         follower_id=self.u2_id))
+        db.session.add(Message(text="Hello", user_id=self.u1_id))
+        db.session.commit()
+
+        counters.reconcile()
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u1_id), (1, 1, 0, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 1, 0))
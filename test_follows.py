@@ -0,0 +1,100 @@
+"""Followers/following page tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follows.py
+
+
+import os
+import re
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY
+import follows
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FollowsTestCase(TestCase):
+    """Test the paged lists and their "viewer follows" flags."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED")
+                 for name in ["viewer", "star", "fan1", "fan2", "fan3"]]
+        db.session.add_all(users)
+        db.session.commit()
+        (self.viewer_id, self.star_id,
+         *self.fan_ids) = [user.id for user in users]
+
+        # the columns read backwards, see FollowersFollowee
+        db.session.add_all(
+            [FollowersFollowee(followee_id=fan_id, follower_id=self.star_id)
+             for fan_id in self.fan_ids]
+            + [FollowersFollowee(followee_id=self.star_id,
+                                 follower_id=self.fan_ids[0]),
+               FollowersFollowee(followee_id=self.viewer_id,
+                                 follower_id=self.fan_ids[1])])
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_followers_before(self):
+        rows = follows.followers_before(self.star_id, self.viewer_id,
+                                        None).all()
+
+        self.assertEqual([(row.User.id, row.viewer_follows) for row in rows],
+                         [(self.fan_ids[2], False),
+                          (self.fan_ids[1], True),
+                          (self.fan_ids[0], False)])
+
+        rows = follows.followers_before(self.star_id, self.viewer_id,
+                                        self.fan_ids[1]).all()
+        self.assertEqual([row.User.id for row in rows], self.fan_ids[:1])
+
+    def test_following_before(self):
+        rows = follows.following_before(self.fan_ids[0], self.viewer_id,
+                                        None).all()
+
+        self.assertEqual([(row.User.id, row.viewer_follows) for row in rows],
+                         [(self.star_id, False)])
+
+    def test_followers_page(self):
+        per_page = app.config['USERS_PER_PAGE']
+        app.config['USERS_PER_PAGE'] = 2
+        try:
+            html = self.client.get(f"/users/{self.star_id}/followers").get_data(
+                as_text=True)
+            older = re.search(r'href="([^"]*before=[^"]*)"', html).group(1)
+            older_html = self.client.get(older).get_data(as_text=True)
+        finally:
+            app.config['USERS_PER_PAGE'] = per_page
+
+        self.assertIn("@fan3", html)
+        self.assertIn("@fan2", html)
+        self.assertNotIn("@fan1", html)
+        self.assertIn(f'action="/users/stop-following/{self.fan_ids[1]}"',
+                      html)
+        self.assertIn(f'action="/users/follow/{self.fan_ids[2]}"', html)
+
+        self.assertIn("@fan1", older_html)
+        self.assertNotIn("@fan2", older_html)
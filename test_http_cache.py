@@ -0,0 +1,195 @@
+"""Conditional GET tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Like, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test ETag handling."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        db.session.commit()
+
+        self.user_id = self.testuser.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        db.session.commit()
+
+    def test_profile_not_modified(self):
+        """Does a profile answer a matching If-None-Match with a 304?"""
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        etag = resp.headers['ETag']
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], "public, no-cache")
+
+        resp = self.client.get(f"/users/{self.user_id}",
+                               headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+
+    def test_profile_changes_etag(self):
+        """Does a new message change the profile's ETag?"""
+
+        etag = self.client.get(f"/users/{self.user_id}").headers['ETag']
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post("/messages/new", data={"text": "Hello"})
+
+        with self.client.session_transaction() as sess:
+            del sess[CURR_USER_KEY]
+
+        resp = self.client.get(f"/users/{self.user_id}",
+                               headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+        self.assertIn(b"Hello", resp.data)
+
+    def test_homepage_not_modified(self):
+        """Does the logged-in homepage answer with a private 304?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.get("/")
+            etag = resp.headers['ETag']
+
+            self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+
+            resp = c.get("/", headers={'If-None-Match': etag})
+
+            self.assertEqual(resp.status_code, 304)
+
+    def test_following_list_changes_etag(self):
+        """Does swapping one followed user for another change the ETag?"""
+
+        others = [User.signup(username=f"other{i}",
+                              email=f"other{i}@test.com",
+                              password="password",
+                              image_url=None)
+                  for i in range(2)]
+        db.session.commit()
+        other_ids = [other.id for other in others]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post(f"/users/follow/{other_ids[0]}")
+            url = f"/users/{self.user_id}/following"
+            etag = c.get(url).headers['ETag']
+
+            # the counts end up as they were
+            c.post(f"/users/follow/{other_ids[1]}")
+            c.post(f"/users/stop-following/{other_ids[0]}")
+
+            resp = c.get(url, headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"@other1", resp.data)
+        self.assertNotIn(b"@other0", resp.data)
+
+    def test_no_last_modified(self):
+        """Is a profile revalidated by ETag only, not by date?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post("/messages/new", data={"text": "Hello"})
+            resp = c.get(f"/users/{self.user_id}")
+            self.assertNotIn('Last-Modified', resp.headers)
+
+            c.post("/users/profile", data={"username": "testuser",
+                                           "email": "test@test.com",
+                                           "bio": "New bio",
+                                           "password": "testuser"})
+
+            resp = c.get(f"/users/{self.user_id}",
+                         headers={'If-Modified-Since':
+                                  "Fri, 01 Jan 2100 00:00:00 GMT"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"New bio", resp.data)
+
+    def test_likes_change_etag(self):
+        """Does swapping one liked message for another change the ETag?"""
+
+        author = User.signup(username="author",
+                             email="author@test.com",
+                             password="password",
+                             image_url=None)
+        db.session.commit()
+        messages = [Message(text=f"message {i}", user_id=author.id)
+                    for i in range(2)]
+        db.session.add_all(messages)
+        db.session.commit()
+        message_ids = [msg.id for msg in messages]
+        url = f"/users/{author.id}"
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post("/api/v1/likes", json={"ids": message_ids[:1]})
+            etag = c.get(url).headers['ETag']
+
+            # the viewer's likes_count ends up as it was
+            c.post("/api/v1/likes", json={"ids": message_ids[1:]})
+            c.delete("/api/v1/likes", json={"ids": message_ids[:1]})
+
+            resp = c.get(url, headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_other_pages_not_cached(self):
+        """Do routes without a policy keep the no-store headers?"""
+
+        resp = self.client.get("/login")
+
+        self.assertIn("no-store", resp.headers['Cache-Control'])
+        self.assertNotIn('ETag', resp.headers)
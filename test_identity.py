@@ -0,0 +1,80 @@
+"""Current user snapshot tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_identity.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache
+from identity import CurrentUser, load_current_user
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CurrentUserTestCase(TestCase):
+    """Test the cached logged-in user."""
+
+    def setUp(self):
+        """Create two users."""
+
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        u1 = User.signup("testuser1", "test1@test.com", "password", None)
+        u2 = User.signup("testuser2", "test2@test.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_snapshot_is_cached(self):
+        """Is the second load answered from the cache?"""
+
+        first = load_current_user(self.u1_id, cache, 60)
+        second = load_current_user(self.u1_id, cache, 60)
+
+        self.assertIsInstance(second, CurrentUser)
+        self.assertEqual(second.username, "testuser1")
+        self.assertIsNotNone(first._model)
+        self.assertIsNone(second._model)
+
+        self.assertEqual(second.model.id, self.u1_id)
+
+    def test_missing_user(self):
+        """Is a deleted user logged out?"""
+
+        self.assertIsNone(load_current_user(-1, cache, 60))
+
+    def test_invalidated_by_tags(self):
+        """Do the write routes' invalidations drop the snapshot?"""
+
+        current = load_current_user(self.u1_id, cache, 60)
+        self.assertFalse(current.is_following(User.query.get(self.u2_id)))
+
+        current.model.following.append(User.query.get(self.u2_id))
+        db.session.commit()
+
+        cached = load_current_user(self.u1_id, cache, 60)
+        self.assertFalse(cached.is_following(User.query.get(self.u2_id)))
+
+        cache.invalidate(f"stats:{self.u1_id}")
+
+        reloaded = load_current_user(self.u1_id, cache, 60)
+        self.assertTrue(reloaded.is_following(User.query.get(self.u2_id)))
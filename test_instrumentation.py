@@ -0,0 +1,100 @@
+"""Instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, instrumentation
+from instrumentation import Histogram, STATEMENT_BUCKETS
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+    """Test per-endpoint metrics and the slow request log."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        db.session.commit()
+
+        self.user_id = self.testuser.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        instrumentation.slow_seconds = app.config['SLOW_REQUEST_SECONDS']
+        instrumentation.sample_rate = app.config['SLOW_REQUEST_SAMPLE_RATE']
+        app.config['METRICS_TOKEN'] = None
+
+    def test_histogram(self):
+        histogram = Histogram(STATEMENT_BUCKETS)
+
+        for value in [0, 1, 3, 1000]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts[0], 1)
+        self.assertEqual(histogram.counts[1], 1)
+        self.assertEqual(histogram.counts[3], 1)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 1004)
+
+    def test_metrics_endpoint(self):
+        """Are requests counted per endpoint, with their SQL?"""
+
+        app.config['METRICS_TOKEN'] = "token"
+        self.client.get(f"/users/{self.user_id}")
+
+        resp = self.client.get("/metrics",
+                               headers={'Authorization': "Bearer token"})
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('warbler_request_seconds_count{endpoint="users_show"}',
+                      text)
+        self.assertIn('warbler_sql_statements_bucket{endpoint="users_show",'
+                      'le="+Inf"}', text)
+        self.assertIn("warbler_password_hash_pending", text)
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+        app.config['METRICS_TOKEN'] = "token"
+
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get(
+            "/metrics", headers={'Authorization': "Bearer other"}).status_code,
+            403)
+
+        resp = self.client.get("/metrics",
+                               headers={'Authorization': "Bearer token"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_slow_request_log(self):
+        """Are slow requests logged with their SQL statements?"""
+
+        instrumentation.slow_seconds = 0
+        instrumentation.sample_rate = 1
+
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.client.get(f"/users/{self.user_id}")
+
+        self.assertIn("slow request GET", logs.output[0])
+        self.assertIn("FROM messages", logs.output[0])
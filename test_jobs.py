@@ -0,0 +1,222 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY, job_queue
+from jobs import Job, JobQueue
+from tags import MessageTag
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class JobQueueTestCase(TestCase):
+    """Test queueing, batching and retrying."""
+
+    def setUp(self):
+        Job.query.delete()
+        db.session.commit()
+
+        self.queue = JobQueue(batch_size=2, max_attempts=2)
+        self.calls = []
+
+        @self.queue.handler('one')
+        def one(payload):
+            self.calls.append(('one', payload))
+
+        @self.queue.handler('many', batch=True)
+        def many(payloads):
+            self.calls.append(('many', payloads))
+
+        @self.queue.handler('broken')
+        def broken(payload):
+            raise ValueError("broken")
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_batches_same_kind(self):
+        for i in range(3):
+            self.queue.enqueue('many', {'n': i})
+        self.queue.enqueue('one', {'n': 9})
+        db.session.commit()
+
+        self.assertEqual(self.queue.run_once(), 2)
+        self.assertEqual(self.queue.run_once(), 1)
+        self.assertEqual(self.queue.run_once(), 1)
+        self.assertEqual(self.queue.run_once(), 0)
+
+        self.assertEqual(self.calls, [('many', [{'n': 0}, {'n': 1}]),
+                                      ('many', [{'n': 2}]),
+                                      ('one', {'n': 9})])
+        self.assertEqual(self.queue.stats()['done'], 4)
+
+    def test_idempotency_key(self):
+        self.queue.enqueue('one', {'n': 1}, key="k")
+        self.queue.enqueue('one', {'n': 2}, key="k")
+        db.session.commit()
+
+        self.queue.run_once()
+        self.assertEqual(self.calls, [('one', {'n': 1})])
+
+    def test_retry_with_backoff(self):
+        self.queue.enqueue('broken', {})
+        db.session.commit()
+
+        self.assertEqual(self.queue.run_once(), 1)
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn("ValueError: broken", job.last_error)
+        self.assertGreater(job.run_at, datetime.utcnow())
+
+        # not due yet
+        self.assertEqual(self.queue.run_once(), 0)
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        self.queue.run_once()
+        self.assertEqual(Job.query.one().status, 'failed')
+
+    def test_expired_lease(self):
+        """Are jobs of a worker that died claimed again?"""
+
+        self.queue.enqueue('one', {})
+        db.session.commit()
+        self.assertEqual(len(self.queue.claim()), 1)
+        self.assertEqual(self.queue.claim(), [])
+
+        Job.query.update({Job.locked_until: datetime.utcnow()
+                          - timedelta(seconds=1)})
+        db.session.commit()
+        self.assertEqual(len(self.queue.claim()), 1)
+
+    def test_eager(self):
+        self.queue.eager = True
+        self.queue.enqueue('one', {'n': 1})
+
+        self.assertEqual(self.calls, [('one', {'n': 1})])
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_never_eager(self):
+        @self.queue.handler('slow', eager=False)
+        def slow(payload):
+            self.calls.append(('slow', payload))
+
+        self.queue.eager = True
+        self.queue.enqueue('slow', {'n': 1})
+        db.session.commit()
+
+        self.assertEqual(self.calls, [])
+        self.queue.run_once()
+        self.assertEqual(self.calls, [('slow', {'n': 1})])
+
+    def test_work_burst(self):
+        for i in range(5):
+            self.queue.enqueue('one', {'n': i})
+        db.session.commit()
+
+        self.queue.work(app, threads=2, burst=True)
+
+        self.assertEqual(sorted(payload['n'] for _, payload in self.calls),
+                         [0, 1, 2, 3, 4])
+
+
+class DeferredWritesTestCase(TestCase):
+    """Test the routes' side effects running as jobs."""
+
+    def setUp(self):
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        MessageTag.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        db.session.commit()
+
+        self.testuser_id = self.testuser.id
+        job_queue.eager = False
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+
+    def tearDown(self):
+        db.session.rollback()
+        job_queue.eager = app.config['JOBS_EAGER']
+
+        # ids are reused by other tests' rows
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        MessageTag.query.delete()
+        db.session.commit()
+
+    def test_message_fan_out(self):
+        # warm the author's timeline
+        self.client.get("/")
+
+        self.client.post("/messages/new", data={"text": "Later #owl"})
+
+        self.assertEqual(MessageTag.query.count(), 0)
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+        self.assertEqual(job_queue.run_once(), 1)
+
+        self.assertEqual(MessageTag.query.count(), 1)
+        self.assertEqual(TimelineEntry.query.count(), 1)
+
+    def test_fan_out_after_warm(self):
+        """Does a fan-out skip timelines warmed since the message?"""
+
+        self.client.post("/messages/new", data={"text": "Later #owl"})
+        self.client.get("/")
+        self.assertEqual(TimelineEntry.query.count(), 1)
+
+        self.assertEqual(job_queue.run_once(), 1)
+
+        self.assertEqual(Job.query.one().status, 'done')
+        self.assertEqual(MessageTag.query.count(), 1)
+        self.assertEqual(TimelineEntry.query.count(), 1)
+
+    def test_backfill_after_fan_out(self):
+        """Does a backfill skip messages a fan-out already pushed?"""
+
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="other",
+                            image_url=None)
+        db.session.commit()
+        other_client = app.test_client()
+        with other_client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = other.id
+
+        self.client.get("/")
+        other_client.post("/messages/new", data={"text": "Hello"})
+        self.client.post(f"/users/follow/{other.id}")
+
+        while job_queue.run_once():
+            pass
+
+        self.assertEqual({job.status for job in Job.query}, {'done'})
+        self.assertEqual(TimelineEntry.query
+                         .filter_by(user_id=self.testuser_id).count(), 1)
@@ -0,0 +1,120 @@
+"""Like insert/delete/toggle tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+
+import os
+import re
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Like, Message, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY
+import likes
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LikesTestCase(TestCase):
+    """Test that likes and their counters change exactly once."""
+
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User(email="u1@test.com", username="u1", password="HASHED")
+        u2 = User(email="u2@test.com", username="u2", password="HASHED")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        messages = [Message(text=f"message {i}", user_id=u2.id)
+                    for i in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.message_ids = [msg.id for msg in messages]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self):
+        db.session.expire_all()
+        return (User.query.get(self.u1_id).likes_count,
+                [Message.query.get(id).likes_count for id in self.message_ids])
+
+    def test_add_remove(self):
+        self.assertEqual(likes.add(self.u1_id, self.message_ids[:2]),
+                         self.message_ids[:2])
+        self.assertEqual(likes.add(self.u1_id, self.message_ids),
+                         self.message_ids[2:])
+        db.session.commit()
+        self.assertEqual(self.counts(), (3, [1, 1, 1]))
+
+        self.assertEqual(likes.remove(self.u1_id, self.message_ids[:1]),
+                         self.message_ids[:1])
+        self.assertEqual(likes.remove(self.u1_id, self.message_ids[:1]), [])
+        db.session.commit()
+        self.assertEqual(self.counts(), (2, [0, 1, 1]))
+
+    def test_toggle(self):
+        message_id = self.message_ids[0]
+
+        self.assertEqual(likes.toggle(self.u1_id, message_id), (True, 1))
+        db.session.commit()
+        self.assertEqual(likes.toggle(self.u1_id, message_id), (False, 0))
+        db.session.commit()
+
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(self.counts(), (0, [0, 0, 0]))
+
+    def test_unique(self):
+        db.session.add_all([Like(user_id=self.u1_id,
+                                 message_id=self.message_ids[0])
+                            for _ in range(2)])
+
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_likes_page(self):
+        """Does it list the user's likes, last liked first, page by page?"""
+
+        cache.clear()
+        start = datetime(2020, 1, 1)
+        db.session.add_all([Like(user_id=self.u1_id, message_id=message_id,
+                                 timestamp=start + timedelta(minutes=i))
+                            for i, message_id
+                            in enumerate(reversed(self.message_ids))])
+        db.session.commit()
+
+        client = app.test_client()
+        # viewed by someone who likes none of them
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+        per_page = app.config['MESSAGES_PER_PAGE']
+        app.config['MESSAGES_PER_PAGE'] = 2
+        try:
+            html = client.get(f"/users/{self.u1_id}/likes").get_data(
+                as_text=True)
+            older = re.search(r'href="([^"]*before=[^"]*)"', html).group(1)
+            older_html = client.get(older).get_data(as_text=True)
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = per_page
+
+        self.assertLess(html.index("message 0"), html.index("message 1"))
+        self.assertNotIn("message 2", html)
+        self.assertNotIn("fas fa-star", html)
+
+        self.assertIn("message 2", older_html)
+        self.assertNotIn("message 1", older_html)
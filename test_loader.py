@@ -0,0 +1,107 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Like, Message, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import loader
+
+db.create_all()
+
+
+class Interrupted(Exception):
+    pass
+
+
+class LoaderTestCase(TestCase):
+    """Test loading CSV and JSON Lines files."""
+
+    def setUp(self):
+        """Write a small data set to a temporary directory."""
+
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        loader.LoadCheckpoint.query.delete()
+        db.session.commit()
+
+        self.directory = tempfile.mkdtemp()
+
+        with open(os.path.join(self.directory, 'users.csv'), 'w') as f:
+            f.write("id,email,username,password,bio\n")
+            for i in range(1, 11):
+                f.write(f"{i},user{i}@test.com,user{i},$2b$12$x,\n")
+
+        self.write_messages(25)
+
+    def write_messages(self, count):
+        with open(os.path.join(self.directory, 'messages.jsonl'), 'w') as f:
+            for i in range(count):
+                f.write(json.dumps({'text': f"message {i}",
+                                    'timestamp': f"2020-01-01 00:00:{i:02}",
+                                    'user_id': i % 10 + 1}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        db.session.rollback()
+
+    def test_load_directory(self):
+        results = loader.load_directory(db.engine, self.directory, chunk_size=4)
+
+        self.assertEqual(results['users'][0], 10)
+        self.assertEqual(results['messages'][0], 25)
+        self.assertNotIn('follows', results)
+
+        user = User.query.get(3)
+        self.assertEqual(user.username, "user3")
+        self.assertIsNone(user.bio)
+        # Python-side defaults fill in missing columns
+        self.assertEqual(user.image_url, "/static/images/default-pic.png")
+        self.assertEqual(Message.query.filter_by(user_id=1).count(), 3)
+
+    def test_resume(self):
+        """Does a load continue after the last committed chunk?"""
+
+        def interrupt(table, rows, seconds):
+            if table == 'messages' and rows >= 8:
+                raise Interrupted
+
+        with self.assertRaises(Interrupted):
+            loader.load_directory(db.engine, self.directory, chunk_size=4,
+                                  progress=interrupt)
+
+        self.assertEqual(Message.query.count(), 8)
+
+        results = loader.load_directory(db.engine, self.directory, chunk_size=4)
+
+        self.assertEqual(results['users'][0], 0)
+        self.assertEqual(results['messages'][0], 17)
+        self.assertEqual(Message.query.count(), 25)
+
+    def test_regenerated_file(self):
+        """Is a file written again after a complete load loaded again?"""
+
+        loader.load_directory(db.engine, self.directory, chunk_size=4)
+        Message.query.delete()
+        db.session.commit()
+        self.write_messages(30)
+
+        results = loader.load_directory(db.engine, self.directory, chunk_size=4)
+
+        self.assertEqual(results['users'][0], 0)
+        self.assertEqual(results['messages'][0], 30)
+        self.assertEqual(Message.query.count(), 30)
+        self.assertEqual(loader.LoadCheckpoint.query.count(), 2)
@@ -2,7 +2,7 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_message_views.py
+#    python -m unittest test_message_views.py
 
 
 import os
@@ -71,3 +71,32 @@ class MessageViewTestCase(TestCase):
 
             msg = Message.query.one()
             self.assertEqual(msg.text, "Hello")
+
+    def test_delete_message(self):
+        """Can a user delete their own message, and only their own?"""
+
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="other",
+                            image_url=None)
+        db.session.commit()
+        db.session.add_all([Message(text="mine", user_id=self.testuser.id),
+                            Message(text="theirs", user_id=other.id)])
+        db.session.commit()
+        mine = Message.query.filter_by(text="mine").one().id
+        theirs = Message.query.filter_by(text="theirs").one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post(f"/messages/{theirs}/delete")
+            self.assertEqual(resp.status_code, 403)
+
+            resp = c.post(f"/messages/{theirs + mine + 1}/delete")
+            self.assertEqual(resp.status_code, 404)
+
+            resp = c.post(f"/messages/{mine}/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual([msg.id for msg in Message.query], [theirs])
@@ -0,0 +1,64 @@
+"""Migration and index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Like, Message, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import migrations
+
+db.create_all()
+
+
+class MigrationsTestCase(TestCase):
+    """Test upgrade-db and explain-queries."""
+
+    def test_upgrade_is_idempotent(self):
+        migrations.upgrade(db.engine)
+
+        self.assertEqual(migrations.upgrade(db.engine), [])
+
+    def test_hot_queries_use_indexes(self):
+        migrations.upgrade(db.engine)
+
+        for description, index, ok, plan in migrations.explain_queries(db.engine):
+            self.assertTrue(ok, f"{description} doesn't use {index}:\n{plan}")
+
+    def test_dedupe_likes(self):
+        """Are duplicate likes removed before the unique index is built?"""
+
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User(email="u1@test.com", username="u1", password="HASHED",
+                  likes_count=3)
+        u2 = User(email="u2@test.com", username="u2", password="HASHED")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        msg = Message(text="Hello", user_id=u2.id, likes_count=3)
+        db.session.add(msg)
+        db.session.commit()
+
+        # as before the index existed
+        db.engine.execute("DROP INDEX uq_likes_user_id_message_id")
+        db.session.add_all([Like(user_id=u1.id, message_id=msg.id)
+                            for _ in range(3)])
+        db.session.commit()
+
+        changes = migrations.upgrade(db.engine)
+
+        self.assertIn("created index uq_likes_user_id_message_id", changes)
+        self.assertEqual(Like.query.count(), 1)
+        db.session.expire_all()
+        self.assertEqual(User.query.get(u1.id).likes_count, 1)
+        self.assertEqual(Message.query.get(msg.id).likes_count, 1)
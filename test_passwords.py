@@ -0,0 +1,55 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from unittest import TestCase
+
+from passwords import PasswordHasher, hash_rounds
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test PasswordHasher inline and with worker processes."""
+
+    def setUp(self):
+        self.hasher = PasswordHasher(rounds=4, workers=0)
+
+    def tearDown(self):
+        self.hasher.shutdown()
+
+    def test_hash_and_check(self):
+        hashed = self.hasher.hash("secret")
+
+        self.assertEqual(hash_rounds(hashed), 4)
+        self.assertTrue(self.hasher.check(hashed, "secret"))
+        self.assertFalse(self.hasher.check(hashed, "wrong"))
+
+    def test_worker_processes(self):
+        self.hasher.configure(rounds=4, workers=2)
+
+        hashed = self.hasher.hash("secret")
+
+        self.assertTrue(self.hasher.check(hashed, "secret"))
+        self.assertEqual(self.hasher.stats()['completed'], 2)
+        self.assertEqual(self.hasher.stats()['pending'], 0)
+
+    def test_invalid_hashes(self):
+        """Are non-bcrypt stored passwords rejected, not errors?"""
+
+        self.assertFalse(self.hasher.check("secret", "secret"))
+        self.assertFalse(self.hasher.check("$2b$xx$garbage", "secret"))
+        self.assertFalse(self.hasher.check("$2b$04$garbage", "secret"))
+        self.assertFalse(self.hasher.check(self.hasher.hash("secret"), ""))
+
+    def test_needs_rehash(self):
+        hashed = self.hasher.hash("secret")
+        self.assertFalse(self.hasher.needs_rehash(hashed))
+
+        self.hasher.configure(rounds=5, workers=0)
+        self.assertTrue(self.hasher.needs_rehash(hashed))
+
+    def test_empty_password(self):
+        with self.assertRaises(ValueError):
+            self.hasher.hash("")
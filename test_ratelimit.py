@@ -0,0 +1,123 @@
+"""Login rate limiting tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ratelimit.py
+
+
+from unittest import TestCase
+
+from ratelimit import FailureTable, LoginLimiter, MemoryStorage
+from sketch import CountMinSketch, SlidingCountMin
+
+
+class SketchTestCase(TestCase):
+    """Test the count-min sketches."""
+
+    def test_count_min(self):
+        sketch = CountMinSketch(width=64, depth=4)
+
+        for i in range(1000):
+            sketch.add(f"key{i % 100}")
+
+        self.assertGreaterEqual(sketch.estimate("key7"), 10)
+        self.assertEqual(sketch.add("other", 5), sketch.estimate("other"))
+
+        sketch.clear()
+        self.assertEqual(sketch.estimate("key7"), 0)
+
+    def test_sliding_window(self):
+        counts = SlidingCountMin(window=60, buckets=6)
+
+        counts.add("a", now=0)
+        counts.add("a", now=30)
+        self.assertEqual(counts.estimate("a", now=59), 2)
+
+        # the first bucket (0-10s) has left the window
+        self.assertEqual(counts.estimate("a", now=61), 1)
+        self.assertEqual(counts.estimate("a", now=100), 0)
+
+
+class FailureTableTestCase(TestCase):
+    """Test the exact counts of the keys failing most."""
+
+    def test_window(self):
+        table = FailureTable(window=60, limit=3)
+
+        for now in [0, 10, 20, 30]:
+            table.add("a", now=now)
+
+        # no more than the limit is kept
+        self.assertEqual(table.count("a", now=30), 3)
+        self.assertEqual(table.count("a", now=85), 1)
+        self.assertIsNone(table.count("b", now=85))
+
+    def test_keeps_heavy_keys(self):
+        table = FailureTable(window=60, limit=3, capacity=10)
+
+        for _ in range(3):
+            table.add("target", now=0)
+        for i in range(100):
+            table.add(f"one-off{i}", now=1)
+
+        self.assertEqual(table.count("target", now=2), 3)
+        self.assertIsNone(table.count("one-off0", now=2))
+        self.assertEqual(table.floor(now=2), 1)
+        self.assertEqual(table.floor(now=70), 0)
+
+
+class LoginLimiterTestCase(TestCase):
+    """Test LoginLimiter."""
+
+    def setUp(self):
+        self.limiter = LoginLimiter(MemoryStorage(limit=3),
+                                    MemoryStorage(limit=5),
+                                    "secret",
+                                    max_per_username=3, max_per_ip=5)
+
+    def test_limit_per_username(self):
+        for i in range(3):
+            self.assertFalse(self.limiter.limited("bob", f"10.0.0.{i}"))
+            self.limiter.record_failure("bob", f"guess{i}", f"10.0.0.{i}")
+
+        self.assertTrue(self.limiter.limited("bob", "10.0.0.9"))
+        self.assertFalse(self.limiter.limited("alice", "10.0.0.9"))
+
+    def test_limit_per_ip(self):
+        for i in range(5):
+            self.limiter.record_failure(f"user{i}", "guess", "10.0.0.1")
+
+        self.assertTrue(self.limiter.limited("alice", "10.0.0.1"))
+        self.assertFalse(self.limiter.limited("alice", "10.0.0.2"))
+
+    def test_known_failures(self):
+        self.limiter.record_failure("bob", "guess", "10.0.0.1")
+
+        self.assertTrue(self.limiter.known_failure("bob", "guess"))
+        self.assertFalse(self.limiter.known_failure("bob", "other"))
+
+        self.limiter.forget("bob")
+        self.assertFalse(self.limiter.known_failure("bob", "guess"))
+
+    def test_flood_of_usernames(self):
+        """Does a flood of distinct usernames leave other users alone?"""
+
+        limiter = LoginLimiter(MemoryStorage(limit=3, capacity=1000,
+                                             width=256),
+                               MemoryStorage(limit=5, capacity=1000,
+                                             width=256),
+                               "secret",
+                               max_per_username=3, max_per_ip=5)
+
+        for i in range(3):
+            limiter.record_failure("target", f"guess{i}", "10.0.0.1")
+        for i in range(20000):
+            limiter.record_failure(f"user{i}", "guess",
+                                   f"10.{i % 256}.{i // 256}.1")
+
+        # the sketch alone would refuse everyone by now
+        self.assertGreaterEqual(limiter.usernames._counts.estimate("alice"), 3)
+
+        for i in range(200):
+            self.assertFalse(limiter.limited(f"unrelated{i}", "192.168.0.1"))
+        self.assertTrue(limiter.limited("target", "192.168.0.1"))
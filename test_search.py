@@ -0,0 +1,133 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY, search_index
+from search import InvertedIndex, tokenize
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InvertedIndexTestCase(TestCase):
+    """Test the in-process index."""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, "Birds of a feather")
+        self.index.add(2, "The early bird gets the worm")
+        self.index.add(3, "bird bird bird, said the bird")
+        self.index.add(4, "Nothing to see here")
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("The Early bird, and THE worm!"),
+                         ["early", "bird", "worm"])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.index.search("early bird", 10), [2])
+        self.assertEqual(self.index.search("early cat", 10), [])
+        self.assertEqual(self.index.search("the", 10), [])
+
+    def test_ranking(self):
+        """Are documents ranked by relevance, then newest first?"""
+
+        self.assertEqual(self.index.search("bird", 10), [3, 2])
+        self.assertEqual(self.index.search("bird", 1, offset=1), [2])
+
+    def test_add_out_of_order_and_replace(self):
+        self.index.add(0, "early riser")
+        self.index.add(2, "a different text now")
+
+        self.assertEqual(self.index.search("early", 10), [0])
+        self.assertEqual(self.index.search("different text", 10), [2])
+
+    def test_remove(self):
+        self.index.remove(3)
+        self.index.remove(3)
+
+        self.assertEqual(self.index.search("bird", 10), [2])
+        self.assertEqual(len(self.index), 3)
+
+
+class SearchViewTestCase(TestCase):
+    """Test the /search route."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        self.birder = User.signup(username="birder",
+                                  email="birder@test.com",
+                                  password="birder",
+                                  image_url=None)
+        self.birder.bio = "Watching herons"
+        db.session.commit()
+
+        db.session.add_all([
+            Message(text="A heron by the river", user_id=self.birder.id),
+            Message(text="Lunch was soup", user_id=self.birder.id),
+        ])
+        db.session.commit()
+
+        self.testuser_id = self.testuser.id
+        search_index.rebuild()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_search_messages(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/search?q=heron river")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("A heron by the river", html)
+            self.assertNotIn("Lunch was soup", html)
+
+    def test_search_users(self):
+        resp = self.client.get("/search?q=birder&kind=users")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@birder", html)
+        self.assertNotIn("@testuser", html)
+
+    def test_new_message_is_searchable(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post("/messages/new", data={"text": "Spotted a kingfisher"})
+            resp = c.get("/search?q=kingfisher")
+
+            self.assertIn("Spotted a kingfisher", resp.get_data(as_text=True))
+
+    def test_bad_arguments(self):
+        self.assertEqual(self.client.get("/search?q=a&kind=x").status_code,
+                         400)
+        self.assertEqual(self.client.get("/search?q=a&page=0").status_code,
+                         400)
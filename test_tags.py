@@ -0,0 +1,158 @@
+"""Hashtag, mention and trending tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_tags.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, FollowersFollowee, Message, User
+from timelines import Timeline, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, cache, CURR_USER_KEY, trending
+from tags import (Mention, MessageTag, TrendingTags, extract_mentions,
+                  extract_tags, link_tags)
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ExtractionTestCase(TestCase):
+    """Test parsing message text."""
+
+    def test_extract_tags(self):
+        self.assertEqual(extract_tags("#Birds and #birds, #owls! a#b ##x"),
+                         ["birds", "owls"])
+
+    def test_extract_mentions(self):
+        self.assertEqual(extract_mentions("hi @bob and @bob, me@mail.com"),
+                         ["bob"])
+
+    def test_link_tags(self):
+        html = link_tags("<b>it's</b> #Owls")
+
+        self.assertEqual(html, '&lt;b&gt;it&#39;s&lt;/b&gt; '
+                               '<a href="/tags/owls">#Owls</a>')
+
+
+class TrendingTagsTestCase(TestCase):
+    """Test the approximate trending tags."""
+
+    def setUp(self):
+        self.trending = TrendingTags(window=60, buckets=6, capacity=3)
+        self.trending._warm = True
+
+    def test_top(self):
+        for tag, uses in [("a", 5), ("b", 3), ("c", 1)]:
+            for _ in range(uses):
+                self.trending.add([tag], now=1000)
+
+        self.assertEqual(self.trending.top(2, now=1000), [("a", 5), ("b", 3)])
+
+    def test_heavy_hitter_replaces_candidate(self):
+        self.trending.add(["a", "b", "c"], now=1000)
+        for _ in range(4):
+            self.trending.add(["d"], now=1000)
+
+        self.assertEqual(self.trending.top(1, now=1000), [("d", 4)])
+        self.assertEqual(len(self.trending._candidates), 3)
+
+    def test_window_expires(self):
+        self.trending.add(["old"], now=1000)
+        self.trending.add(["new"], now=1050)
+
+        self.assertEqual(self.trending.top(now=1055), [("new", 1), ("old", 1)])
+        self.assertEqual(self.trending.top(now=1070), [("new", 1)])
+
+
+class TagViewsTestCase(TestCase):
+    """Test tagging messages through the routes."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        MessageTag.query.delete()
+        Mention.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        cache.clear()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        self.birder = User.signup(username="birder",
+                                  email="birder@test.com",
+                                  password="birder",
+                                  image_url=None)
+        db.session.commit()
+
+        self.testuser_id = self.testuser.id
+        self.birder_id = self.birder.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def post(self, text):
+        self.client.post("/messages/new", data={"text": text})
+        return Message.query.filter_by(text=text).one().id
+
+    def test_tag_timeline(self):
+        self.post("An #Owl tonight @birder")
+        self.post("Soup again")
+
+        resp = self.client.get("/tags/OWL")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('<a href="/tags/owl">#Owl</a>', html)
+        self.assertNotIn("Soup again", html)
+
+    def test_tag_pages(self):
+        app.config['MESSAGES_PER_PAGE'] = 1
+        try:
+            self.post("first #owl")
+            self.post("second #owl")
+
+            html = self.client.get("/tags/owl").get_data(as_text=True)
+            self.assertIn("second", html)
+            self.assertNotIn("first", html)
+            self.assertIn("before=", html)
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = 100
+
+    def test_mentions_timeline(self):
+        self.post("Hello @birder and @nobody")
+
+        resp = self.client.get(f"/users/{self.birder_id}/mentions")
+        self.assertIn("Hello @birder", resp.get_data(as_text=True))
+        self.assertEqual(Mention.query.count(), 1)
+
+        resp = self.client.get(f"/users/{self.testuser_id}/mentions")
+        self.assertNotIn("Hello @birder", resp.get_data(as_text=True))
+
+    def test_delete_message(self):
+        message_id = self.post("Gone soon #owl @birder")
+
+        self.client.post(f"/messages/{message_id}/delete")
+
+        self.assertEqual(MessageTag.query.count(), 0)
+        self.assertEqual(Mention.query.count(), 0)
+
+    def test_trending(self):
+        trending.warm()
+        self.post("#wren #wren")
+        self.post("#wren #heron")
+
+        html = self.client.get("/tags").get_data(as_text=True)
+        self.assertLess(html.index("#wren"), html.index("#heron"))
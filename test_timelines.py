@@ -0,0 +1,131 @@
+"""Timeline store tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from timelines import (MemoryTimelineStore, SQLTimelineStore, Timeline,
+                       TimelineEntry)
+
+db.create_all()
+
+
+class TimelineStoreTestCase(TestCase):
+    """Behaviour shared by every timeline backend."""
+
+    store_class = MemoryTimelineStore
+
+    def setUp(self):
+        """Create two users; u1 follows u2."""
+
+        TimelineEntry.query.delete()
+        Timeline.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+
+        self.u1 = User(email="u1@test.com", username="u1", password="HASHED")
+        self.u2 = User(email="u2@test.com", username="u2", password="HASHED")
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+        self.u1.following.append(self.u2)
+        self.u1.following_count = 1
+        self.u2.followers_count = 1
+        db.session.commit()
+
+        self.store = self.store_class(size=3)
+
+    def post(self, user, text):
+        msg = Message(text=text, user_id=user.id)
+        db.session.add(msg)
+        db.session.flush()
+        self.store.push(msg)
+        db.session.commit()
+        return msg
+
+    def test_cold(self):
+        """A timeline nobody warmed can't answer."""
+
+        self.assertIsNone(self.store.get(self.u1.id, 3))
+
+    def test_push_to_warm_timeline(self):
+        self.store.warm(self.u1.id, [])
+        db.session.commit()
+
+        msg = self.post(self.u2, "hello")
+
+        self.assertEqual(self.store.get(self.u1.id, 3), [msg.id])
+
+    def test_trim_sets_horizon(self):
+        """Once trimmed, reads deeper than the timeline fall back."""
+
+        self.store.warm(self.u1.id, [])
+        db.session.commit()
+
+        msgs = [self.post(self.u2, f"msg {i}") for i in range(5)]
+
+        self.assertEqual(self.store.get(self.u1.id, 2), [msgs[4].id, msgs[3].id])
+        self.assertIsNone(self.store.get(self.u1.id, 5))
+
+    def test_prune(self):
+        self.store.warm(self.u1.id, [])
+        db.session.commit()
+        self.post(self.u2, "hello")
+
+        self.store.prune(self.u1.id, self.u2.id)
+        db.session.commit()
+
+        self.assertEqual(self.store.get(self.u1.id, 3), [])
+
+    def test_celebrity_pulled_at_read(self):
+        """Posts by popular users aren't pushed but still show up."""
+
+        self.store.celebrity_threshold = 1
+        self.store.warm(self.u1.id, [])
+        db.session.commit()
+
+        msg = self.post(self.u2, "hello")
+
+        self.assertEqual(self.store.get(self.u1.id, 3), [])
+        self.assertEqual(self.store.messages_for(self.u1.id, 3), [msg])
+
+    def test_celebrity_threshold_crossed(self):
+        """Posts made on either side of the threshold keep showing up."""
+
+        self.store.celebrity_threshold = 1
+        self.store.warm(self.u1.id, [])
+        db.session.commit()
+        pulled = self.post(self.u2, "pulled")
+
+        self.u2.followers_count = 0
+        self.store.followers_changed([self.u2.id], -1)
+        db.session.commit()
+
+        self.assertIsNone(self.store.get(self.u1.id, 3))
+        self.assertEqual(self.store.messages_for(self.u1.id, 3), [pulled])
+        db.session.commit()
+
+        pushed = self.post(self.u2, "pushed")
+        self.u2.followers_count = 1
+        self.store.followers_changed([self.u2.id], 1)
+        db.session.commit()
+
+        self.assertIsNone(self.store.get(self.u1.id, 3))
+        self.assertEqual(self.store.messages_for(self.u1.id, 3),
+                         [pushed, pulled])
+
+
+class SQLTimelineStoreTestCase(TimelineStoreTestCase):
+    """Same tests against the SQL backend."""
+
+    store_class = SQLTimelineStore
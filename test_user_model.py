@@ -8,7 +8,8 @@
 import os
 from unittest import TestCase
 
-from models import db, User, Message, FollowersFollowee
+from models import db, hasher, User, Message, FollowersFollowee
+from passwords import hash_rounds
 from sqlalchemy.exc import IntegrityError as ie, InvalidRequestError
 
 # BEFORE we import our app, let's set an environmental variable
@@ -183,6 +184,32 @@ class UserModelTestCase(TestCase):
         self.assertEqual(u2.followers, [])
 
 
+    def test_is_following_method(self):
+        """is_following / is_followed_by agree with and without the id cache"""
+
+        u1 = User(email="test31@test.com", username="testuser1",
+                  password="HASHED_PASSWORD", id=5900)
+        u2 = User(email="test32@test.com", username="testuser2",
+                  password="HASHED_PASSWORD", id=5901)
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        u1.following.append(u2)
+        db.session.commit()
+
+        self.assertTrue(u1.is_following(u2))
+        self.assertFalse(u2.is_following(u1))
+        self.assertTrue(u2.is_followed_by(u1))
+        self.assertFalse(u1.is_followed_by(u2))
+
+        u1.load_following_ids()
+        u2.load_following_ids()
+
+        self.assertTrue(u1.is_following(u2))
+        self.assertFalse(u2.is_following(u1))
+        self.assertTrue(u2.is_followed_by(u1))
+        self.assertFalse(u1.is_followed_by(u2))
+
     def test_create_new_user(self):
         """ test if signup() successfully create a new user given valid credentials and redirect to the home page"""
 
@@ -273,3 +300,21 @@ class UserModelTestCase(TestCase):
 
         self.assertFalse(test_login)
         
+
+    def test_authenticate_rehashes(self):
+        """ rehashes a password stored with an outdated work factor """
+        test_user = User.signup(username="Kristina",
+                                email="test1@gmail.com",
+                                password="test1",
+                                image_url=None)
+        db.session.commit()
+
+        old_rounds = hasher.rounds
+        hasher.configure(rounds=old_rounds - 1, workers=hasher.workers)
+        try:
+            test_login = User.authenticate(username="Kristina", password="test1")
+        finally:
+            hasher.configure(rounds=old_rounds, workers=hasher.workers)
+
+        self.assertEqual(test_login, test_user)
+        self.assertEqual(hash_rounds(test_login.password), old_rounds - 1)
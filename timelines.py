@@ -0,0 +1,581 @@
+"""Precomputed home timelines for Warbler.
+
+Fan-out on write: when a message is posted, its id is pushed into the
+timeline of every (warm) follower of the author, so the homepage can read
+the newest ids directly instead of querying every followee.
+
+Each timeline holds at most `size` entries, newest first. When entries are
+trimmed off the end, the timeline remembers its *horizon* -- the newest
+entry it threw away. Everything newer than the horizon is guaranteed to be
+in the timeline; reads that need to look past it return None and the caller
+falls back to querying messages directly.
+
+Authors with at least `celebrity_threshold` followers are not fanned out --
+one post from them would be that many writes. Their messages are pulled at
+read time instead and merged into the precomputed part by timestamp. When
+an author's follower count crosses the threshold, the timelines of their
+followers go cold (see `followers_changed()`): what was pushed no longer
+matches what would be pulled.
+"""
+
+from bisect import bisect_left, insort
+from heapq import merge
+from threading import Lock
+
+from sqlalchemy import exists, literal, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.orm import joinedload
+
+from models import db, visible_messages, FollowersFollowee, Message, User
+from pagination import messages_before
+
+
+def _follower_ids_query(author_id):
+    """Query for the ids of users who follow `author_id`."""
+
+    return (db.session
+            .query(FollowersFollowee.followee_id)
+            .filter(FollowersFollowee.follower_id == author_id))
+
+
+def _followee_ids_query(user_id):
+    """Query for the ids of users `user_id` follows."""
+
+    return (db.session
+            .query(FollowersFollowee.follower_id)
+            .filter(FollowersFollowee.followee_id == user_id))
+
+
+def _recent_messages(user_ids, limit, before=None):
+    """Newest `limit` messages written by any of `user_ids`."""
+
+    query = (visible_messages(Message.query)
+             .options(joinedload(Message.user))
+             .filter(Message.user_id.in_(user_ids)))
+    return messages_before(query, before).limit(limit).all()
+
+
+def _entry(message):
+    return (message.timestamp, message.id, message.user_id)
+
+
+def merge_messages(streams, limit):
+    """K-way merge of message lists (each newest first), without duplicates."""
+
+    seen = set()
+    merged = []
+
+    for msg in merge(*streams,
+                     key=lambda msg: (msg.timestamp, msg.id),
+                     reverse=True):
+        if msg.id not in seen:
+            seen.add(msg.id)
+            merged.append(msg)
+            if len(merged) == limit:
+                break
+
+    return merged
+
+
+class TimelineStore:
+    """Base class for timeline backends.
+
+    Backends only store message ids; `messages_for()` loads the messages
+    and merges in whatever was pulled rather than pushed.
+    """
+
+    def __init__(self, size=100, celebrity_threshold=None):
+        self.size = size
+        self.celebrity_threshold = celebrity_threshold
+
+    def _fans_out(self, author_id):
+        """Should messages by `author_id` be pushed to their followers?"""
+
+        if self.celebrity_threshold is None:
+            return True
+
+        followers = (db.session
+                     .query(User.followers_count)
+                     .filter(User.id == author_id)
+                     .scalar())
+        return (followers or 0) < self.celebrity_threshold
+
+    def _followed_celebrities(self, user_id):
+        """Ids of users `user_id` follows whose messages aren't pushed."""
+
+        if self.celebrity_threshold is None:
+            return []
+
+        return [row.follower_id for row in (
+            _followee_ids_query(user_id)
+            .join(User, User.id == FollowersFollowee.follower_id)
+            .filter(User.followers_count >= self.celebrity_threshold))]
+
+    def followers_changed(self, author_ids, delta):
+        """Each of `author_ids` gained `delta` followers (negative if lost).
+
+        Call it after the counters are updated. Authors this moves across
+        `celebrity_threshold` had their older messages pulled where they
+        would now be pushed, or the other way round, so their followers'
+        timelines go cold and are rebuilt from messages on the next read.
+        """
+
+        if self.celebrity_threshold is None or not delta:
+            return
+
+        threshold = self.celebrity_threshold
+        crossed = [row.id for row in (
+            db.session
+            .query(User.id, User.followers_count)
+            .filter(User.id.in_(author_ids)))
+            if ((row.followers_count >= threshold)
+                != (row.followers_count - delta >= threshold))]
+
+        for author_id in crossed:
+            self.cool(_follower_ids_query(author_id))
+
+    def messages_for(self, user_id, limit, before=None):
+        """Newest `limit` messages for the home timeline of `user_id`.
+
+        `before` is a (timestamp, id) pagination key. Warms the timeline if
+        it is cold; the caller should commit.
+        """
+
+        message_ids = self.get(user_id, limit, before)
+
+        if message_ids is None:
+            users_ids = [row.follower_id for row in _followee_ids_query(user_id)]
+            users_ids.append(user_id)
+
+            if before is not None:
+                # too deep for the timeline; nothing to warm
+                return _recent_messages(users_ids, limit, before)
+
+            messages = _recent_messages(users_ids, self.size)
+            self.warm(user_id, messages)
+
+            if limit > self.size:
+                return _recent_messages(users_ids, limit)
+            return messages[:limit]
+
+        messages = []
+        if message_ids:
+            query = (visible_messages(Message.query)
+                     .options(joinedload(Message.user))
+                     .filter(Message.id.in_(message_ids)))
+            messages = messages_before(query, None).all()
+
+        celebrity_ids = self._followed_celebrities(user_id)
+        if celebrity_ids:
+            pulled = _recent_messages(celebrity_ids, limit, before)
+            messages = merge_messages([messages, pulled], limit)
+
+        return messages
+
+    def get(self, user_id, limit, before=None):
+        """Return the newest `limit` message ids for `user_id`.
+
+        With `before` (a (timestamp, id) pair), start after that message.
+
+        Returns None if the timeline is cold, or if it can't answer
+        completely -- the caller should then use `warm()`.
+        """
+
+        raise NotImplementedError
+
+    def warm(self, user_id, messages):
+        """Seed the timeline of `user_id` from a fallback query result.
+
+        `messages` must be the newest messages of the timeline, newest
+        first, as returned by a query limited to `self.size`.
+        """
+
+        raise NotImplementedError
+
+    def push(self, message):
+        """Fan `message` out to its author and their warm followers."""
+
+        raise NotImplementedError
+
+    def backfill(self, user_id, followee_id):
+        """`user_id` started following `followee_id`: merge their messages."""
+
+        raise NotImplementedError
+
+    def prune(self, user_id, followee_id):
+        """`user_id` stopped following `followee_id`: drop their messages."""
+
+        raise NotImplementedError
+
+    def remove_message(self, message):
+        """Drop a deleted message from every timeline."""
+
+        raise NotImplementedError
+
+    def drop_user(self, user_id):
+        """Forget the timeline of `user_id` and every message they wrote."""
+
+        raise NotImplementedError
+
+    def cool(self, user_ids):
+        """Forget the timelines of `user_ids` (a query for their ids)."""
+
+        raise NotImplementedError
+
+    def clear(self):
+        """Forget every timeline, e.g. after a bulk load; they go cold."""
+
+        raise NotImplementedError
+
+
+class MemoryTimelineStore(TimelineStore):
+    """Timelines kept in a dict in this process.
+
+    Only suitable for a single-process deployment (or for tests); every
+    process has its own copy and they are lost on restart.
+    """
+
+    def __init__(self, size=100, celebrity_threshold=None):
+        super().__init__(size, celebrity_threshold)
+        # user_id -> [entries sorted oldest first, horizon]
+        # an entry is (timestamp, message_id, author_id)
+        self._timelines = {}
+        self._lock = Lock()
+
+    def _trim(self, timeline):
+        entries = timeline[0]
+        if len(entries) > self.size:
+            cut = len(entries) - self.size
+            timeline[1] = max(timeline[1] or (), entries[cut - 1][:2])
+            del entries[:cut]
+
+    def get(self, user_id, limit, before=None):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return None
+
+            entries, horizon = timeline
+            if before is not None:
+                entries = entries[:bisect_left(entries, before)]
+
+            if len(entries) < limit and horizon is not None:
+                return None
+
+            return [entry[1] for entry in reversed(entries[-limit:])]
+
+    def warm(self, user_id, messages):
+        entries = sorted(_entry(msg) for msg in messages)
+        horizon = None
+        if len(messages) >= self.size:
+            # there may be older messages we didn't load
+            horizon = entries[0][:2]
+            entries = entries[1:]
+
+        with self._lock:
+            self._timelines[user_id] = [entries, horizon]
+
+    def push(self, message):
+        user_ids = {message.user_id}
+        if self._fans_out(message.user_id):
+            user_ids.update(row.followee_id for row in
+                            _follower_ids_query(message.user_id))
+        entry = _entry(message)
+
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                # a timeline warmed since the message was posted has it
+                if timeline is not None and entry not in timeline[0]:
+                    insort(timeline[0], entry)
+                    self._trim(timeline)
+
+    def backfill(self, user_id, followee_id):
+        if user_id not in self._timelines or not self._fans_out(followee_id):
+            return
+
+        messages = _recent_messages([followee_id], self.size)
+
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return
+
+            if len(messages) >= self.size:
+                # followee has older messages we didn't load
+                oldest = _entry(messages[-1])[:2]
+                timeline[1] = max(timeline[1] or (), oldest)
+
+            entries = set(timeline[0])
+            entries.update(_entry(msg) for msg in messages)
+            horizon = timeline[1]
+            timeline[0] = sorted(entry for entry in entries
+                                 if horizon is None or entry[:2] > horizon)
+            self._trim(timeline)
+
+    def prune(self, user_id, followee_id):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is not None:
+                timeline[0] = [entry for entry in timeline[0]
+                               if entry[2] != followee_id]
+
+    def remove_message(self, message):
+        entry = _entry(message)
+
+        with self._lock:
+            for entries, _ in self._timelines.values():
+                if entry in entries:
+                    entries.remove(entry)
+
+    def drop_user(self, user_id):
+        with self._lock:
+            self._timelines.pop(user_id, None)
+            for timeline in self._timelines.values():
+                timeline[0] = [entry for entry in timeline[0]
+                               if entry[2] != user_id]
+
+    def cool(self, user_ids):
+        user_ids = [row[0] for row in user_ids]
+
+        with self._lock:
+            for user_id in user_ids:
+                self._timelines.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._timelines.clear()
+
+
+class Timeline(db.Model):
+    """A warm timeline in the SQL backend."""
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # newest timestamp trimmed off this timeline; NULL if it is complete
+    horizon = db.Column(
+        db.DateTime,
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message id in someone's timeline (SQL backend)."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('timelines.user_id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+db.Index('ix_timeline_entries_user_id_timestamp',
+         TimelineEntry.user_id, TimelineEntry.timestamp.desc())
+
+
+class SQLTimelineStore(TimelineStore):
+    """Timelines kept in the `timelines` / `timeline_entries` tables.
+
+    Writes go through `db.session`; the route (or job) commits them
+    together with the change that caused them. Pushes and backfills can
+    run as jobs after a read has warmed the timeline with the same
+    messages, so they skip entries that are already there.
+    """
+
+    @staticmethod
+    def _insert_entries():
+        """INSERT into `timeline_entries` that skips existing entries."""
+
+        entries = TimelineEntry.__table__
+        if db.session.get_bind().dialect.name == 'postgresql':
+            return (postgresql_insert(entries)
+                    .on_conflict_do_nothing(
+                        index_elements=['user_id', 'message_id']))
+
+        return entries.insert().prefix_with('OR IGNORE')
+
+    def _trim(self, user_ids):
+        """Trim every timeline in `user_ids` (a list or subquery) to size."""
+
+        entries = TimelineEntry.__table__
+        timelines = Timeline.__table__
+
+        nth_newest = (select([entries.c.timestamp])
+                      .where(entries.c.user_id == timelines.c.user_id)
+                      .order_by(entries.c.timestamp.desc(),
+                                entries.c.message_id.desc())
+                      .limit(1)
+                      .offset(self.size))
+
+        db.session.execute(
+            timelines.update()
+            .where(timelines.c.user_id.in_(user_ids))
+            .where(exists(nth_newest))
+            .values(horizon=nth_newest.as_scalar()))
+
+        horizon = (select([timelines.c.horizon])
+                   .where(timelines.c.user_id == entries.c.user_id)
+                   .as_scalar())
+
+        db.session.execute(
+            entries.delete()
+            .where(entries.c.user_id.in_(user_ids))
+            .where(entries.c.timestamp <= horizon))
+
+    def get(self, user_id, limit, before=None):
+        timeline = Timeline.query.get(user_id)
+        if timeline is None:
+            return None
+
+        query = (db.session
+                 .query(TimelineEntry.message_id)
+                 .filter(TimelineEntry.user_id == user_id))
+
+        if before is not None:
+            query = query.filter(
+                tuple_(TimelineEntry.timestamp, TimelineEntry.message_id)
+                < before)
+
+        ids = [row.message_id for row in (
+            query
+            .order_by(TimelineEntry.timestamp.desc(),
+                      TimelineEntry.message_id.desc())
+            .limit(limit))]
+
+        if len(ids) < limit and timeline.horizon is not None:
+            return None
+
+        return ids
+
+    def warm(self, user_id, messages):
+        TimelineEntry.query.filter_by(user_id=user_id).delete()
+        Timeline.query.filter_by(user_id=user_id).delete()
+
+        horizon = None
+        if len(messages) >= self.size:
+            horizon = messages[-1].timestamp
+            messages = [msg for msg in messages if msg.timestamp > horizon]
+
+        db.session.add(Timeline(user_id=user_id, horizon=horizon))
+        db.session.flush()
+        db.session.bulk_insert_mappings(TimelineEntry, [
+            dict(user_id=user_id,
+                 message_id=msg.id,
+                 author_id=msg.user_id,
+                 timestamp=msg.timestamp)
+            for msg in messages
+        ])
+
+    def push(self, message):
+        timelines = Timeline.__table__
+        user_ids = db.session.query(literal(message.user_id))
+        if self._fans_out(message.user_id):
+            user_ids = user_ids.union(_follower_ids_query(message.user_id))
+        user_ids = user_ids.subquery()
+
+        db.session.execute(
+            self._insert_entries().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                select([timelines.c.user_id,
+                        literal(message.id),
+                        literal(message.user_id),
+                        literal(message.timestamp)])
+                .where(timelines.c.user_id.in_(select([user_ids])))))
+
+        self._trim(select([user_ids]))
+
+    def backfill(self, user_id, followee_id):
+        timeline = Timeline.query.get(user_id)
+        if timeline is None or not self._fans_out(followee_id):
+            return
+
+        messages = _recent_messages([followee_id], self.size)
+        if len(messages) >= self.size:
+            oldest = messages[-1].timestamp
+            if timeline.horizon is None or timeline.horizon < oldest:
+                timeline.horizon = oldest
+                (TimelineEntry.query
+                 .filter(TimelineEntry.user_id == user_id,
+                         TimelineEntry.timestamp <= oldest)
+                 .delete(synchronize_session=False))
+
+        rows = [dict(user_id=user_id,
+                     message_id=msg.id,
+                     author_id=msg.user_id,
+                     timestamp=msg.timestamp)
+                for msg in messages
+                if timeline.horizon is None or msg.timestamp > timeline.horizon]
+        if rows:
+            db.session.execute(self._insert_entries(), rows)
+        db.session.flush()
+        self._trim([user_id])
+
+    def prune(self, user_id, followee_id):
+        (TimelineEntry.query
+         .filter_by(user_id=user_id, author_id=followee_id)
+         .delete(synchronize_session=False))
+
+    def remove_message(self, message):
+        (TimelineEntry.query
+         .filter_by(message_id=message.id)
+         .delete(synchronize_session=False))
+
+    def drop_user(self, user_id):
+        (TimelineEntry.query
+         .filter(or_(TimelineEntry.user_id == user_id,
+                     TimelineEntry.author_id == user_id))
+         .delete(synchronize_session=False))
+        Timeline.query.filter_by(user_id=user_id).delete()
+
+    def cool(self, user_ids):
+        user_ids = user_ids.subquery()
+        for model in (TimelineEntry, Timeline):
+            (model.query
+             .filter(model.user_id.in_(select([user_ids])))
+             .delete(synchronize_session=False))
+
+    def clear(self):
+        TimelineEntry.query.delete(synchronize_session=False)
+        Timeline.query.delete(synchronize_session=False)
+
+
+BACKENDS = {
+    'memory': MemoryTimelineStore,
+    'sql': SQLTimelineStore,
+}
+
+
+def create_timeline_store(app):
+    """Build the timeline backend named by `TIMELINE_BACKEND`."""
+
+    backend = BACKENDS[app.config.get('TIMELINE_BACKEND', 'sql')]
+    return backend(
+        size=app.config.get('TIMELINE_SIZE', 100),
+        celebrity_threshold=app.config.get('TIMELINE_CELEBRITY_THRESHOLD'),
+    )